@@ -0,0 +1,264 @@
+"""Writes a delta rebuilding a makeself archive from its previous version.
+
+Both archives are cut into parts, their header and every payload segment, or the whole file if it
+isn't a makeself archive. Parts of the new archive found byte for byte in the previous one are
+copied from it. Others are patched with `zstd --patch-from`, chunk by chunk, against the same
+region of the part at the same position in the previous archive, or stored as they are when that
+doesn't pay off. Layered archives thus only ship the packages which changed.
+
+The delta is a shell script with the patches appended, run as
+`sh <delta> PREVIOUS_ARCHIVE [OUTPUT]` on the target host: it verifies the SHA256 of the previous
+archive, rebuilds the new one and verifies its SHA256 before moving it in place. Run as
+`python -m pants_backend_makeself.delta`, it prints a JSON report and only depends on the standard
+library and the `zstd` binary.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from pants_backend_makeself.reader import parse_header
+
+_CHUNK_SIZE = 1024 * 1024
+# Changed parts are patched in chunks of this size, each against the previous part around the same
+# offset, from a chunk before to a chunk after. `zstd --patch-from` can't handle a previous version
+# over 2 GiB, and needs about twice the memory of the previous version and chunk it is given.
+PATCH_CHUNK_SIZE = 256 * 1024 * 1024
+
+_SCRIPT = """\
+#!/bin/sh
+# This script was generated by pants-backend-makeself. It rebuilds {archive} from the previous
+# version of the archive and the parts appended to this script, then verifies it.
+archive={archive}
+basesha={basesha}
+sha={sha}
+parts={parts}
+skip={skip}
+delta="$0"
+if test $# -lt 1 || test $# -gt 2 || test ! -f "$1"; then
+    echo "Usage: sh $delta PREVIOUS_ARCHIVE [OUTPUT]" >&2
+    exit 1
+fi
+base="$1"
+output="${{2:-`dirname "$delta"`/$archive}}"
+sha256() {{
+    if command -v sha256sum >/dev/null 2>&1; then
+        sha256sum < "$1" | cut -b-64
+    elif command -v shasum >/dev/null 2>&1; then
+        shasum -a 256 < "$1" | cut -b-64
+    else
+        echo "Cannot verify the archives: neither sha256sum nor shasum is available" >&2
+    fi
+}}
+range() {{
+    tail -c +`expr "$2" + 1` "$1" | head -c "$3"
+}}
+actual=`sha256 "$base"`
+if test x"$actual" != x"$basesha"; then
+    echo "Error: $base is not the archive this delta applies to." >&2
+    echo "Its SHA256 $actual is different from $basesha" >&2
+    exit 2
+fi
+offset=`head -n "$skip" "$delta" | wc -c | tr -d " "`
+rebuilt="$output.delta.$$"
+: > "$rebuilt" || exit 1
+# `copy:OFFSET:SIZE` parts come from the previous archive, `data:OFFSET:SIZE` parts from this
+# script and `patch:OFFSET:SIZE:PATCH_OFFSET:PATCH_SIZE` parts are zstd patches in this script
+# against a range of the previous archive.
+for part in $parts; do
+    IFS=: read kind a b c d <<EOF
+$part
+EOF
+    case "$kind" in
+    copy) range "$base" "$a" "$b" >> "$rebuilt" ;;
+    data) range "$delta" `expr $offset + "$a"` "$b" >> "$rebuilt" ;;
+    patch)
+        range "$base" "$a" "$b" > "$rebuilt.base" &&
+            range "$delta" `expr $offset + "$c"` "$d" |
+            zstd -dcq --patch-from="$rebuilt.base" >> "$rebuilt" ;;
+    esac
+    if test $? -ne 0; then
+        echo "Cannot rebuild $archive" >&2
+        rm -f "$rebuilt" "$rebuilt.base"
+        exit 1
+    fi
+done
+rm -f "$rebuilt.base"
+actual=`sha256 "$rebuilt"`
+if test x"$actual" != x"$sha"; then
+    echo "Error in SHA256 checksums of the rebuilt $archive: $actual is different from $sha" >&2
+    rm -f "$rebuilt"
+    exit 2
+fi
+chmod 755 "$rebuilt" && mv -f "$rebuilt" "$output" || exit 1
+echo "Rebuilt $output"
+exit 0
+"""
+
+
+@dataclass(frozen=True)
+class Part:
+    offset: int
+    size: int
+    sha256: str
+
+
+@dataclass
+class DeltaReport:
+    archive_bytes: int = 0
+    delta_bytes: int = 0
+    copied_bytes: int = 0
+    patched_bytes: int = 0
+    stored_bytes: int = 0
+    basesha: str = ""
+
+
+def _sha256(fp: BinaryIO, offset: int, size: int) -> str:
+    sha256 = hashlib.sha256()
+    fp.seek(offset)
+    while size:
+        chunk = fp.read(min(size, _CHUNK_SIZE))
+        if not chunk:
+            break
+        sha256.update(chunk)
+        size -= len(chunk)
+    return sha256.hexdigest()
+
+
+def _copy_range(fp: BinaryIO, offset: int, size: int, sink: BinaryIO) -> None:
+    fp.seek(offset)
+    while size:
+        chunk = fp.read(min(size, _CHUNK_SIZE))
+        if not chunk:
+            break
+        sink.write(chunk)
+        size -= len(chunk)
+
+
+def archive_parts(fp: BinaryIO) -> List[Part]:
+    """The header and every payload segment of a makeself archive, or the whole file otherwise."""
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell()
+    fp.seek(0)
+    try:
+        layout = parse_header(fp)
+        ranges = [(0, layout.offset), *layout.segments()]
+    except ValueError:
+        ranges = []
+    if sum(part_size for _, part_size in ranges) != size:
+        ranges = [(0, size)]
+    return [Part(offset, part_size, _sha256(fp, offset, part_size)) for offset, part_size in ranges]
+
+
+def _patch(
+    base: BinaryIO,
+    base_range: Tuple[int, int],
+    new: BinaryIO,
+    new_range: Tuple[int, int],
+    level: Optional[int],
+    tmp: str,
+) -> bytes:
+    base_path = os.path.join(tmp, "base")
+    new_path = os.path.join(tmp, "new")
+    with open(base_path, "wb") as sink:
+        _copy_range(base, *base_range, sink)
+    with open(new_path, "wb") as sink:
+        _copy_range(new, *new_range, sink)
+    argv = ["zstd", "-q", "-c", f"--patch-from={base_path}", new_path]
+    if level is not None:
+        argv.insert(1, f"-{level}")
+        if level > 19:
+            argv.insert(1, "--ultra")
+    return subprocess.run(argv, stdout=subprocess.PIPE, check=True).stdout
+
+
+def write_delta(
+    base_path: str, archive_path: str, output: str, level: Optional[int] = None
+) -> DeltaReport:
+    """Write the delta rebuilding `archive_path` from `base_path` to `output`."""
+    report = DeltaReport()
+    parts: List[str] = []
+    output_dir = os.path.dirname(os.path.abspath(output))
+    with open(base_path, "rb") as base, open(archive_path, "rb") as new:
+        with tempfile.TemporaryFile(dir=output_dir) as payload:
+            with tempfile.TemporaryDirectory(dir=output_dir) as tmp:
+                base_parts = archive_parts(base)
+                report.basesha = _sha256(base, 0, sum(part.size for part in base_parts))
+                by_sha: Dict[str, Part] = {part.sha256: part for part in reversed(base_parts)}
+                new_parts = archive_parts(new)
+                sha = _sha256(new, 0, sum(part.size for part in new_parts))
+                for index, part in enumerate(new_parts):
+                    report.archive_bytes += part.size
+                    if part.sha256 in by_sha:
+                        same = by_sha[part.sha256]
+                        parts.append(f"copy:{same.offset}:{same.size}")
+                        report.copied_bytes += part.size
+                        continue
+                    base_part = base_parts[index] if index < len(base_parts) else None
+                    for start in range(0, part.size, PATCH_CHUNK_SIZE):
+                        size = min(PATCH_CHUNK_SIZE, part.size - start)
+                        if base_part and base_part.size:
+                            window_end = min(start + 2 * PATCH_CHUNK_SIZE, base_part.size)
+                            window_start = max(0, window_end - 3 * PATCH_CHUNK_SIZE)
+                            window = (base_part.offset + window_start, window_end - window_start)
+                            patch = _patch(
+                                base, window, new, (part.offset + start, size), level, tmp
+                            )
+                            if len(patch) < size:
+                                parts.append(
+                                    f"patch:{window[0]}:{window[1]}:{payload.tell()}:{len(patch)}"
+                                )
+                                payload.write(patch)
+                                report.patched_bytes += size
+                                continue
+                        parts.append(f"data:{payload.tell()}:{size}")
+                        _copy_range(new, part.offset + start, size, payload)
+                        report.stored_bytes += size
+
+            script = _SCRIPT.format(
+                archive=shlex.quote(os.path.basename(archive_path)),
+                basesha=report.basesha,
+                sha=sha,
+                parts=shlex.quote(" ".join(parts)),
+                skip=_SCRIPT.count("\n"),
+            )
+            payload.seek(0)
+            with open(output, "wb") as sink:
+                sink.write(script.encode())
+                shutil.copyfileobj(payload, sink, _CHUNK_SIZE)
+                report.delta_bytes = sink.tell()
+    os.chmod(output, 0o755)
+    return report
+
+
+def delta_name(archive: str, basesha: str) -> str:
+    return f"{archive}.from-{basesha[:12]}.delta"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base", required=True, help="The previous version of the archive.")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--level", type=int, default=None)
+    parser.add_argument("archive")
+    options = parser.parse_args(argv)
+
+    os.makedirs(options.output_dir, exist_ok=True)
+    staging = os.path.join(options.output_dir, ".delta")
+    report = write_delta(options.base, options.archive, staging, options.level)
+    output = os.path.join(
+        options.output_dir, delta_name(os.path.basename(options.archive), report.basesha)
+    )
+    os.replace(staging, output)
+    json.dump({"path": output, **report.__dict__}, sys.stdout)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,129 @@
+import hashlib
+import io
+import os
+import subprocess
+import tarfile
+from pathlib import Path
+from typing import Dict
+
+import pytest
+from pants_backend_makeself.delta import delta_name, main, write_delta
+from pants_backend_makeself.header import Segment, compress_command, render_header
+
+
+def _segment(files: Dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mode = 0o755
+            tar.addfile(info, io.BytesIO(content))
+    return subprocess.run(
+        compress_command("zstd"), input=buffer.getvalue(), stdout=subprocess.PIPE, check=True
+    ).stdout
+
+
+def _write_archive(path: Path, data: bytes, version: str) -> None:
+    payloads = [
+        _segment({"run.sh": b"#!/bin/sh\ncat version\nwc -c < data.bin\n"}),
+        _segment({"data.bin": data}),
+        _segment({"version": f"{version}\n".encode()}),
+    ]
+    header = render_header(
+        label=f"test archive {version}",
+        script="./run.sh",
+        scriptargs="",
+        segments=[
+            Segment(size=len(payload), sha256=hashlib.sha256(payload).hexdigest())
+            for payload in payloads
+        ],
+        compression="zstd",
+    )
+    path.write_bytes(header + b"".join(payloads))
+    path.chmod(0o755)
+
+
+def _apply(delta: Path, *args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        ["/bin/sh", str(delta), *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=delta.parent,
+        check=False,
+    )
+
+
+def test_delta_rebuilds_archive(tmp_path: Path) -> None:
+    data = os.urandom(256 * 1024)
+    base = tmp_path / "old" / "test.run"
+    base.parent.mkdir()
+    _write_archive(base, data, "1.0")
+    archive = tmp_path / "test.run"
+    _write_archive(archive, data, "1.1")
+    delta = tmp_path / "test.run.delta"
+
+    report = write_delta(str(base), str(archive), str(delta))
+
+    assert report.basesha == hashlib.sha256(base.read_bytes()).hexdigest()
+    assert report.archive_bytes == archive.stat().st_size
+    assert report.copied_bytes > 256 * 1024
+    assert report.copied_bytes + report.patched_bytes == report.archive_bytes
+    assert report.delta_bytes == delta.stat().st_size < 8192
+
+    output = tmp_path / "rebuilt" / "test.run"
+    output.parent.mkdir()
+    result = _apply(delta, str(base), str(output))
+    assert result.returncode == 0, result.stderr
+    assert output.read_bytes() == archive.read_bytes()
+    assert os.access(output, os.X_OK)
+    assert [path.name for path in output.parent.iterdir()] == ["test.run"]
+
+    run = subprocess.run(
+        [str(output), "--quiet", "--nox11", "--accept"],
+        stdout=subprocess.PIPE,
+        cwd=tmp_path,
+        env={**os.environ, "TMPDIR": str(tmp_path)},
+        check=False,
+    )
+    assert run.stdout.split() == [b"1.1", b"262144"]
+
+
+def test_delta_patches_other_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("pants_backend_makeself.delta.PATCH_CHUNK_SIZE", 64 * 1024)
+    data = bytearray(os.urandom(512 * 1024))
+    base = tmp_path / "old.bin"
+    base.write_bytes(data)
+    data[1000:1010] = b"0123456789"
+    data[300 * 1024 : 300 * 1024] = os.urandom(1000)
+    archive = tmp_path / "new.bin"
+    archive.write_bytes(data)
+
+    main(["--base", str(base), "--output-dir", str(tmp_path / "dist"), str(archive)])
+
+    delta = tmp_path / "dist" / delta_name("new.bin", hashlib.sha256(base.read_bytes()).hexdigest())
+    assert delta.stat().st_size < 8192
+    result = _apply(delta, str(base))
+    assert result.returncode == 0, result.stderr
+    assert (tmp_path / "dist" / "new.bin").read_bytes() == archive.read_bytes()
+
+
+@pytest.mark.parametrize("corrupt", ["base", "delta"])
+def test_delta_verifies_archives(tmp_path: Path, corrupt: str) -> None:
+    data = os.urandom(64 * 1024)
+    base = tmp_path / "old.run"
+    _write_archive(base, data, "1.0")
+    archive = tmp_path / "test.run"
+    _write_archive(archive, os.urandom(64 * 1024), "1.1")
+    delta = tmp_path / "test.run.delta"
+    write_delta(str(base), str(archive), str(delta))
+    corrupted = base if corrupt == "base" else delta
+    content = bytearray(corrupted.read_bytes())
+    content[-1] ^= 0xFF
+    corrupted.write_bytes(bytes(content))
+
+    output = tmp_path / "rebuilt.run"
+    result = _apply(delta, str(base), str(output))
+    assert result.returncode != 0
+    assert b"SHA256" in result.stderr or b"Cannot rebuild" in result.stderr
+    assert not list(tmp_path.glob("rebuilt.run*"))
@@ -0,0 +1,229 @@
+import json
+from collections import defaultdict
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, DefaultDict, Dict, Iterator, List, Sequence, Set, Tuple
+
+from pants.core.goals.package import BuiltPackage, EnvironmentAwarePackageRequest
+from pants.core.util_rules.system_binaries import BinaryShims, BinaryShimsRequest
+from pants.engine.addresses import Address
+from pants.engine.console import Console
+from pants.engine.fs import Digest, DigestEntries, FileEntry
+from pants.engine.goal import Goal, GoalSubsystem, Outputting
+from pants.engine.process import Process, ProcessResult
+from pants.engine.rules import Get, MultiGet, collect_rules, goal_rule, rule
+from pants.engine.target import Targets
+from pants.option.option_types import EnumOption, IntOption
+from pants.util.logging import LogLevel
+from pants.util.strutil import softwrap
+from pants_backend_makeself import reader
+from pants_backend_makeself.goals.package import (
+    BuiltMakeselfArchiveArtifact,
+    MakeselfArchiveFieldSet,
+    MakeselfArchiveInputs,
+)
+from pants_backend_makeself.makeself import DECOMPRESSION_BINARIES, MakeselfPythonModules
+from pants_backend_makeself.system_binaries import MakeselfBinaries
+
+# Decompressors the reader replaces with the standard library.
+_STDLIB_DECOMPRESSORS = ("gzip", "bzip2", "xz")
+
+
+class InspectOutputFormat(Enum):
+    TABLE = "table"
+    JSON = "json"
+
+
+class MakeselfInspectSubsystem(Outputting, GoalSubsystem):
+    name = "makeself-inspect"
+    help = softwrap(
+        """
+        Show what takes up the space in `makeself_archive` targets: the compressed and
+        uncompressed size of every package and top-level directory, and the largest files.
+        """
+    )
+
+    output_format = EnumOption(
+        "--output-format",
+        default=InspectOutputFormat.TABLE,
+        help="Print a table per archive, or a JSON document keyed by archive address.",
+    )
+    largest_files = IntOption(
+        "--largest-files",
+        default=10,
+        help="How many of the largest files to list per archive.",
+    )
+
+
+class MakeselfInspect(Goal):
+    subsystem_cls = MakeselfInspectSubsystem
+    environment_behavior = Goal.EnvironmentBehavior.LOCAL_ONLY
+
+
+@dataclass(frozen=True)
+class InspectMakeselfArchive:
+    field_set: MakeselfArchiveFieldSet
+    largest_files: int
+
+
+@dataclass(frozen=True)
+class MakeselfArchiveReport:
+    address: Address
+    relpath: str
+    # The JSON report printed by `pants_backend_makeself.reader`.
+    content: str
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"archive": self.relpath, **json.loads(self.content)}
+
+
+def _prefixes(path: str) -> Iterator[str]:
+    parts = path.split("/")
+    return ("/".join(parts[:index]) for index in range(1, len(parts) + 1))
+
+
+def package_groups(
+    packages: Sequence[Tuple[str, DigestEntries]], others: Sequence[DigestEntries]
+) -> List[Tuple[str, str]]:
+    """`(name, path)` groups accounting for the files of each of the named `packages`.
+
+    A file is grouped under the shortest of its parent directories, or itself, which the other
+    packages and `others` have no files in. PEXes unpacked into loose PEXes and nested archives
+    flattened into the archive thus each make up a single group.
+    """
+    paths_per_digest = [
+        [entry.path for entry in entries if isinstance(entry, FileEntry)]
+        for entries in (*(entries for _, entries in packages), *others)
+    ]
+    owners: DefaultDict[str, Set[int]] = defaultdict(set)
+    for index, paths in enumerate(paths_per_digest):
+        for path in paths:
+            for prefix in _prefixes(path):
+                owners[prefix].add(index)
+    groups: Dict[str, str] = {}
+    for index, (name, _) in enumerate(packages):
+        for path in paths_per_digest[index]:
+            owned = next((prefix for prefix in _prefixes(path) if owners[prefix] == {index}), None)
+            if owned is not None:
+                groups.setdefault(owned, name)
+    return sorted((name, prefix) for prefix, name in groups.items())
+
+
+@rule(desc="Inspect makeself archive", level=LogLevel.DEBUG)
+async def inspect_makeself_archive(
+    request: InspectMakeselfArchive,
+    binaries: MakeselfBinaries,
+    modules: MakeselfPythonModules,
+) -> MakeselfArchiveReport:
+    field_set = request.field_set
+    # The archive is grouped by the inputs its package rule built it from, which are cached.
+    package, inputs = await MultiGet(
+        Get(BuiltPackage, EnvironmentAwarePackageRequest(field_set)),
+        Get(MakeselfArchiveInputs, MakeselfArchiveFieldSet, field_set),
+    )
+    artifact = package.artifacts[0]
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact), artifact
+    assert artifact.relpath is not None, artifact
+
+    # `inputs.digests` are the startup script, the packages and the files.
+    entries = await MultiGet(Get(DigestEntries, Digest, digest) for digest in inputs.digests)
+    packages = len(inputs.package_digests)
+    groups = package_groups(
+        list(
+            zip((address.spec for address in inputs.package_addresses), entries[1 : 1 + packages])
+        ),
+        (entries[0], *entries[1 + packages :]),
+    )
+
+    rationale = "inspect makeself archive"
+    decompressor = artifact.compression and DECOMPRESSION_BINARIES.get(artifact.compression)
+    python, *paths = binaries.require(
+        "python3",
+        *((decompressor,) if decompressor not in (None, *_STDLIB_DECOMPRESSORS) else ()),
+        rationale=rationale,
+    )
+    shims = await Get(BinaryShims, BinaryShimsRequest(paths=tuple(paths), rationale=rationale))
+
+    result = await Get(
+        ProcessResult,
+        Process(
+            argv=(
+                python.path,
+                "-m",
+                reader.__name__,
+                "--largest",
+                str(request.largest_files),
+                *(f"--group={name}={path}" for name, path in groups),
+                *(artifact.volumes or (artifact.relpath,)),
+            ),
+            input_digest=package.digest,
+            immutable_input_digests={
+                modules.path: modules.digest,
+                **shims.immutable_input_digests,
+            },
+            env={"PATH": shims.path_component, "PYTHONPATH": modules.path},
+            description=f"Inspect {artifact.relpath}",
+            level=LogLevel.DEBUG,
+        ),
+    )
+    return MakeselfArchiveReport(
+        address=field_set.address, relpath=artifact.relpath, content=result.stdout.decode()
+    )
+
+
+def _format_bytes(size: int) -> str:
+    if size < 1024:
+        return f"{size} B"
+    scaled = size / 1024
+    for unit in ("KiB", "MiB"):
+        if scaled < 1024:
+            return f"{scaled:.1f} {unit}"
+        scaled /= 1024
+    return f"{scaled:.1f} GiB"
+
+
+def format_report(address: str, report: Dict[str, Any]) -> str:
+    uncompressed = _format_bytes(report["uncompressed_bytes"])
+    compressed = _format_bytes(report["compressed_bytes"])
+    summary = f"{report['compression']}, {report['files']} files, {uncompressed} -> {compressed}"
+    lines = [
+        f"{address}: {report['archive']} ({summary})",
+        f"  {'Compressed':>12}  {'Uncompressed':>12}  {'Files':>7}  Entry",
+    ]
+    lines.extend(
+        f"  {_format_bytes(entry['compressed_bytes']):>12}  "
+        f"{_format_bytes(entry['uncompressed_bytes']):>12}  {entry['files']:>7}  {entry['name']}"
+        for entry in report["entries"]
+    )
+    if report["largest_files"]:
+        lines.append("  Largest files:")
+        lines.extend(
+            f"  {_format_bytes(largest['bytes']):>12}  {largest['path']}"
+            for largest in report["largest_files"]
+        )
+    return "\n".join(lines) + "\n"
+
+
+@goal_rule
+async def makeself_inspect(
+    console: Console, subsystem: MakeselfInspectSubsystem, targets: Targets
+) -> MakeselfInspect:
+    reports = await MultiGet(
+        Get(
+            MakeselfArchiveReport,
+            InspectMakeselfArchive(MakeselfArchiveFieldSet.create(target), subsystem.largest_files),
+        )
+        for target in targets
+        if MakeselfArchiveFieldSet.is_applicable(target)
+    )
+    documents = {report.address.spec: report.to_json() for report in reports}
+    with subsystem.output(console) as write_stdout:
+        if subsystem.output_format == InspectOutputFormat.JSON:
+            write_stdout(json.dumps(documents, indent=2, sort_keys=True) + "\n")
+        else:
+            write_stdout("\n".join(format_report(*item) for item in documents.items()))
+    return MakeselfInspect(exit_code=0)
+
+
+def rules():
+    return collect_rules()
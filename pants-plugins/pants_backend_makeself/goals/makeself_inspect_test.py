@@ -0,0 +1,65 @@
+import json
+from textwrap import dedent
+
+from pants.core.target_types import FilesGeneratorTarget
+from pants.testutil.rule_runner import PYTHON_BOOTSTRAP_ENV, RuleRunner
+from pants_backend_makeself import makeself, system_binaries
+from pants_backend_makeself.goals import makeself_inspect, package, run
+from pants_backend_makeself.goals.makeself_inspect import MakeselfInspect
+from pants_backend_makeself.target_types import MakeselfArchiveTarget
+
+
+def test_makeself_inspect_groups_nested_archives() -> None:
+    rule_runner = RuleRunner(
+        target_types=[MakeselfArchiveTarget, FilesGeneratorTarget],
+        rules=[
+            *makeself.rules(),
+            *makeself_inspect.rules(),
+            *package.rules(),
+            *run.rules(),
+            *system_binaries.rules(),
+        ],
+    )
+    rule_runner.set_options(args=[], env_inherit=PYTHON_BOOTSTRAP_ENV)
+    rule_runner.write_files(
+        {
+            "src/inner/BUILD": dedent(
+                """\
+                files(name="data", sources=["data.txt"])
+
+                makeself_archive(name="inner", startup_script="run.sh", files=[":data"])
+                """
+            ),
+            "src/inner/run.sh": "cat src/inner/data.txt",
+            "src/inner/data.txt": "inner data",
+            "src/outer/BUILD": dedent(
+                """\
+                files(name="data", sources=["data.txt"])
+
+                makeself_archive(
+                    name="outer",
+                    startup_script="run.sh",
+                    packages=["src/inner:inner"],
+                    files=[":data"],
+                )
+                """
+            ),
+            "src/outer/run.sh": "./src.inner/inner.run",
+            "src/outer/data.txt": "outer data",
+        }
+    )
+    rule_runner.chmod("src/inner/run.sh", 0o777)
+    rule_runner.chmod("src/outer/run.sh", 0o777)
+
+    result = rule_runner.run_goal_rule(
+        MakeselfInspect, args=["--output-format=json", "src/outer:outer"]
+    )
+
+    assert result.exit_code == 0
+    report = json.loads(result.stdout)["src/outer:outer"]
+    assert report["archive"] == "src.outer/outer.run"
+    assert report["files"] == 5
+    entries = {entry["name"]: entry for entry in report["entries"]}
+    # The flattened archive, its launcher included, is accounted for as the nested target.
+    assert entries["src/inner:inner"]["files"] == 3
+    assert entries["src"]["files"] == 2
@@ -1,6 +1,12 @@
+import dataclasses
+import hashlib
+import json
 import logging
+import os
+import shlex
 from dataclasses import dataclass
 from pathlib import PurePath
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 from pants.core.goals import package
 from pants.core.goals.package import (
@@ -14,27 +20,85 @@ from pants.core.goals.run import RunFieldSet, RunInSandboxBehavior
 from pants.core.target_types import FileSourceField
 from pants.core.util_rules import source_files
 from pants.core.util_rules.source_files import SourceFiles, SourceFilesRequest
-from pants.engine.addresses import UnparsedAddressInputs
-from pants.engine.fs import Digest, MergeDigests
+from pants.engine.addresses import Address, UnparsedAddressInputs
+from pants.engine.engine_aware import EngineAwareReturnType
+from pants.engine.env_vars import EnvironmentVars, EnvironmentVarsRequest
+from pants.engine.fs import (
+    EMPTY_DIGEST,
+    CreateDigest,
+    Digest,
+    DigestEntries,
+    DigestSubset,
+    FileContent,
+    FileEntry,
+    GlobMatchErrorBehavior,
+    MergeDigests,
+    PathGlobs,
+    RemovePrefix,
+)
 from pants.engine.internals.native_engine import AddPrefix, Snapshot
-from pants.engine.process import ProcessResult
-from pants.engine.rules import Get, MultiGet, collect_rules, rule
+from pants.engine.process import Process, ProcessResult
+from pants.engine.rules import Get, MultiGet, collect_rules, rule, rule_helper
 from pants.engine.target import (
     FieldSetsPerTarget,
     FieldSetsPerTargetRequest,
     HydratedSources,
     HydrateSourcesRequest,
+    InvalidFieldException,
     SourcesField,
     Targets,
 )
 from pants.engine.unions import UnionRule
+from pants.util.frozendict import FrozenDict
 from pants.util.logging import LogLevel
-from pants_backend_makeself.makeself import CreateMakeselfArchive
+from pants_backend_makeself.makeself import (
+    AutoCompression,
+    CompressMakeselfSegment,
+    CreateLayeredMakeselfArchive,
+    CreateMakeselfArchive,
+    CreateMakeselfArchiveVariants,
+    CreateMakeselfDelta,
+    MakeselfArchive,
+    MakeselfSegment,
+    MakeselfSubsystem,
+    MakeselfZstdDictionary,
+    PackagingStats,
+    SampleMakeselfPayload,
+    SplitMakeselfArchives,
+    TrainZstdDictionary,
+    UnpackPexes,
+    choose_compression,
+    entries_size,
+    find_duplicates,
+    zstd_dictionary_id,
+)
 from pants_backend_makeself.target_types import (
+    MakeselfArchiveCompressionField,
+    MakeselfArchiveCompressionLevelField,
+    MakeselfArchiveDeduplicateField,
+    MakeselfArchiveDeltaFromField,
+    MakeselfArchiveEngineField,
+    MakeselfArchiveExcludeField,
     MakeselfArchiveFilesField,
+    MakeselfArchiveIncludeField,
+    MakeselfArchiveInstallDirField,
+    MakeselfArchiveIntegrityField,
+    MakeselfArchiveLayeredField,
+    MakeselfArchiveMaxVolumeSizeField,
     MakeselfArchivePackagesField,
+    MakeselfArchiveParallelDecompressionField,
+    MakeselfArchivePexLayoutField,
     MakeselfArchiveStartupScript,
+    MakeselfArchiveVariantsField,
+    MakeselfArchiveZstdDictionaryField,
     MakeselfArthiveLabel,
+    MakeselfCompression,
+    MakeselfEngine,
+    MakeselfIntegrity,
+    MakeselfPexLayout,
+    MakeselfZstdDictionaryArchivesField,
+    MakeselfZstdDictionaryMaxSizeField,
+    MakeselfZstdDictionaryTarget,
 )
 
 logger = logging.getLogger(__name__)
@@ -42,11 +106,38 @@ logger = logging.getLogger(__name__)
 
 @dataclass(frozen=True)
 class BuiltMakeselfArchiveArtifact(BuiltPackageArtifact):
+    compression: Optional[MakeselfCompression] = None
+    integrity: Optional[MakeselfIntegrity] = None
+    # The command run after extraction, relative to the extraction directory.
+    startup_script: Optional[str] = None
+    scriptargs: Tuple[str, ...] = ()
+    # The volumes joined by the artifact, which is a script when the archive is split.
+    volumes: Tuple[str, ...] = ()
+
     @classmethod
-    def create(cls, relpath: str) -> "BuiltMakeselfArchiveArtifact":
+    def create(
+        cls,
+        relpath: str,
+        compression: MakeselfCompression,
+        integrity: MakeselfIntegrity,
+        startup_script: str,
+        stats: PackagingStats,
+        scriptargs: Tuple[str, ...] = (),
+        volumes: Tuple[str, ...] = (),
+        notes: Tuple[str, ...] = (),
+    ) -> "BuiltMakeselfArchiveArtifact":
         return cls(
             relpath=relpath,
-            extra_log_lines=(f"Built Makeself binary: {relpath}",),
+            extra_log_lines=(
+                f"Built Makeself binary: {relpath}",
+                f"  {stats.summary()}",
+                *(f"  {note}" for note in notes),
+            ),
+            compression=compression,
+            integrity=integrity,
+            startup_script=startup_script,
+            scriptargs=scriptargs,
+            volumes=volumes,
         )
 
 
@@ -59,15 +150,137 @@ class MakeselfArchiveFieldSet(PackageFieldSet, RunFieldSet):
     label: MakeselfArthiveLabel
     files: MakeselfArchiveFilesField
     packages: MakeselfArchivePackagesField
+    pex_layout: MakeselfArchivePexLayoutField
+    include: MakeselfArchiveIncludeField
+    exclude: MakeselfArchiveExcludeField
+    compression: MakeselfArchiveCompressionField
+    compression_level: MakeselfArchiveCompressionLevelField
+    layered: MakeselfArchiveLayeredField
+    parallel_decompression: MakeselfArchiveParallelDecompressionField
+    install_dir: MakeselfArchiveInstallDirField
+    deduplicate: MakeselfArchiveDeduplicateField
+    zstd_dictionary: MakeselfArchiveZstdDictionaryField
+    engine: MakeselfArchiveEngineField
+    integrity: MakeselfArchiveIntegrityField
+    variants: MakeselfArchiveVariantsField
+    max_volume_size: MakeselfArchiveMaxVolumeSizeField
+    delta_from: MakeselfArchiveDeltaFromField
     output_path: OutputPathField
 
 
-@rule
-async def package_makeself_binary(
-    field_set: MakeselfArchiveFieldSet,
-) -> BuiltPackage:
-    archive_dir = "__archive"
+@dataclass(frozen=True)
+class MakeselfArchiveInputs(EngineAwareReturnType):
+    """Everything that goes into an archive, built and hydrated."""
+
+    startup_script: str
+    startup_script_digest: Digest
+    package_digests: Tuple[Digest, ...]
+    # The target each of `package_digests` was built from.
+    package_addresses: Tuple[Address, ...]
+    file_digests: Tuple[Digest, ...]
+    packages: PackagingStats
+    files: PackagingStats
+    # The files of `packages` and `files` left out by the `include` and `exclude` fields.
+    excluded_bytes: int = 0
+    excluded_files: int = 0
+
+    @property
+    def digests(self) -> Tuple[Digest, ...]:
+        return (self.startup_script_digest, *self.package_digests, *self.file_digests)
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            **self.packages.metadata("packages_"),
+            **self.files.metadata("files_"),
+            "excluded_bytes": self.excluded_bytes,
+            "excluded_files": self.excluded_files,
+        }
+
+
+# Stands in for a makeself archive flattened into the directory next to it. Like the archive, it
+# skips the makeself options before its arguments and runs the startup script from the root of
+# the payload.
+_FLATTENED_LAUNCHER = """\
+#!/bin/sh
+# This script was generated by pants-backend-makeself. It runs a makeself archive flattened into
+# the directory next to it.
+while true; do
+    case "$1" in
+    --quiet | -q | --accept | --noprogress | --nox11 | --nochown | --chown | --keep | --nocheck \\
+    | --nodiskspace | --verbose | --confirm | --keep-umask | --noexec-cleanup)
+        shift
+        ;;
+    --target | --threads | --cleanup-args)
+        shift 2 || exit 1
+        ;;
+    --noexec)
+        exit 0
+        ;;
+    --)
+        shift
+        break
+        ;;
+    *)
+        break
+        ;;
+    esac
+done
+cd "`dirname "$0"`"/{directory} || exit 1
+exec {command} "$@"
+"""
+
+
+@dataclass(frozen=True)
+class FlattenedMakeselfArchive:
+    """The inputs of a nested archive under a directory, next to launchers standing in for it."""
+
+    digest: Digest
+
+
+@rule_helper
+async def _loose_pexes(packages: Tuple[BuiltPackage, ...], address: Address) -> Tuple[Digest, ...]:
+    """The digests of `packages`, with their zipapp PEXes unpacked into loose PEXes."""
+    pexes_dir = "__pexes"
+    pexes = [
+        tuple(
+            artifact.relpath
+            for artifact in package.artifacts
+            if artifact.relpath and artifact.relpath.endswith(".pex")
+        )
+        for package in packages
+    ]
+    with_pexes = [(package, paths) for package, paths in zip(packages, pexes) if paths]
+    prefixed = await MultiGet(
+        Get(Digest, AddPrefix(package.digest, pexes_dir)) for package, _ in with_pexes
+    )
+    processes = await MultiGet(
+        Get(
+            Process,
+            UnpackPexes(
+                pexes=paths,
+                input_digest=digest,
+                output_dir=pexes_dir,
+                description=f"Unpacking PEXes for makeself archive: {address}",
+                level=LogLevel.DEBUG,
+            ),
+        )
+        for (_, paths), digest in zip(with_pexes, prefixed)
+    )
+    results = await MultiGet(Get(ProcessResult, Process, process) for process in processes)
+    unpacked = iter(
+        await MultiGet(
+            Get(Digest, RemovePrefix(result.output_digest, pexes_dir)) for result in results
+        )
+    )
+    return tuple(
+        next(unpacked) if paths else package.digest for package, paths in zip(packages, pexes)
+    )
+
 
+@rule(desc="Build makeself archive inputs", level=LogLevel.DEBUG)
+async def build_makeself_archive_inputs(
+    field_set: MakeselfArchiveFieldSet,
+) -> MakeselfArchiveInputs:
     package_targets, file_targets = await MultiGet(
         Get(Targets, UnparsedAddressInputs, field_set.packages.to_unparsed_address_inputs()),
         Get(Targets, UnparsedAddressInputs, field_set.files.to_unparsed_address_inputs()),
@@ -76,9 +289,20 @@ async def package_makeself_binary(
     package_field_sets_per_target = await Get(
         FieldSetsPerTarget, FieldSetsPerTargetRequest(PackageFieldSet, package_targets)
     )
+    # Nested archives are merged in uncompressed rather than compressed and extracted twice.
+    nested_field_sets = [
+        package_field_set
+        for package_field_set in package_field_sets_per_target.field_sets
+        if isinstance(package_field_set, MakeselfArchiveFieldSet)
+    ]
     packages = await MultiGet(
-        Get(BuiltPackage, EnvironmentAwarePackageRequest(field_set))
-        for field_set in package_field_sets_per_target.field_sets
+        Get(BuiltPackage, EnvironmentAwarePackageRequest(package_field_set))
+        for package_field_set in package_field_sets_per_target.field_sets
+        if not isinstance(package_field_set, MakeselfArchiveFieldSet)
+    )
+    flattened = await MultiGet(
+        Get(FlattenedMakeselfArchive, MakeselfArchiveFieldSet, nested_field_set)
+        for nested_field_set in nested_field_sets
     )
 
     file_sources = await MultiGet(
@@ -96,42 +320,707 @@ async def package_makeself_binary(
     startup_script = await Get(SourceFiles, SourceFilesRequest([field_set.startup_script]))
     assert len(startup_script.files) == 1, startup_script.files
 
-    input_digest = await Get(
-        Digest,
-        MergeDigests(
+    package_addresses = tuple(
+        package_field_set.address
+        for package_field_set in package_field_sets_per_target.field_sets
+        if not isinstance(package_field_set, MakeselfArchiveFieldSet)
+    ) + tuple(nested_field_set.address for nested_field_set in nested_field_sets)
+    package_digests = tuple(package.digest for package in packages)
+    if field_set.pex_layout.value == MakeselfPexLayout.LOOSE.value:
+        package_digests = await _loose_pexes(packages, field_set.address)
+    package_digests += tuple(archive.digest for archive in flattened)
+    file_digests = tuple(sources.snapshot.digest for sources in file_sources)
+    entries = await MultiGet(
+        Get(DigestEntries, Digest, digest) for digest in (*package_digests, *file_digests)
+    )
+    excluded_bytes = excluded_files = 0
+    if field_set.include.value or field_set.exclude.value:
+        unfiltered_bytes, unfiltered_files = entries_size(*entries)
+        globs = PathGlobs(
             (
-                startup_script.snapshot.digest,
-                *(package.digest for package in packages),
-                *(sources.snapshot.digest for sources in file_sources),
+                *(field_set.include.value or ("**",)),
+                *(f"!{glob}" for glob in field_set.exclude.value or ()),
+            ),
+            glob_match_error_behavior=GlobMatchErrorBehavior.ignore,
+        )
+        filtered = await MultiGet(
+            Get(Digest, DigestSubset(digest, globs)) for digest in (*package_digests, *file_digests)
+        )
+        package_digests = filtered[: len(package_digests)]
+        file_digests = filtered[len(package_digests) :]
+        entries = await MultiGet(Get(DigestEntries, Digest, digest) for digest in filtered)
+        filtered_bytes, filtered_files = entries_size(*entries)
+        excluded_bytes = unfiltered_bytes - filtered_bytes
+        excluded_files = unfiltered_files - filtered_files
+        logger.info(
+            f"{field_set.address}: `include` and `exclude` left {excluded_files} files "
+            f"({excluded_bytes / 2**20:.1f} MiB) out of the archive."
+        )
+    package_bytes, package_files = entries_size(*entries[: len(package_digests)])
+    file_bytes, file_files = entries_size(*entries[len(package_digests) :])
+
+    return MakeselfArchiveInputs(
+        startup_script=startup_script.files[0],
+        startup_script_digest=startup_script.snapshot.digest,
+        package_digests=package_digests,
+        package_addresses=package_addresses,
+        file_digests=file_digests,
+        packages=PackagingStats(package_bytes, package_files),
+        files=PackagingStats(file_bytes, file_files),
+        excluded_bytes=excluded_bytes,
+        excluded_files=excluded_files,
+    )
+
+
+@rule(desc="Flatten nested makeself archive", level=LogLevel.DEBUG)
+async def flatten_makeself_archive(field_set: MakeselfArchiveFieldSet) -> FlattenedMakeselfArchive:
+    inputs = await Get(MakeselfArchiveInputs, MakeselfArchiveFieldSet, field_set)
+    output_path = PurePath(field_set.output_path.value_or_default(file_ending="run"))
+    commands = {output_path.name: shlex.quote(os.path.join(os.curdir, inputs.startup_script))}
+    for name, command in (field_set.variants.value or {}).items():
+        commands[f"{output_path.stem}-{name}{output_path.suffix}"] = shlex.join(
+            shlex.split(command)
+        )
+    tree, launchers = await MultiGet(
+        Get(Digest, MergeDigests(inputs.digests)),
+        Get(
+            Digest,
+            CreateDigest(
+                FileContent(
+                    str(output_path.parent / filename),
+                    _FLATTENED_LAUNCHER.format(
+                        directory=shlex.quote(output_path.stem), command=command
+                    ).encode(),
+                    is_executable=True,
+                )
+                for filename, command in commands.items()
+            ),
+        ),
+    )
+    tree = await Get(Digest, AddPrefix(tree, str(output_path.parent / output_path.stem)))
+    digest = await Get(Digest, MergeDigests((tree, launchers)))
+    return FlattenedMakeselfArchive(digest)
+
+
+@dataclass(frozen=True)
+class MergeMakeselfArchiveInputs:
+    digests: Tuple[Digest, ...]
+    prefix: str
+
+
+@dataclass(frozen=True)
+class MergedMakeselfArchiveInputs(EngineAwareReturnType):
+    digest: Digest
+    stats: PackagingStats
+
+    def metadata(self) -> Dict[str, Any]:
+        return self.stats.metadata()
+
+
+@rule(desc="Merge makeself archive inputs", level=LogLevel.DEBUG)
+async def merge_makeself_archive_inputs(
+    request: MergeMakeselfArchiveInputs,
+) -> MergedMakeselfArchiveInputs:
+    digest = await Get(Digest, MergeDigests(request.digests))
+    digest = await Get(Digest, AddPrefix(digest, request.prefix))
+    entries = await Get(DigestEntries, Digest, digest)
+    input_bytes, input_files = entries_size(entries)
+    return MergedMakeselfArchiveInputs(digest, PackagingStats(input_bytes, input_files))
+
+
+@dataclass(frozen=True)
+class MakeselfZstdDictionaryFieldSet(PackageFieldSet):
+    required_fields = (MakeselfZstdDictionaryArchivesField,)
+
+    archives: MakeselfZstdDictionaryArchivesField
+    max_size: MakeselfZstdDictionaryMaxSizeField
+    output_path: OutputPathField
+
+
+@rule(desc="Train zstd dictionary", level=LogLevel.DEBUG)
+async def train_makeself_zstd_dictionary(
+    field_set: MakeselfZstdDictionaryFieldSet,
+) -> MakeselfZstdDictionary:
+    targets = await Get(
+        Targets, UnparsedAddressInputs, field_set.archives.to_unparsed_address_inputs()
+    )
+    field_sets_per_target = await Get(
+        FieldSetsPerTarget, FieldSetsPerTargetRequest(PackageFieldSet, targets)
+    )
+    archive_field_sets = [
+        archive_field_set
+        for archive_field_set in field_sets_per_target.field_sets
+        if isinstance(archive_field_set, MakeselfArchiveFieldSet)
+    ]
+    inputs = await MultiGet(
+        Get(MakeselfArchiveInputs, MakeselfArchiveFieldSet, archive_field_set)
+        for archive_field_set in archive_field_sets
+    )
+    samples = await MultiGet(
+        Get(Digest, MergeDigests(archive_inputs.digests)) for archive_inputs in inputs
+    )
+    sample_bytes = sum(
+        archive_inputs.packages.input_bytes + archive_inputs.files.input_bytes
+        for archive_inputs in inputs
+    )
+    max_size = field_set.max_size.value
+    if sample_bytes < 10 * max_size:
+        logger.warning(
+            f"{field_set.address} is trained on {sample_bytes} bytes, less than 10 times its "
+            f"`{MakeselfZstdDictionaryMaxSizeField.alias}` of {max_size} bytes, which zstd "
+            "recommends. Add more archives or lower it."
+        )
+
+    dictionary_id = zstd_dictionary_id(samples)
+    output_path = PurePath(field_set.output_path.value_or_default(file_ending="zdict"))
+    filename = f"{output_path.stem}-{dictionary_id}{output_path.suffix}"
+    process = await Get(
+        Process,
+        TrainZstdDictionary(
+            digests=samples,
+            output_filename=filename,
+            dictionary_id=dictionary_id,
+            max_size=max_size,
+            description=(
+                f"Training zstd dictionary on {len(samples)} makeself archives: "
+                f"{field_set.address}"
+            ),
+            level=LogLevel.DEBUG,
+        ),
+    )
+    result = await Get(ProcessResult, Process, process)
+    return MakeselfZstdDictionary(digest=result.output_digest, filename=filename)
+
+
+@rule
+async def package_makeself_zstd_dictionary(
+    field_set: MakeselfZstdDictionaryFieldSet,
+) -> BuiltPackage:
+    dictionary = await Get(MakeselfZstdDictionary, MakeselfZstdDictionaryFieldSet, field_set)
+    output_path = PurePath(field_set.output_path.value_or_default(file_ending="zdict"))
+    digest = await Get(Digest, AddPrefix(dictionary.digest, str(output_path.parent)))
+    relpath = str(output_path.parent / dictionary.filename)
+    return BuiltPackage(
+        digest,
+        artifacts=(
+            BuiltPackageArtifact(
+                relpath=relpath, extra_log_lines=(f"Built zstd dictionary: {relpath}",)
+            ),
+        ),
+    )
+
+
+@rule_helper
+async def _auto_compression(
+    field_set: MakeselfArchiveFieldSet, inputs: MakeselfArchiveInputs, makeself: MakeselfSubsystem
+) -> AutoCompression:
+    """The compression `auto` picks for the payload of `field_set`, from a sample of it."""
+    process = await Get(
+        Process,
+        SampleMakeselfPayload(
+            digests=tuple(digest for digest in inputs.digests if digest != EMPTY_DIGEST),
+            description=f"Sampling makeself archive payload: {field_set.address}",
+            level=LogLevel.DEBUG,
+        ),
+    )
+    result = await Get(ProcessResult, Process, process)
+    return choose_compression(
+        json.loads(result.stdout),
+        payload_bytes=inputs.packages.input_bytes + inputs.files.input_bytes,
+        transfer_rate=makeself.auto_compression_transfer_rate,
+        runs_per_build=makeself.auto_compression_runs_per_build,
+    )
+
+
+@rule_helper
+async def _zstd_dictionary(
+    field_set: MakeselfArchiveFieldSet, compression: MakeselfCompression
+) -> Optional[MakeselfZstdDictionary]:
+    """The dictionary the `zstd_dictionary` field of `field_set` points at, if it is used.
+
+    Dictionaries only apply to the `zstd` compression, other codecs warn and go without.
+    """
+    if not field_set.zstd_dictionary.value:
+        return None
+    alias = MakeselfArchiveZstdDictionaryField.alias
+    if compression != MakeselfCompression.ZSTD:
+        logger.warning(
+            f"{field_set.address} sets `{alias}`, which is only used with the `zstd` "
+            f"compression, not `{compression.value}`."
+        )
+        return None
+    targets = await Get(
+        Targets,
+        UnparsedAddressInputs(
+            (field_set.zstd_dictionary.value,),
+            owning_address=field_set.address,
+            description_of_origin=f"the `{alias}` field of {field_set.address}",
+        ),
+    )
+    if len(targets) != 1 or not MakeselfZstdDictionaryFieldSet.is_applicable(targets[0]):
+        raise InvalidFieldException(
+            f"The {alias!r} field in target {field_set.address} must be the address of a "
+            f"`{MakeselfZstdDictionaryTarget.alias}` target, got "
+            f"{field_set.zstd_dictionary.value!r}."
+        )
+    return await Get(
+        MakeselfZstdDictionary,
+        MakeselfZstdDictionaryFieldSet,
+        MakeselfZstdDictionaryFieldSet.create(targets[0]),
+    )
+
+
+def _warn_unsupported_options(
+    field_set: MakeselfArchiveFieldSet, zstd_dictionary: Optional[MakeselfZstdDictionary]
+) -> None:
+    """Warn about the fields of `field_set` which the header of the `makeself` engine ignores."""
+    for alias, value in (
+        (MakeselfArchiveParallelDecompressionField.alias, field_set.parallel_decompression.value),
+        (MakeselfArchiveInstallDirField.alias, field_set.install_dir.value),
+        (MakeselfArchiveDeduplicateField.alias, field_set.deduplicate.value),
+        (MakeselfArchiveZstdDictionaryField.alias, zstd_dictionary),
+    ):
+        if value:
+            logger.warning(
+                f"{field_set.address} sets `{alias}`, which the header written by the "
+                "`makeself` engine doesn't support. Set `engine='python'` to use it."
+            )
+
+
+@rule_helper
+async def _source_date_epoch(makeself: MakeselfSubsystem) -> Optional[int]:
+    """The timestamp deterministic archives are dated at, or `None` if they aren't."""
+    if not makeself.deterministic:
+        return None
+    env = await Get(EnvironmentVars, EnvironmentVarsRequest(["SOURCE_DATE_EPOCH"]))
+    try:
+        return int(env.get("SOURCE_DATE_EPOCH") or 0)
+    except ValueError as e:
+        raise ValueError(
+            f"`SOURCE_DATE_EPOCH` must be a Unix timestamp, got {env['SOURCE_DATE_EPOCH']!r}."
+        ) from e
+
+
+def _install_key(digests: Tuple[Digest, ...]) -> str:
+    """The subdirectory of `install_dir` the payload of `digests` is installed to.
+
+    Archives with the same contents share their install directory, whatever their compression.
+    """
+    fingerprints = "\n".join(digest.fingerprint for digest in digests)
+    return hashlib.sha256(fingerprints.encode()).hexdigest()[:16]
+
+
+@rule_helper
+async def _deduplicate(
+    digests: Tuple[Digest, ...], layered: bool
+) -> Tuple[Tuple[Digest, ...], Tuple[Tuple[FileEntry, FileEntry], ...]]:
+    """`digests` along with the files duplicating an earlier one, see `find_duplicates`.
+
+    A tar hardlink can't point into another segment, so layered archives leave the duplicates out
+    of `digests` and the header links them instead.
+    """
+    entries_per_digest = await MultiGet(Get(DigestEntries, Digest, digest) for digest in digests)
+    duplicates = find_duplicates(*entries_per_digest)
+    if layered and duplicates:
+        duplicate_paths = {duplicate.path for _, duplicate in duplicates}
+        digests = await MultiGet(
+            Get(
+                Digest,
+                CreateDigest(
+                    tuple(entry for entry in entries if entry.path not in duplicate_paths)
+                ),
             )
+            for entries in entries_per_digest
+        )
+    return digests, duplicates
+
+
+@dataclass(frozen=True)
+class _ArchiveOptions:
+    """The options of a packaged archive shared by its layered and merged forms."""
+
+    label: str
+    startup_script: str
+    output_filename: str
+    compression: MakeselfCompression
+    compression_level: Optional[int]
+    integrity: MakeselfIntegrity
+    source_date_epoch: Optional[int]
+    parallel_decompression: bool
+    install_dir: Optional[str]
+    install_key: str
+    zstd_dictionary: Optional[MakeselfZstdDictionary]
+    description: str
+
+
+@rule_helper
+async def _layered_archive(
+    field_set: MakeselfArchiveFieldSet,
+    makeself: MakeselfSubsystem,
+    digests: Tuple[Digest, ...],
+    duplicates: Tuple[Tuple[FileEntry, FileEntry], ...],
+    options: _ArchiveOptions,
+) -> MakeselfArchive:
+    """An archive with a segment per digest, compressed on its own so it is cached on its own."""
+    segments = await MultiGet(
+        Get(
+            MakeselfSegment,
+            CompressMakeselfSegment(
+                digest=digest,
+                compression=options.compression,
+                compression_level=options.compression_level,
+                compression_threads=makeself.compression_threads,
+                bytes_per_compression_thread=makeself.bytes_per_compression_thread,
+                integrity=options.integrity,
+                source_date_epoch=options.source_date_epoch,
+                zstd_dictionary=options.zstd_dictionary,
+                description=f"Compressing makeself archive segment: {field_set.address}",
+            ),
+        )
+        for digest in digests
+        if digest != EMPTY_DIGEST
+    )
+    return await Get(
+        MakeselfArchive,
+        CreateLayeredMakeselfArchive(
+            segments=segments,
+            label=options.label,
+            startup_script=options.startup_script,
+            output_filename=options.output_filename,
+            compression=options.compression,
+            source_date_epoch=options.source_date_epoch,
+            parallel_decompression=options.parallel_decompression,
+            install_dir=options.install_dir,
+            install_key=options.install_key,
+            links=tuple((original.path, duplicate.path) for original, duplicate in duplicates),
+            zstd_dictionary=options.zstd_dictionary.filename if options.zstd_dictionary else "",
+            description=options.description,
+            level=LogLevel.DEBUG,
         ),
     )
-    input_digest = await Get(Digest, AddPrefix(input_digest, archive_dir))
 
-    output_path = PurePath(field_set.output_path.value_or_default(file_ending="run"))
-    output_filename = output_path.name
-    startup_script_filename = startup_script.files[0]
-    result = await Get(
-        ProcessResult,
+
+@rule_helper
+async def _merged_archive(
+    makeself: MakeselfSubsystem,
+    digests: Tuple[Digest, ...],
+    package_digests: Tuple[Digest, ...],
+    engine: MakeselfEngine,
+    deduplicate: bool,
+    options: _ArchiveOptions,
+) -> MakeselfArchive:
+    """An archive of a single segment, written from `digests` merged into one directory."""
+    archive_dir = "__archive"
+    # Packages tend to be large, so they are linked into the sandbox rather than copied.
+    linked_digests = package_digests if makeself.link_packages else ()
+    merged = await Get(
+        MergedMakeselfArchiveInputs,
+        MergeMakeselfArchiveInputs(
+            tuple(digest for digest in digests if digest not in linked_digests), archive_dir
+        ),
+    )
+    return await Get(
+        MakeselfArchive,
         CreateMakeselfArchive(
             archive_dir=archive_dir,
-            file_name=output_filename,
-            label=field_set.label.value or output_filename,
-            startup_script=startup_script_filename,
-            input_digest=input_digest,
-            output_filename=output_filename,
-            description=f"Packaging makeself archive: {field_set.address}",
+            file_name=options.output_filename,
+            label=options.label,
+            startup_script=options.startup_script,
+            input_digest=merged.digest,
+            output_filename=options.output_filename,
+            compression=options.compression,
+            compression_level=options.compression_level,
+            compression_threads=makeself.compression_threads,
+            bytes_per_compression_thread=makeself.bytes_per_compression_thread,
+            integrity=options.integrity,
+            engine=engine,
+            linked_digests=linked_digests,
+            source_date_epoch=options.source_date_epoch,
+            parallel_decompression=options.parallel_decompression,
+            install_dir=options.install_dir,
+            install_key=options.install_key,
+            deduplicate=deduplicate,
+            zstd_dictionary=options.zstd_dictionary,
+            description=options.description,
             level=LogLevel.DEBUG,
         ),
     )
-    digest = await Get(Digest, AddPrefix(result.output_digest, str(output_path.parent)))
-    snapshot = await Get(Snapshot, Digest, digest)
-    assert len(snapshot.files) == 1, snapshot
 
-    return BuiltPackage(
-        snapshot.digest,
-        artifacts=tuple(BuiltMakeselfArchiveArtifact.create(file) for file in snapshot.files),
+
+@rule_helper
+async def _variants(
+    field_set: MakeselfArchiveFieldSet,
+    output_path: PurePath,
+    archive: MakeselfArchive,
+    options: _ArchiveOptions,
+) -> Tuple[Digest, Dict[str, Tuple[str, Tuple[str, ...]]]]:
+    """The archive along with its variants, and the startup script and arguments of each.
+
+    Variants reuse the compressed payload and only get a header of their own.
+    """
+    variants = {
+        f"{output_path.stem}-{name}{output_path.suffix}": command
+        for name, command in (field_set.variants.value or {}).items()
+    }
+    archives: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+        options.output_filename: (os.path.join(os.curdir, options.startup_script), ())
+    }
+    for filename, command in variants.items():
+        script, *args = shlex.split(command)
+        archives[filename] = (script, tuple(args))
+    if not variants:
+        return archive.digest, archives
+    process = await Get(
+        Process,
+        CreateMakeselfArchiveVariants(
+            archive=options.output_filename,
+            input_digest=archive.digest,
+            variants=FrozenDict(variants),
+            description=f"Writing makeself archive variants: {field_set.address}",
+            level=LogLevel.DEBUG,
+        ),
+    )
+    result = await Get(ProcessResult, Process, process)
+    digest = await Get(Digest, MergeDigests((archive.digest, result.output_digest)))
+    return digest, archives
+
+
+@rule_helper
+async def _delta_bases(field_set: MakeselfArchiveFieldSet) -> Tuple[Tuple[str, Digest], ...]:
+    """The path and digest of every previous archive the `delta_from` field points at.
+
+    Those are the files of `file` targets and the first artifact of packageable targets.
+    """
+    targets = await Get(
+        Targets, UnparsedAddressInputs, field_set.delta_from.to_unparsed_address_inputs()
+    )
+    field_sets_per_target = await Get(
+        FieldSetsPerTarget, FieldSetsPerTargetRequest(PackageFieldSet, targets)
+    )
+    packages = await MultiGet(
+        Get(BuiltPackage, EnvironmentAwarePackageRequest(field_sets[0]))
+        for field_sets in field_sets_per_target.collection
+        if field_sets
     )
+    file_sources = await MultiGet(
+        Get(
+            HydratedSources,
+            HydrateSourcesRequest(
+                tgt.get(SourcesField), for_sources_types=(FileSourceField,), enable_codegen=True
+            ),
+        )
+        for tgt, field_sets in zip(targets, field_sets_per_target.collection)
+        if not field_sets
+    )
+    return (
+        *(
+            (path, sources.snapshot.digest)
+            for sources in file_sources
+            for path in sources.snapshot.files
+        ),
+        *(
+            (package.artifacts[0].relpath, package.digest)
+            for package in packages
+            if package.artifacts and package.artifacts[0].relpath
+        ),
+    )
+
+
+@rule_helper
+async def _deltas(
+    field_set: MakeselfArchiveFieldSet, archive: MakeselfArchive, options: _ArchiveOptions
+) -> Tuple[Tuple[Digest, ...], Tuple[str, ...], Tuple[str, ...]]:
+    """The deltas from the bases of `delta_from` to the archive, their filenames and notes."""
+    delta_dir = "__deltas"
+    bases = await _delta_bases(field_set)
+    processes = await MultiGet(
+        Get(
+            Process,
+            CreateMakeselfDelta(
+                archive=options.output_filename,
+                input_digest=archive.digest,
+                base=base,
+                base_digest=base_digest,
+                output_dir=delta_dir,
+                compression_level=(
+                    options.compression_level
+                    if options.compression == MakeselfCompression.ZSTD
+                    else None
+                ),
+                description=f"Writing makeself archive delta from {base}: {field_set.address}",
+                level=LogLevel.DEBUG,
+            ),
+        )
+        for base, base_digest in bases
+    )
+    results = await MultiGet(Get(ProcessResult, Process, process) for process in processes)
+    digests = await MultiGet(
+        Get(Digest, RemovePrefix(result.output_digest, delta_dir)) for result in results
+    )
+    filenames, notes = [], []
+    for (base, _), result in zip(bases, results):
+        delta = json.loads(result.stdout)
+        name, size = os.path.basename(delta["path"]), delta["delta_bytes"]
+        share = size / max(delta["archive_bytes"], 1)
+        filenames.append(name)
+        notes.append(
+            f"delta from {base}: {name}, {size / 2**20:.1f} MiB ({share:.1%} of the archive)"
+        )
+    return digests, tuple(filenames), tuple(notes)
+
+
+@rule_helper
+async def _volumes(
+    field_set: MakeselfArchiveFieldSet, archives: Tuple[str, ...], digest: Digest
+) -> Digest:
+    """`digest` with each of its `archives` split into volumes of `max_volume_size`."""
+    volumes_dir = "__volumes"
+    process = await Get(
+        Process,
+        SplitMakeselfArchives(
+            archives=archives,
+            input_digest=digest,
+            max_volume_size=field_set.max_volume_size.value,
+            output_dir=volumes_dir,
+            description=f"Splitting makeself archive into volumes: {field_set.address}",
+            level=LogLevel.DEBUG,
+        ),
+    )
+    result = await Get(ProcessResult, Process, process)
+    return await Get(Digest, RemovePrefix(result.output_digest, volumes_dir))
+
+
+def _artifacts(
+    snapshot: Snapshot,
+    output_path: PurePath,
+    archives: Dict[str, Tuple[str, Tuple[str, ...]]],
+    companions: Sequence[str],
+    options: _ArchiveOptions,
+    stats: PackagingStats,
+    notes: Tuple[str, ...],
+) -> Tuple[BuiltPackageArtifact, ...]:
+    """An artifact per archive followed by its volumes, then one per companion file."""
+    artifacts: List[BuiltPackageArtifact] = []
+    for filename, (script, scriptargs) in archives.items():
+        relpath = str(output_path.parent / filename)
+        volumes = tuple(
+            file
+            for file in snapshot.files
+            if file.startswith(f"{relpath}.") and file[len(relpath) + 1 :].isdigit()
+        )
+        artifacts.append(
+            BuiltMakeselfArchiveArtifact.create(
+                relpath,
+                options.compression,
+                options.integrity,
+                script,
+                stats,
+                scriptargs,
+                volumes,
+                notes,
+            )
+        )
+        artifacts.extend(BuiltPackageArtifact(relpath=volume) for volume in volumes)
+    artifacts.extend(
+        BuiltPackageArtifact(relpath=str(output_path.parent / filename)) for filename in companions
+    )
+    assert len(artifacts) == len(snapshot.files), snapshot
+    return tuple(artifacts)
+
+
+@rule
+async def package_makeself_binary(
+    field_set: MakeselfArchiveFieldSet,
+    makeself: MakeselfSubsystem,
+) -> BuiltPackage:
+    inputs = await Get(MakeselfArchiveInputs, MakeselfArchiveFieldSet, field_set)
+    output_path = PurePath(field_set.output_path.value_or_default(file_ending="run"))
+    layered = field_set.layered.value
+    compression = (
+        MakeselfCompression(field_set.compression.value)
+        if field_set.compression.value
+        else makeself.compression
+    )
+    compression_level = (
+        field_set.compression_level.value
+        if field_set.compression_level.value is not None
+        else makeself.compression_level
+    )
+    notes: Tuple[str, ...] = ()
+    if compression == MakeselfCompression.AUTO:
+        auto_compression = await _auto_compression(field_set, inputs, makeself)
+        compression = auto_compression.compression
+        compression_level = None
+        notes += (auto_compression.summary(),)
+    zstd_dictionary = await _zstd_dictionary(field_set, compression)
+    engine = MakeselfEngine(field_set.engine.value) if field_set.engine.value else makeself.engine
+    deduplicate = field_set.deduplicate.value
+    if engine == MakeselfEngine.MAKESELF and not layered:
+        _warn_unsupported_options(field_set, zstd_dictionary)
+        deduplicate = False
+        zstd_dictionary = None
+    if zstd_dictionary:
+        notes += (f"zstd dictionary: {zstd_dictionary.filename}, to ship next to the archive",)
+    source_date_epoch = await _source_date_epoch(makeself)
+    options = _ArchiveOptions(
+        label=field_set.label.value or output_path.name,
+        startup_script=inputs.startup_script,
+        output_filename=output_path.name,
+        compression=compression,
+        compression_level=compression_level,
+        integrity=(
+            MakeselfIntegrity(field_set.integrity.value)
+            if field_set.integrity.value
+            else makeself.integrity
+        ),
+        source_date_epoch=source_date_epoch,
+        parallel_decompression=field_set.parallel_decompression.value,
+        install_dir=field_set.install_dir.value,
+        install_key=_install_key(inputs.digests),
+        zstd_dictionary=zstd_dictionary,
+        description=f"Packaging makeself archive: {field_set.address}",
+    )
+
+    digests = inputs.digests
+    duplicates: Tuple[Tuple[FileEntry, FileEntry], ...] = ()
+    if deduplicate:
+        digests, duplicates = await _deduplicate(digests, layered)
+    if layered:
+        archive = await _layered_archive(field_set, makeself, digests, duplicates, options)
+    else:
+        archive = await _merged_archive(
+            makeself, digests, inputs.package_digests, engine, deduplicate, options
+        )
+    stats = archive.stats
+    if deduplicate:
+        stats = dataclasses.replace(
+            stats,
+            deduplicated_bytes=sum(
+                duplicate.file_digest.serialized_bytes_length for _, duplicate in duplicates
+            ),
+        )
+
+    archive_digest, archives = await _variants(field_set, output_path, archive, options)
+    companion_digests: Tuple[Digest, ...] = ()
+    companions: Tuple[str, ...] = ()
+    if zstd_dictionary:
+        companion_digests += (zstd_dictionary.digest,)
+        companions += (zstd_dictionary.filename,)
+    # Deltas rebuild the whole archive, so they are computed before it is split into volumes.
+    if field_set.delta_from.value:
+        delta_digests, delta_filenames, delta_notes = await _deltas(field_set, archive, options)
+        companion_digests += delta_digests
+        companions += delta_filenames
+        notes += delta_notes
+    if field_set.max_volume_size.value:
+        archive_digest = await _volumes(field_set, tuple(archives), archive_digest)
+    if companion_digests:
+        archive_digest = await Get(Digest, MergeDigests((archive_digest, *companion_digests)))
+
+    digest = await Get(Digest, AddPrefix(archive_digest, str(output_path.parent)))
+    snapshot = await Get(Snapshot, Digest, digest)
+    artifacts = _artifacts(snapshot, output_path, archives, companions, options, stats, notes)
+    return BuiltPackage(snapshot.digest, artifacts=artifacts)
 
 
 def rules():
@@ -141,4 +1030,5 @@ def rules():
         *source_files.rules(),
         *MakeselfArchiveFieldSet.rules(),
         UnionRule(PackageFieldSet, MakeselfArchiveFieldSet),
+        UnionRule(PackageFieldSet, MakeselfZstdDictionaryFieldSet),
     ]
@@ -0,0 +1,332 @@
+"""Benchmarks for packaging makeself archives.
+
+They build large payloads, so they only run with `MAKESELF_BENCHMARK=1` set. Pants only passes
+the environment variables of `[test].extra_env_vars` to tests, and caches their results, e.g.
+
+    pants test --force --test-extra-env-vars="['MAKESELF_BENCHMARK=1']" \\
+        pants-plugins/pants_backend_makeself/goals/package_benchmark_test.py -- -s
+
+The matrix is configured with comma separated lists in `MAKESELF_BENCHMARK_SIZES` (e.g. `1M,4G`),
+`MAKESELF_BENCHMARK_PAYLOADS`, `MAKESELF_BENCHMARK_COMPRESSIONS`, `MAKESELF_BENCHMARK_THREADS` and
+`MAKESELF_BENCHMARK_ENGINES`. Results are written as JSON to `MAKESELF_BENCHMARK_REPORT`, and
+compared against the report in `MAKESELF_BENCHMARK_BASELINE` if set: a case fails when it gets
+slower or bigger than `MAKESELF_BENCHMARK_TOLERANCE` (default `0.2`) allows.
+
+Timings and memory depend on the machine, so no baseline is checked in. To check a change, write
+a baseline on the same machine from the commit it's based on, then compare against it, with
+absolute paths since tests run in a sandbox:
+
+    git checkout main
+    pants test --force --test-extra-env-vars="['MAKESELF_BENCHMARK=1', \\
+        'MAKESELF_BENCHMARK_REPORT=/tmp/makeself-baseline.json']" \\
+        pants-plugins/pants_backend_makeself/goals/package_benchmark_test.py -- -s
+    git checkout -
+    pants test --force --test-extra-env-vars="['MAKESELF_BENCHMARK=1', \\
+        'MAKESELF_BENCHMARK_BASELINE=/tmp/makeself-baseline.json']" \\
+        pants-plugins/pants_backend_makeself/goals/package_benchmark_test.py -- -s
+"""
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from textwrap import dedent
+from typing import Dict, Iterator, List
+
+import pytest
+from pants.core.goals.package import BuiltPackage
+from pants.core.target_types import ArchiveTarget, FilesGeneratorTarget, FileTarget
+from pants.core.target_types import rules as core_target_types_rules
+from pants.core.util_rules import archive
+from pants.engine.addresses import Address
+from pants.engine.fs import Digest, DigestEntries, FileEntry
+from pants.testutil.rule_runner import PYTHON_BOOTSTRAP_ENV, QueryRule, RuleRunner
+from pants_backend_makeself import makeself, system_binaries
+from pants_backend_makeself.goals import package
+from pants_backend_makeself.goals.package import MakeselfArchiveFieldSet
+from pants_backend_makeself.target_types import MakeselfArchiveTarget
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("MAKESELF_BENCHMARK"), reason="set MAKESELF_BENCHMARK=1 to run benchmarks"
+)
+
+_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+
+def _env_list(name: str, default: str) -> List[str]:
+    return [value.strip() for value in os.environ.get(name, default).split(",") if value.strip()]
+
+
+def _parse_size(size: str) -> int:
+    unit = _UNITS.get(size[-1].upper())
+    return int(size[:-1]) * unit if unit else int(size)
+
+
+PAYLOAD_SIZE = int(os.environ.get("MAKESELF_BENCHMARK_PAYLOAD_MB", "256")) * 1024 * 1024
+
+
+def _rule_runner(*args: str) -> RuleRunner:
+    rule_runner = RuleRunner(
+        target_types=[MakeselfArchiveTarget, FileTarget, FilesGeneratorTarget, ArchiveTarget],
+        rules=[
+            *archive.rules(),
+            *core_target_types_rules(),
+            *makeself.rules(),
+            *package.rules(),
+            *system_binaries.rules(),
+            QueryRule(BuiltPackage, [MakeselfArchiveFieldSet]),
+            QueryRule(DigestEntries, [Digest]),
+        ],
+    )
+    rule_runner.set_options(args=args, env_inherit=PYTHON_BOOTSTRAP_ENV)
+    return rule_runner
+
+
+def _build(rule_runner: RuleRunner, name: str) -> BuiltPackage:
+    target = rule_runner.get_target(Address("src", target_name=name))
+    return rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+
+
+# Payloads
+
+
+def _write_zip(root: str, size: int, rng: random.Random) -> None:
+    """A PEX-like zip of already compressed, i.e. incompressible, entries."""
+    entry_size = 8 << 20
+    with zipfile.ZipFile(os.path.join(root, "app.pex"), "w", zipfile.ZIP_STORED) as pex:
+        for index in range(max(1, size // entry_size)):
+            length = min(entry_size, size)
+            with pex.open(f".deps/dep{index}.whl", "w", force_zip64=True) as entry:
+                entry.write(rng.getrandbits(8 * length).to_bytes(length, "little"))
+
+
+def _text_blocks(rng: random.Random) -> List[bytes]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = ["".join(rng.choices(letters, k=rng.randint(2, 10))) for _ in range(2000)]
+    return [
+        "\n".join(" ".join(rng.choices(words, k=12)) for _ in range(1024)).encode()
+        for _ in range(16)
+    ]
+
+
+def _write_text(root: str, size: int, rng: random.Random) -> None:
+    """A source-like tree of text files."""
+    blocks = _text_blocks(rng)
+    written = index = 0
+    while written < size:
+        path = os.path.join(root, f"pkg{index // 100}", f"module{index}.txt")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fp:
+            for block in rng.choices(blocks, k=4):
+                written += fp.write(block)
+        index += 1
+
+
+def _write_small_files(root: str, size: int, rng: random.Random) -> None:
+    """Many small files, half of them text and half of them binary."""
+    blocks = _text_blocks(rng)
+    written = index = 0
+    while written < size:
+        path = os.path.join(root, f"dir{index // 1000}", f"file{index}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        length = rng.randint(1 << 10, 4 << 10)
+        if index % 2:
+            data = rng.getrandbits(8 * length).to_bytes(length, "little")
+        else:
+            data = rng.choice(blocks)[:length]
+        with open(path, "wb") as fp:
+            written += fp.write(data)
+        index += 1
+
+
+PAYLOADS = {"zip": _write_zip, "text": _write_text, "small_files": _write_small_files}
+
+
+@dataclass(frozen=True)
+class Case:
+    payload: str
+    size: str
+    compression: str
+    threads: int
+    engine: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.payload}-{self.size}-{self.compression}-t{self.threads}-{self.engine}"
+
+
+@dataclass(frozen=True)
+class Result:
+    case: Case
+    input_bytes: int
+    output_bytes: int
+    seconds: float
+    # The peak RSS of the Pants engine and of the processes it spawned, in KiB.
+    peak_rss_kb: int
+    peak_process_rss_kb: int
+
+
+def _cases() -> Iterator[Case]:
+    for payload in _env_list("MAKESELF_BENCHMARK_PAYLOADS", ",".join(PAYLOADS)):
+        for size in _env_list("MAKESELF_BENCHMARK_SIZES", "1M,64M"):
+            for compression in _env_list("MAKESELF_BENCHMARK_COMPRESSIONS", "gzip,zstd,xz"):
+                for threads in _env_list("MAKESELF_BENCHMARK_THREADS", "1,0"):
+                    for engine in _env_list("MAKESELF_BENCHMARK_ENGINES", "makeself,python"):
+                        yield Case(payload, size, compression, int(threads), engine)
+
+
+def _run_case(case: Case) -> Result:
+    """Package `case` in this process, which must be a fresh one for the RSS to be its own."""
+    rule_runner = _rule_runner(
+        f"--makeself-compression={case.compression}",
+        f"--makeself-compression-threads={case.threads}",
+        f"--makeself-engine={case.engine}",
+    )
+    rule_runner.write_files(
+        {
+            "src/BUILD": dedent(
+                """\
+                files(name="payload", sources=["payload/**"])
+                makeself_archive(name="archive", startup_script="run.sh", files=[":payload"])
+                """
+            ),
+            "src/run.sh": "#!/bin/sh\n",
+        }
+    )
+    rule_runner.chmod("src/run.sh", 0o755)
+    payload_dir = os.path.join(rule_runner.build_root, "src", "payload")
+    os.makedirs(payload_dir)
+    PAYLOADS[case.payload](payload_dir, _parse_size(case.size), random.Random(case.key))
+    input_bytes = sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, names in os.walk(payload_dir)
+        for name in names
+    )
+
+    start = time.perf_counter()
+    built = _build(rule_runner, "archive")
+    seconds = time.perf_counter() - start
+
+    entries = rule_runner.request(DigestEntries, [built.digest])
+    return Result(
+        case=case,
+        input_bytes=input_bytes,
+        output_bytes=sum(
+            entry.file_digest.serialized_bytes_length
+            for entry in entries
+            if isinstance(entry, FileEntry)
+        ),
+        seconds=seconds,
+        peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        peak_process_rss_kb=resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+@pytest.fixture(scope="module")
+def report() -> Iterator[Dict[str, dict]]:
+    results: Dict[str, dict] = {}
+    yield results
+    path = os.environ.get("MAKESELF_BENCHMARK_REPORT")
+    document = {
+        "machine": {"platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+    if path:
+        with open(path, "w") as fp:
+            json.dump(document, fp, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(document, indent=2, sort_keys=True))
+
+
+@pytest.fixture(scope="module")
+def baseline() -> Dict[str, dict]:
+    path = os.environ.get("MAKESELF_BENCHMARK_BASELINE")
+    if not path:
+        return {}
+    with open(path) as fp:
+        return json.load(fp)["results"]
+
+
+@pytest.mark.parametrize("case", _cases(), ids=lambda case: case.key)
+def test_package(case: Case, report: Dict[str, dict], baseline: Dict[str, dict]) -> None:
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        result = executor.submit(_run_case, case).result()
+    report[case.key] = asdict(result)
+
+    previous = baseline.get(case.key)
+    if previous is None:
+        return
+    tolerance = 1 + float(os.environ.get("MAKESELF_BENCHMARK_TOLERANCE", "0.2"))
+    regressions = [
+        f"{metric}: {previous[metric]} -> {getattr(result, metric)}"
+        for metric in ("seconds", "output_bytes", "peak_rss_kb", "peak_process_rss_kb")
+        if getattr(result, metric) > previous[metric] * tolerance
+    ]
+    assert not regressions, f"{case.key} regressed: {', '.join(regressions)}"
+
+
+# Sandbox materialization
+
+
+@dataclass(frozen=True)
+class Measurement:
+    seconds: float
+    # Bytes written by the Pants process itself, i.e. sandbox materialization, but not the writes
+    # of the archiving processes it spawns.
+    written_bytes: int
+
+
+def _written_bytes() -> int:
+    with open("/proc/self/io") as io:
+        for line in io:
+            name, value = line.split(":")
+            if name == "wchar":
+                return int(value)
+    raise AssertionError("`wchar` is missing from /proc/self/io")
+
+
+def _package_with_packages(*args: str) -> Measurement:
+    rule_runner = _rule_runner(*args)
+    rule_runner.write_files(
+        {
+            "src/BUILD": dedent(
+                """\
+                file(name="payload", source="payload.bin")
+                archive(name="inner", format="tar", files=[":payload"])
+                makeself_archive(
+                    name="outer",
+                    startup_script="run.sh",
+                    packages=[":inner"],
+                    compression="zstd",
+                    compression_level=1,
+                )
+                """
+            ),
+            "src/run.sh": "#!/bin/sh\n",
+            "src/payload.bin": os.urandom(PAYLOAD_SIZE),
+        }
+    )
+    rule_runner.chmod("src/run.sh", 0o755)
+
+    written_bytes = _written_bytes()
+    start = time.perf_counter()
+    _build(rule_runner, "outer")
+    return Measurement(time.perf_counter() - start, _written_bytes() - written_bytes)
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/io"), reason="needs /proc/self/io")
+def test_link_packages_materializes_less() -> None:
+    copied = _package_with_packages("--makeself-link-packages=false")
+    linked = _package_with_packages("--makeself-link-packages")
+
+    print(
+        f"\npayload {PAYLOAD_SIZE >> 20} MiB\n"
+        f"copied: {copied.seconds:.2f}s, {copied.written_bytes >> 20} MiB written\n"
+        f"linked: {linked.seconds:.2f}s, {linked.written_bytes >> 20} MiB written"
+    )
+    assert linked.written_bytes < copied.written_bytes - PAYLOAD_SIZE // 2
@@ -1,43 +1,86 @@
+import os
+import re
+import subprocess
+from pathlib import Path
+from textwrap import dedent
+from typing import Dict, Optional
+
 import pytest
 from pants.core.goals.package import BuiltPackage
+from pants.core.target_types import ArchiveTarget, FilesGeneratorTarget
+from pants.core.target_types import rules as core_target_types_rules
+from pants.core.util_rules import archive
 from pants.engine.addresses import Address
-from pants.engine.process import ProcessResult
+from pants.engine.fs import CreateDigest, Digest, DigestContents, FileContent
+from pants.engine.process import Process, ProcessResult
 from pants.testutil.rule_runner import PYTHON_BOOTSTRAP_ENV, QueryRule, RuleRunner
 from pants_backend_makeself import makeself, system_binaries
 from pants_backend_makeself.goals import package, run
 from pants_backend_makeself.goals.package import (
     BuiltMakeselfArchiveArtifact,
     MakeselfArchiveFieldSet,
+    MakeselfArchiveInputs,
+    MakeselfZstdDictionaryFieldSet,
+)
+from pants_backend_makeself.makeself import CreateMakeselfArchive, RunMakeselfArchive
+from pants_backend_makeself.target_types import (
+    MakeselfArchiveTarget,
+    MakeselfCompression,
+    MakeselfEngine,
+    MakeselfZstdDictionaryTarget,
 )
-from pants_backend_makeself.makeself import RunMakeselfArchive
-from pants_backend_makeself.target_types import MakeselfArchiveTarget
 
 
-@pytest.fixture
-def rule_runner() -> RuleRunner:
+def _rule_runner(*args: str) -> RuleRunner:
     rule_runner = RuleRunner(
         target_types=[
             MakeselfArchiveTarget,
+            MakeselfZstdDictionaryTarget,
+            FilesGeneratorTarget,
+            ArchiveTarget,
         ],
         rules=[
+            *archive.rules(),
+            *core_target_types_rules(),
             *makeself.rules(),
             *package.rules(),
             *run.rules(),
             *system_binaries.rules(),
             QueryRule(BuiltPackage, [MakeselfArchiveFieldSet]),
+            QueryRule(BuiltPackage, [MakeselfZstdDictionaryFieldSet]),
+            QueryRule(Digest, [CreateDigest]),
+            QueryRule(DigestContents, [Digest]),
+            QueryRule(MakeselfArchiveInputs, [MakeselfArchiveFieldSet]),
             QueryRule(ProcessResult, [RunMakeselfArchive]),
+            QueryRule(Process, [CreateMakeselfArchive]),
         ],
     )
-    rule_runner.set_options(args=[], env_inherit=PYTHON_BOOTSTRAP_ENV)
+    rule_runner.set_options(args=args, env_inherit=PYTHON_BOOTSTRAP_ENV)
     return rule_runner
 
 
-def test_makeself_package(rule_runner: RuleRunner) -> None:
+@pytest.fixture
+def rule_runner() -> RuleRunner:
+    return _rule_runner()
+
+
+@pytest.mark.parametrize("engine", ["makeself", "python"])
+@pytest.mark.parametrize("compression", [None, "xz", "zstd", "none"])
+def test_makeself_package(rule_runner: RuleRunner, compression: Optional[str], engine: str) -> None:
     binary_name = "archive"
+    compression_arg = f", compression='{compression}'" if compression else ""
 
     rule_runner.write_files(
         {
-            "src/shell/BUILD": f"makeself_archive(name='{binary_name}', startup_script='run.sh')",
+            "src/shell/BUILD": dedent(
+                f"""\
+                makeself_archive(
+                    name='{binary_name}',
+                    startup_script='run.sh'{compression_arg},
+                    engine='{engine}',
+                )
+                """
+            ),
             "src/shell/run.sh": "echo test",
         }
     )
@@ -49,9 +92,13 @@ def test_makeself_package(rule_runner: RuleRunner) -> None:
     package = rule_runner.request(BuiltPackage, [field_set])
 
     assert len(package.artifacts) == 1, field_set
-    assert isinstance(package.artifacts[0], BuiltMakeselfArchiveArtifact)
+    artifact = package.artifacts[0]
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
     relpath = f"src.shell/{binary_name}.run"
-    assert package.artifacts[0].relpath == relpath
+    assert artifact.relpath == relpath
+    assert artifact.compression == MakeselfCompression(compression or "gzip")
+    assert artifact.extra_log_lines[0] == f"Built Makeself binary: {relpath}"
+    assert artifact.extra_log_lines[1].lstrip().startswith("1 files, 0.0 MiB -> ")
 
     result = rule_runner.request(
         ProcessResult,
@@ -60,7 +107,812 @@ def test_makeself_package(rule_runner: RuleRunner) -> None:
                 exe=relpath,
                 description="Run built makeself archive",
                 input_digest=package.digest,
+                compression=artifact.compression,
             )
         ],
     )
     assert result.stdout == b"test\n"
+
+
+@pytest.mark.parametrize("engine", [MakeselfEngine.MAKESELF, MakeselfEngine.PYTHON])
+def test_makeself_package_compression_threads(
+    rule_runner: RuleRunner, engine: MakeselfEngine
+) -> None:
+    input_digest = rule_runner.request(
+        Digest,
+        [
+            CreateDigest(
+                [
+                    FileContent("archive/run.sh", b"#!/bin/sh\necho ok\n", is_executable=True),
+                    FileContent("archive/data.txt", b"data\n" * 1024),
+                ]
+            )
+        ],
+    )
+
+    def create(compression: MakeselfCompression, compression_threads: int) -> Process:
+        return rule_runner.request(
+            Process,
+            [
+                CreateMakeselfArchive(
+                    archive_dir="archive",
+                    file_name="archive.run",
+                    label="test archive",
+                    startup_script="run.sh",
+                    input_digest=input_digest,
+                    description="Write makeself archive on several threads",
+                    output_filename="archive.run",
+                    compression=compression,
+                    compression_threads=compression_threads,
+                    bytes_per_compression_thread=1024,
+                    engine=engine,
+                )
+            ],
+        )
+
+    # One thread per 1 KiB of payload, capped at `compression_threads`.
+    process = create(MakeselfCompression.ZSTD, 4)
+    assert process.concurrency_available == 4
+    assert "{pants_concurrency}" in process.argv
+    for compression, threads in ((MakeselfCompression.ZSTD, 1), (MakeselfCompression.GZIP, 4)):
+        process = create(compression, threads)
+        assert process.concurrency_available == 0
+        assert "{pants_concurrency}" not in process.argv
+
+    result = rule_runner.request(ProcessResult, [create(MakeselfCompression.ZSTD, 4)])
+    result = rule_runner.request(
+        ProcessResult,
+        [
+            RunMakeselfArchive(
+                exe="archive.run",
+                description="Run makeself archive compressed on several threads",
+                input_digest=result.output_digest,
+                compression=MakeselfCompression.ZSTD,
+            )
+        ],
+    )
+    assert result.stdout == b"ok\n"
+
+
+@pytest.mark.parametrize("integrity", ["sha256", "none"])
+def test_makeself_package_layered(rule_runner: RuleRunner, integrity: str) -> None:
+    rule_runner.write_files(
+        {
+            "src/shell/BUILD": dedent(
+                f"""\
+                files(name="data", sources=["data/*.txt"])
+
+                makeself_archive(
+                    name="archive",
+                    startup_script="run.sh",
+                    files=[":data"],
+                    layered=True,
+                    integrity="{integrity}",
+                )
+                """
+            ),
+            "src/shell/run.sh": "cat src/shell/data/*.txt",
+            "src/shell/data/a.txt": "a\n",
+            "src/shell/data/b.txt": "b\n",
+        }
+    )
+    rule_runner.chmod("src/shell/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+    package = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+    artifact = package.artifacts[0]
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
+    assert artifact.relpath is not None
+
+    result = rule_runner.request(
+        ProcessResult,
+        [
+            RunMakeselfArchive(
+                exe=artifact.relpath,
+                description="Run built layered makeself archive",
+                input_digest=package.digest,
+                compression=artifact.compression,
+                integrity=artifact.integrity,
+            )
+        ],
+    )
+    assert result.stdout == b"a\nb\n"
+
+
+@pytest.mark.parametrize("engine", ["makeself", "python"])
+@pytest.mark.parametrize("link_packages", [True, False])
+def test_makeself_package_with_packages(
+    rule_runner: RuleRunner, engine: str, link_packages: bool
+) -> None:
+    rule_runner.set_options(
+        args=[f"--makeself-link-packages={link_packages}"], env_inherit=PYTHON_BOOTSTRAP_ENV
+    )
+    rule_runner.write_files(
+        {
+            "src/shell/BUILD": dedent(
+                f"""\
+                files(name="data", sources=["inner.txt"])
+
+                archive(name="inner", format="tar", files=[":data"])
+
+                makeself_archive(
+                    name="outer",
+                    startup_script="outer.sh",
+                    packages=[":inner"],
+                    engine="{engine}",
+                )
+                """
+            ),
+            "src/shell/inner.txt": "inner\n",
+            "src/shell/outer.sh": "tar -xOf src.shell/inner.tar",
+        }
+    )
+    rule_runner.chmod("src/shell/outer.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/shell", target_name="outer"))
+    package = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+    artifact = package.artifacts[0]
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
+    assert artifact.relpath is not None
+
+    result = rule_runner.request(
+        ProcessResult,
+        [
+            RunMakeselfArchive(
+                exe=artifact.relpath,
+                description="Run built makeself archive with packages",
+                input_digest=package.digest,
+                compression=artifact.compression,
+            )
+        ],
+    )
+    assert result.stdout == b"inner\n"
+
+
+@pytest.mark.parametrize("engine", ["makeself", "python"])
+@pytest.mark.parametrize("layered", [False, True])
+def test_makeself_package_is_deterministic(engine: str, layered: bool) -> None:
+    digests = []
+    for mtime in (1_000_000_000, 1_500_000_000):
+        # Every build gets its own build root and sandboxes.
+        rule_runner = _rule_runner("--makeself-deterministic")
+        rule_runner.write_files(
+            {
+                "src/shell/BUILD": dedent(
+                    f"""\
+                    files(name="data", sources=["data/*.txt"])
+
+                    makeself_archive(
+                        name="archive",
+                        startup_script="run.sh",
+                        files=[":data"],
+                        engine="{engine}",
+                        layered={layered},
+                    )
+                    """
+                ),
+                "src/shell/run.sh": "cat src/shell/data/*.txt",
+                "src/shell/data/a.txt": "a\n",
+                "src/shell/data/b.txt": "b\n",
+            }
+        )
+        rule_runner.chmod("src/shell/run.sh", 0o777)
+        for path in ("run.sh", "data/a.txt", "data/b.txt"):
+            os.utime(os.path.join(rule_runner.build_root, "src/shell", path), (mtime, mtime))
+
+        target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+        package = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+        digests.append(package.digest)
+
+    assert digests[0] == digests[1]
+    if engine == "makeself" and not layered:
+        # The total size of the files, not `du -ks`, which counts at least a block for each.
+        (archive,) = rule_runner.request(DigestContents, [digests[0]])
+        assert b"Uncompressed size: 0 KB" in archive.content
+
+
+@pytest.mark.parametrize("engine", ["makeself", "python"])
+def test_makeself_package_variants(rule_runner: RuleRunner, engine: str) -> None:
+    rule_runner.write_files(
+        {
+            "src/shell/BUILD": dedent(
+                f"""\
+                makeself_archive(
+                    name="archive",
+                    startup_script="run.sh",
+                    engine="{engine}",
+                    variants={{"migrate": "./src/shell/run.sh migrate", "shell": "echo shell"}},
+                )
+                """
+            ),
+            "src/shell/run.sh": 'echo "run $@"',
+        }
+    )
+    rule_runner.chmod("src/shell/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+    package = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+    assert [artifact.relpath for artifact in package.artifacts] == [
+        "src.shell/archive.run",
+        "src.shell/archive-migrate.run",
+        "src.shell/archive-shell.run",
+    ]
+
+    outputs = []
+    for artifact in package.artifacts:
+        assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
+        assert artifact.relpath is not None
+        result = rule_runner.request(
+            ProcessResult,
+            [
+                RunMakeselfArchive(
+                    exe=artifact.relpath,
+                    description=f"Run {artifact.relpath}",
+                    input_digest=package.digest,
+                    compression=artifact.compression,
+                )
+            ],
+        )
+        outputs.append(result.stdout)
+    assert outputs == [b"run \n", b"run migrate\n", b"shell\n"]
+
+
+@pytest.mark.parametrize("engine", ["makeself", "python"])
+def test_makeself_package_volumes(rule_runner: RuleRunner, engine: str) -> None:
+    rule_runner.write_files(
+        {
+            "src/shell/BUILD": dedent(
+                f"""\
+                files(name="data", sources=["data.bin"])
+
+                makeself_archive(
+                    name="archive",
+                    startup_script="run.sh",
+                    files=[":data"],
+                    compression="none",
+                    engine="{engine}",
+                    max_volume_size=8192,
+                )
+                """
+            ),
+            "src/shell/run.sh": "wc -c < src/shell/data.bin",
+            "src/shell/data.bin": "x" * 20000,
+        }
+    )
+    rule_runner.chmod("src/shell/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+    package = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+    artifact, *volumes = package.artifacts
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
+    assert artifact.relpath == "src.shell/archive.run"
+    assert len(volumes) >= 3
+    assert artifact.volumes == tuple(volume.relpath for volume in volumes)
+    assert artifact.volumes[0] == "src.shell/archive.run.001"
+
+    result = rule_runner.request(
+        ProcessResult,
+        [
+            RunMakeselfArchive(
+                exe=artifact.relpath,
+                description="Run split makeself archive",
+                input_digest=package.digest,
+                compression=artifact.compression,
+                integrity=artifact.integrity,
+                volumes=True,
+            )
+        ],
+    )
+    assert result.stdout.strip() == b"20000"
+
+
+@pytest.mark.parametrize("layered", [False, True])
+def test_makeself_package_parallel_decompression(layered: bool) -> None:
+    rule_runner = _rule_runner("--makeself-bytes-per-compression-thread=1")
+    rule_runner.write_files(
+        {
+            "src/shell/BUILD": dedent(
+                f"""\
+                makeself_archive(
+                    name="archive",
+                    startup_script="run.sh",
+                    compression="xz",
+                    engine="python",
+                    layered={layered},
+                    parallel_decompression=True,
+                )
+                """
+            ),
+            "src/shell/run.sh": 'echo "threads: $SETUP_THREADS"',
+        }
+    )
+    rule_runner.chmod("src/shell/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+    package = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+    artifact = package.artifacts[0]
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
+    assert artifact.relpath is not None
+
+    result = rule_runner.request(
+        ProcessResult,
+        [
+            RunMakeselfArchive(
+                exe=artifact.relpath,
+                description="Run makeself archive on several threads",
+                input_digest=package.digest,
+                compression=artifact.compression,
+                decompression_threads=4,
+            )
+        ],
+    )
+    threads = result.stdout.decode().strip().split(": ")[1]
+    assert 1 <= int(threads) <= 4
+
+
+def test_makeself_package_install_dir() -> None:
+    rule_runner = _rule_runner()
+    rule_runner.write_files(
+        {
+            "src/shell/BUILD": dedent(
+                """\
+                makeself_archive(
+                    name="archive",
+                    startup_script="run.sh",
+                    engine="python",
+                    install_dir="installed",
+                )
+                """
+            ),
+            "src/shell/run.sh": "pwd; ls -a",
+        }
+    )
+    rule_runner.chmod("src/shell/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+    package = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+    artifact = package.artifacts[0]
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
+    assert artifact.relpath is not None
+
+    result = rule_runner.request(
+        ProcessResult,
+        [
+            RunMakeselfArchive(
+                exe=artifact.relpath,
+                description="Run makeself archive with an install directory",
+                input_digest=package.digest,
+                compression=artifact.compression,
+            )
+        ],
+    )
+    cwd, *files = result.stdout.decode().split()
+    assert re.search(r"/installed/[0-9a-f]{16}$", cwd)
+    assert ".makeself-installed" in files
+
+
+@pytest.mark.parametrize("layered", [False, True])
+def test_makeself_package_deduplicate(rule_runner: RuleRunner, layered: bool) -> None:
+    rule_runner.write_files(
+        {
+            "src/shell/BUILD": dedent(
+                f"""\
+                files(name="a", sources=["a/data.bin"])
+                files(name="b", sources=["b/data.bin"])
+
+                makeself_archive(
+                    name="archive",
+                    startup_script="run.sh",
+                    files=[":a", ":b"],
+                    compression="none",
+                    engine="python",
+                    layered={layered},
+                    deduplicate=True,
+                )
+                """
+            ),
+            "src/shell/run.sh": dedent(
+                """\
+                cat src/shell/a/data.bin src/shell/b/data.bin | wc -c
+                test src/shell/a/data.bin -ef src/shell/b/data.bin && echo linked
+                """
+            ),
+            "src/shell/a/data.bin": "x" * 20000,
+            "src/shell/b/data.bin": "x" * 20000,
+        }
+    )
+    rule_runner.chmod("src/shell/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+    package = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+    artifact = package.artifacts[0]
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
+    assert artifact.relpath is not None
+    assert "0.0 MiB deduplicated" in artifact.extra_log_lines[1]
+
+    result = rule_runner.request(
+        ProcessResult,
+        [
+            RunMakeselfArchive(
+                exe=artifact.relpath,
+                description="Run deduplicated makeself archive",
+                input_digest=package.digest,
+                compression=artifact.compression,
+            )
+        ],
+    )
+    assert result.stdout.split() == [b"40000", b"linked"]
+
+
+def test_makeself_package_deduplicate_unsupported(rule_runner: RuleRunner) -> None:
+    rule_runner.write_files(
+        {
+            "src/shell/BUILD": dedent(
+                """\
+                files(name="data", sources=["*.bin"])
+
+                makeself_archive(
+                    name="archive",
+                    startup_script="run.sh",
+                    files=[":data"],
+                    engine="makeself",
+                    deduplicate=True,
+                )
+                """
+            ),
+            "src/shell/run.sh": "echo ok",
+            "src/shell/a.bin": "x" * 20000,
+            "src/shell/b.bin": "x" * 20000,
+        }
+    )
+    rule_runner.chmod("src/shell/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+    package = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+    assert "deduplicated" not in package.artifacts[0].extra_log_lines[1]
+
+
+def test_makeself_package_include_exclude(rule_runner: RuleRunner) -> None:
+    rule_runner.write_files(
+        {
+            "src/shell/BUILD": dedent(
+                """\
+                files(name="data", sources=["data/**/*"])
+
+                makeself_archive(
+                    name="archive",
+                    startup_script="run.sh",
+                    files=[":data"],
+                    include=["src/shell/data/**"],
+                    exclude=["**/__pycache__", "**/*.pyi"],
+                )
+                """
+            ),
+            "src/shell/run.sh": "find . -type f",
+            "src/shell/data/app.py": "",
+            "src/shell/data/app.pyi": "",
+            "src/shell/data/__pycache__/app.pyc": "x" * 100,
+            "src/shell/data/README.md": "",
+        }
+    )
+    rule_runner.chmod("src/shell/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+    field_set = MakeselfArchiveFieldSet.create(target)
+    inputs = rule_runner.request(MakeselfArchiveInputs, [field_set])
+    assert (inputs.excluded_files, inputs.excluded_bytes) == (2, 100)
+
+    package = rule_runner.request(BuiltPackage, [field_set])
+    artifact = package.artifacts[0]
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
+    assert artifact.relpath is not None
+    result = rule_runner.request(
+        ProcessResult,
+        [
+            RunMakeselfArchive(
+                exe=artifact.relpath,
+                description="Run filtered makeself archive",
+                input_digest=package.digest,
+                compression=artifact.compression,
+            )
+        ],
+    )
+    assert sorted(result.stdout.split()) == [
+        b"./src/shell/data/README.md",
+        b"./src/shell/data/app.py",
+        b"./src/shell/run.sh",
+    ]
+
+
+def test_makeself_package_flattens_nested_archives(rule_runner: RuleRunner) -> None:
+    rule_runner.write_files(
+        {
+            "src/inner/BUILD": dedent(
+                """\
+                files(name="data", sources=["data.txt"])
+
+                makeself_archive(
+                    name="inner",
+                    startup_script="run.sh",
+                    files=[":data"],
+                    variants={"other": "cat src/inner/data.txt"},
+                )
+                """
+            ),
+            "src/inner/run.sh": 'echo "inner $@"; cat src/inner/data.txt',
+            "src/inner/data.txt": "data",
+            "src/outer/BUILD": dedent(
+                """\
+                makeself_archive(
+                    name="outer",
+                    startup_script="run.sh",
+                    packages=["src/inner:inner"],
+                )
+                """
+            ),
+            "src/outer/run.sh": dedent(
+                """\
+                ./src.inner/inner.run --quiet -- a
+                ./src.inner/inner-other.run
+                """
+            ),
+        }
+    )
+    rule_runner.chmod("src/inner/run.sh", 0o777)
+    rule_runner.chmod("src/outer/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/outer", target_name="outer"))
+    field_set = MakeselfArchiveFieldSet.create(target)
+    inputs = rule_runner.request(MakeselfArchiveInputs, [field_set])
+    assert inputs.packages.input_files == 4
+
+    package = rule_runner.request(BuiltPackage, [field_set])
+    artifact = package.artifacts[0]
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
+    assert artifact.relpath is not None
+    result = rule_runner.request(
+        ProcessResult,
+        [
+            RunMakeselfArchive(
+                exe=artifact.relpath,
+                description="Run makeself archive with a nested one",
+                input_digest=package.digest,
+                compression=artifact.compression,
+            )
+        ],
+    )
+    assert result.stdout.split() == [b"inner", b"a", b"data", b"data"]
+
+
+def test_makeself_package_loose_pexes(rule_runner: RuleRunner) -> None:
+    rule_runner.write_files(
+        {
+            # A zip with a `PEX-INFO` and a `__main__.py` is all it takes to pass for a PEX.
+            "BUILD": dedent(
+                """\
+                files(name="pex", sources=["PEX-INFO", "__main__.py"])
+                archive(name="app", format="zip", files=[":pex"], output_path="src.python/app.pex")
+                """
+            ),
+            "PEX-INFO": "{}",
+            "__main__.py": "print('hello')",
+            "src/shell/BUILD": dedent(
+                """\
+                makeself_archive(
+                    name="archive",
+                    startup_script="run.sh",
+                    packages=["//:app"],
+                    pex_layout="loose",
+                )
+                """
+            ),
+            "src/shell/run.sh": "./src.python/app.pex",
+        }
+    )
+    rule_runner.chmod("src/shell/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+    field_set = MakeselfArchiveFieldSet.create(target)
+    inputs = rule_runner.request(MakeselfArchiveInputs, [field_set])
+    assert inputs.package_addresses == (Address("", target_name="app"),)
+    contents = {
+        content.path: content
+        for content in rule_runner.request(DigestContents, [inputs.package_digests[0]])
+    }
+    assert sorted(contents) == [
+        "src.python/app.pex",
+        "src.python/app.pex.loose/PEX-INFO",
+        "src.python/app.pex.loose/__main__.py",
+    ]
+    launcher = contents["src.python/app.pex"]
+    assert launcher.is_executable
+    assert b'exec python3 "`dirname "$0"`"/app.pex.loose "$@"' in launcher.content
+
+    package = rule_runner.request(BuiltPackage, [field_set])
+    assert [artifact.relpath for artifact in package.artifacts] == ["src.shell/archive.run"]
+
+
+@pytest.mark.parametrize(
+    "data, compression",
+    [
+        (b"hello world\n" * 100_000, MakeselfCompression.GZIP),
+        (os.urandom(1024 * 1024), MakeselfCompression.NONE),
+    ],
+    ids=["text", "random"],
+)
+def test_makeself_package_auto_compression(
+    rule_runner: RuleRunner, data: bytes, compression: MakeselfCompression
+) -> None:
+    rule_runner.write_files(
+        {
+            "src/shell/BUILD": dedent(
+                """\
+                files(name="data", sources=["data.bin"])
+
+                makeself_archive(
+                    name="archive",
+                    startup_script="run.sh",
+                    files=[":data"],
+                    compression="auto",
+                )
+                """
+            ),
+            "src/shell/run.sh": "wc -c < src/shell/data.bin",
+            "src/shell/data.bin": data,
+        }
+    )
+    rule_runner.chmod("src/shell/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+    package = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+    artifact = package.artifacts[0]
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
+    assert artifact.compression == compression
+    assert artifact.extra_log_lines[2].startswith(f"  auto compression: {compression.value} (")
+    assert artifact.relpath is not None
+
+    result = rule_runner.request(
+        ProcessResult,
+        [
+            RunMakeselfArchive(
+                exe=artifact.relpath,
+                description="Run makeself archive with auto compression",
+                input_digest=package.digest,
+                compression=artifact.compression,
+            )
+        ],
+    )
+    assert int(result.stdout) == len(data)
+
+
+@pytest.mark.parametrize("layered", [False, True])
+def test_makeself_package_zstd_dictionary(rule_runner: RuleRunner, layered: bool) -> None:
+    agents = ("billing", "search", "mail")
+    build = [
+        dedent(
+            f"""\
+            makeself_zstd_dictionary(
+                name="dictionary",
+                archives=[{", ".join(f'":{agent}"' for agent in agents)}],
+                max_size=1024,
+            )
+            """
+        )
+    ]
+    files = {"src/agents/run.sh": "cat src/agents/*/*.yaml | wc -l"}
+    for agent in agents:
+        build.append(
+            dedent(
+                f"""\
+                files(name="{agent}-config", sources=["{agent}/*.yaml"])
+
+                makeself_archive(
+                    name="{agent}",
+                    startup_script="run.sh",
+                    files=[":{agent}-config"],
+                    compression="zstd",
+                    engine="python",
+                    layered={layered},
+                    zstd_dictionary=":dictionary",
+                )
+                """
+            )
+        )
+        for index in range(8):
+            files[f"src/agents/{agent}/{index}.yaml"] = dedent(
+                f"""\
+                service: {agent}-{index}
+                listen:
+                  port: {8000 + index}
+                metrics:
+                  endpoint: https://metrics.example.com/api/v2/push/{agent}-{index}
+                """
+            )
+    rule_runner.write_files({"src/agents/BUILD": "\n".join(build), **files})
+    rule_runner.chmod("src/agents/run.sh", 0o777)
+
+    target = rule_runner.get_target(Address("src/agents", target_name="dictionary"))
+    dictionary = rule_runner.request(BuiltPackage, [MakeselfZstdDictionaryFieldSet.create(target)])
+    (dictionary_artifact,) = dictionary.artifacts
+    assert dictionary_artifact.relpath is not None
+    assert re.fullmatch(r"src\.agents/dictionary-\d+\.zdict", dictionary_artifact.relpath)
+
+    target = rule_runner.get_target(Address("src/agents", target_name="billing"))
+    package = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+    artifact, shipped_dictionary = package.artifacts
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact)
+    assert artifact.relpath is not None
+    assert shipped_dictionary.relpath == dictionary_artifact.relpath
+    assert artifact.extra_log_lines[2].startswith("  zstd dictionary: dictionary-")
+
+    result = rule_runner.request(
+        ProcessResult,
+        [
+            RunMakeselfArchive(
+                exe=artifact.relpath,
+                description="Run makeself archive compressed with a zstd dictionary",
+                input_digest=package.digest,
+                compression=artifact.compression,
+            )
+        ],
+    )
+    assert int(result.stdout) == 5 * 8
+
+
+@pytest.mark.parametrize("layered", [False, True])
+def test_makeself_package_delta_from(
+    rule_runner: RuleRunner, tmp_path: Path, layered: bool
+) -> None:
+    def package(version: str, delta_from: str) -> Dict[str, bytes]:
+        rule_runner.write_files(
+            {
+                "src/shell/BUILD": dedent(
+                    f"""\
+                    files(name="data", sources=["data.bin"])
+                    files(name="version", sources=["version"])
+                    files(name="previous", sources=["previous/archive.run"])
+
+                    makeself_archive(
+                        name="archive",
+                        startup_script="run.sh",
+                        files=[":data", ":version"],
+                        compression="none",
+                        engine="python",
+                        layered={layered},
+                        delta_from=[{delta_from}],
+                    )
+                    """
+                ),
+                "src/shell/version": version,
+            }
+        )
+        target = rule_runner.get_target(Address("src/shell", target_name="archive"))
+        built = rule_runner.request(BuiltPackage, [MakeselfArchiveFieldSet.create(target)])
+        contents = rule_runner.request(DigestContents, [built.digest])
+        assert [artifact.relpath for artifact in built.artifacts] == [
+            content.path for content in contents
+        ]
+        return {content.path: content.content for content in contents}
+
+    rule_runner.write_files(
+        {"src/shell/run.sh": "cat src/shell/version", "src/shell/data.bin": os.urandom(100000)}
+    )
+    rule_runner.chmod("src/shell/run.sh", 0o777)
+    previous = package("1.0", "")["src.shell/archive.run"]
+    rule_runner.write_files({"src/shell/previous/archive.run": previous})
+
+    built = package("1.1", '":previous"')
+    delta_path = next(path for path in built if path.endswith(".delta"))
+    assert re.fullmatch(r"src\.shell/archive\.run\.from-[0-9a-f]{12}\.delta", delta_path)
+    assert len(built[delta_path]) < 20000
+
+    (tmp_path / "previous.run").write_bytes(previous)
+    (tmp_path / "archive.run.delta").write_bytes(built[delta_path])
+    result = subprocess.run(
+        ["/bin/sh", "archive.run.delta", "previous.run", "archive.run"],
+        stderr=subprocess.PIPE,
+        cwd=tmp_path,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+    assert (tmp_path / "archive.run").read_bytes() == built["src.shell/archive.run"]
@@ -1,33 +1,153 @@
 import os
+from textwrap import dedent
 
 from pants.core.goals.package import BuiltPackage, PackageFieldSet
 from pants.core.goals.run import RunRequest
+from pants.core.util_rules.system_binaries import BinaryShims, BinaryShimsRequest
+from pants.engine.fs import CreateDigest, Digest, FileContent, MergeDigests
 from pants.engine.process import Process
-from pants.engine.rules import Get, collect_rules, rule
-from pants_backend_makeself.goals.package import MakeselfArchiveFieldSet
-from pants_backend_makeself.makeself import RunMakeselfArchive
+from pants.engine.rules import Get, MultiGet, collect_rules, rule
+from pants_backend_makeself.goals.package import (
+    BuiltMakeselfArchiveArtifact,
+    MakeselfArchiveFieldSet,
+)
+from pants_backend_makeself.makeself import MakeselfSubsystem, RunMakeselfArchive
+from pants_backend_makeself.system_binaries import MakeselfBinaries
+
+_RUN_CACHE_NAME = "makeself_run"
+_RUN_CACHE_DIR = ".cache/makeself_run"
+_RUN_CACHED_SCRIPT = "__run_cached.sh"
+
+# Extracts the archive into `cache/key` unless a completed extraction is already there, evicts the
+# least recently used entries and execs the startup script from the cached tree, the same way the
+# makeself header would after extracting to a temporary directory.
+#
+# Entries are only ever renamed into place complete. A run holds a shared lock on the `.lock` of its
+# entry until the startup script and its children exit, and evicting an entry takes an exclusive
+# one, so entries in use are never removed.
+_RUN_CACHED_SCRIPT_CONTENT = dedent(
+    """\
+    set -euo pipefail
+
+    archive="$1"
+    cache="$2"
+    key="$3"
+    script="$4"
+    max_entries="$5"
+    shift 5
+
+    USER_PWD="${PWD}"
+    entry="${cache}/${key}"
+    mkdir -p "${cache}"
+    for attempt in 1 2 3 4 5; do
+      if [[ ! -f "${entry}/.complete" ]]; then
+        staging="${cache}/.staging.${key}.$$"
+        rm -rf "${staging}"
+        "${archive}" --accept --noprogress --nox11 --nochown --nodiskspace --quiet \\
+          --noexec --keep --target "${staging}"
+        : > "${staging}/.complete"
+        # Fails when another run won the race, its tree is used instead.
+        mv -T "${staging}" "${entry}" 2>/dev/null || rm -rf "${staging}"
+      fi
+      # The entry may be evicted until the lock is held, in which case it is extracted again.
+      if cd "${entry}" 2>/dev/null && exec 9>> .lock && flock -s 9 && [[ -f .complete ]]; then
+        break
+      fi
+      exec 9>&-
+      if [[ "${attempt}" == 5 ]]; then
+        echo "Cannot extract ${archive} into ${entry}" >&2
+        exit 1
+      fi
+    done
+
+    rm -f .last_used
+    : > .last_used
+    ls -1t "${cache}" | tail -n +$((max_entries + 1)) | while read -r stale; do
+      [[ "${stale}" != "${key}" ]] || continue
+      evicted="${cache}/.evicted.${stale}.$$"
+      (
+        exec 8>> "${cache}/${stale}/.lock" && flock -xn 8 &&
+          mv -T "${cache}/${stale}" "${evicted}" && rm -rf "${evicted}"
+      ) 2>/dev/null || true
+    done
+
+    ARCHIVE_DIR="$(dirname "${archive}")"
+    export USER_PWD ARCHIVE_DIR
+    exec "${script}" "$@"
+    """
+)
+
+
+def _chroot_path(path: str) -> str:
+    return os.pathsep.join(os.path.join("{chroot}", entry) for entry in path.split(os.pathsep))
 
 
 @rule
-async def create_makeself_archive_run_request(field_set: MakeselfArchiveFieldSet) -> RunRequest:
+async def create_makeself_archive_run_request(
+    field_set: MakeselfArchiveFieldSet,
+    makeself: MakeselfSubsystem,
+    binaries: MakeselfBinaries,
+) -> RunRequest:
     package = await Get(BuiltPackage, PackageFieldSet, field_set)
 
-    exe = package.artifacts[0].relpath
+    artifact = package.artifacts[0]
+    exe = artifact.relpath
     assert exe is not None, package
+    assert isinstance(artifact, BuiltMakeselfArchiveArtifact), artifact
     process = await Get(
         Process,
         RunMakeselfArchive(
             exe=exe,
             input_digest=package.digest,
             description="Run makeself archive",
+            compression=artifact.compression,
+            integrity=artifact.integrity,
+            volumes=bool(artifact.volumes),
+        ),
+    )
+
+    # Without `flock`, runs couldn't tell which cached entries are in use.
+    flock = binaries.find("flock")
+    if not makeself.run_cache or artifact.startup_script is None or flock is None:
+        return RunRequest(
+            digest=process.input_digest,
+            args=(os.path.join("{chroot}", process.argv[0]),) + process.argv[1:],
+            extra_env={**process.env, "PATH": _chroot_path(process.env["PATH"])},
+            immutable_input_digests=process.immutable_input_digests,
+        )
+
+    rationale = "run makeself archive from the extraction cache"
+    bash, *paths = binaries.require("bash", "ls", "mv", rationale=rationale)
+    shims, script_digest = await MultiGet(
+        Get(BinaryShims, BinaryShimsRequest(paths=(*paths, flock), rationale=rationale)),
+        Get(
+            Digest,
+            CreateDigest([FileContent(_RUN_CACHED_SCRIPT, _RUN_CACHED_SCRIPT_CONTENT.encode())]),
         ),
     )
+    digest = await Get(Digest, MergeDigests((process.input_digest, script_digest)))
 
     return RunRequest(
-        digest=process.input_digest,
-        args=(os.path.join("{chroot}", process.argv[0]),) + process.argv[1:],
-        extra_env=process.env,
-        immutable_input_digests=process.immutable_input_digests,
+        digest=digest,
+        args=(
+            bash.path,
+            os.path.join("{chroot}", _RUN_CACHED_SCRIPT),
+            os.path.join("{chroot}", exe),
+            os.path.join("{chroot}", _RUN_CACHE_DIR),
+            package.digest.fingerprint,
+            artifact.startup_script,
+            str(max(1, makeself.run_cache_max_entries)),
+            *artifact.scriptargs,
+        ),
+        extra_env={
+            **process.env,
+            "PATH": _chroot_path(os.pathsep.join((process.env["PATH"], shims.path_component))),
+        },
+        immutable_input_digests={
+            **process.immutable_input_digests,
+            **shims.immutable_input_digests,
+        },
+        append_only_caches={_RUN_CACHE_NAME: _RUN_CACHE_DIR},
     )
 
 
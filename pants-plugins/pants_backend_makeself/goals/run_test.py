@@ -0,0 +1,77 @@
+import fcntl
+import subprocess
+from pathlib import Path
+
+from pants_backend_makeself.goals.run import _RUN_CACHED_SCRIPT_CONTENT
+
+# Stands in for a makeself archive run with `--noexec --target DIR`, and counts its extractions.
+_ARCHIVE = """\
+#!/bin/sh
+while test $# -gt 0; do
+    test x"$1" = x--target && target="$2"
+    shift
+done
+echo >> "$0.extractions"
+mkdir -p "$target"
+printf '#!/bin/sh\\necho "{version} $*"\\n' > "$target/run.sh"
+chmod 755 "$target/run.sh"
+"""
+
+
+def _archive(tmp_path: Path, version: str) -> Path:
+    archive = tmp_path / f"{version}.run"
+    archive.write_text(_ARCHIVE.format(version=version))
+    archive.chmod(0o755)
+    return archive
+
+
+def _extractions(archive: Path) -> int:
+    extractions = archive.with_name(f"{archive.name}.extractions")
+    return len(extractions.read_text().splitlines()) if extractions.exists() else 0
+
+
+def _run_cached(
+    tmp_path: Path, archive: Path, key: str, *args: str, max_entries: int = 3
+) -> subprocess.CompletedProcess:
+    script = tmp_path / "run_cached.sh"
+    script.write_text(_RUN_CACHED_SCRIPT_CONTENT)
+    return subprocess.run(
+        ["bash", str(script), str(archive), str(tmp_path / "cache"), key, "./run.sh"]
+        + [str(max_entries), *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=tmp_path,
+        check=False,
+    )
+
+
+def test_run_cache_hit_and_miss(tmp_path: Path) -> None:
+    v1 = _archive(tmp_path, "v1")
+    v2 = _archive(tmp_path, "v2")
+
+    for args in (("a",), ("b", "c")):
+        result = _run_cached(tmp_path, v1, "key1", *args)
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.decode() == f"v1 {' '.join(args)}\n"
+    assert _extractions(v1) == 1
+
+    result = _run_cached(tmp_path, v2, "key2")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == b"v2 \n"
+    assert _extractions(v2) == 1
+    assert sorted(path.name for path in (tmp_path / "cache").iterdir()) == ["key1", "key2"]
+
+
+def test_run_cache_keeps_entries_in_use(tmp_path: Path) -> None:
+    v1 = _archive(tmp_path, "v1")
+    v2 = _archive(tmp_path, "v2")
+    assert _run_cached(tmp_path, v1, "key1").returncode == 0
+
+    with open(tmp_path / "cache" / "key1" / ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        assert _run_cached(tmp_path, v2, "key2", max_entries=1).returncode == 0
+        assert (tmp_path / "cache" / "key1" / ".complete").exists()
+
+    assert _run_cached(tmp_path, v2, "key2", max_entries=1).returncode == 0
+    assert sorted(path.name for path in (tmp_path / "cache").iterdir()) == ["key2"]
+    assert _extractions(v2) == 1
@@ -0,0 +1,632 @@
+"""Renders a makeself compatible self-extracting header.
+
+The header understands the same runtime flags as the one generated by `makeself.sh` and lays the
+payload out the same way: `skip` lines of shell followed by the compressed tar segments listed in
+`filesizes`, each with its own CRC, MD5 and SHA256 entry.
+
+This module only depends on the standard library, so it can be shipped into a sandbox next to the
+scripts that write archives.
+"""
+import shlex
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+NO_CRC = "0000000000"
+NO_MD5 = "0" * 32
+NO_SHA = "0" * 64
+
+DECOMPRESS_COMMANDS: Dict[str, str] = {
+    "gzip": "gzip -cd",
+    "pigz": "gzip -cd",
+    "zstd": "zstd -cdq",
+    "xz": "xz -cd",
+    "lz4": "lz4 -cdq",
+    "lzo": "lzop -cd",
+    "bzip2": "bzip2 -cd",
+    "bzip3": "bzip3 -dc",
+    "none": "cat",
+}
+
+# Decompressors using several threads, tried before `DECOMPRESS_COMMANDS` by archives built with
+# parallel decompression. `$threads` is expanded when the archive runs.
+PARALLEL_DECOMPRESS_COMMANDS: Dict[str, str] = {
+    "gzip": "pigz -cd -p $threads",
+    "pigz": "pigz -cd -p $threads",
+    "zstd": "pzstd -cdq -p $threads",
+    "xz": "xz -cd -T$threads",
+    "bzip2": "lbzip2 -cd -n $threads",
+}
+
+# Written into an install directory once the payload is completely extracted there.
+INSTALL_STAMP = ".makeself-installed"
+
+# The checksums stored in the header for each integrity mode.
+INTEGRITY_CHECKSUMS: Dict[str, Tuple[str, ...]] = {
+    "md5_crc": ("md5", "crc"),
+    "sha256": ("sha256",),
+    "md5": ("md5",),
+    "crc": ("crc",),
+    "none": (),
+}
+
+
+def compress_command(
+    compression: str,
+    level: Optional[int] = None,
+    threads: Optional[str] = None,
+    zstd_dictionary: Optional[str] = None,
+) -> Tuple[str, ...]:
+    """The argv compressing stdin to stdout with `compression`.
+
+    `threads` is only honoured by the codecs that can use several threads. `zstd_dictionary` is
+    the path of a dictionary trained with `zstd --train`, only `zstd` compresses with one.
+    """
+    if zstd_dictionary and compression != "zstd":
+        raise ValueError(f"Only zstd compresses with a dictionary, not {compression}.")
+    level_args: Tuple[str, ...] = () if level is None else (f"-{level}",)
+    if compression == "gzip":
+        return ("gzip", "-cn", *level_args)
+    if compression == "pigz":
+        return ("pigz", "-cn", *level_args, *(("-p", threads) if threads else ()))
+    if compression == "zstd":
+        ultra = ("--ultra",) if level is not None and level > 19 else ()
+        return (
+            "zstd",
+            "-cq",
+            *ultra,
+            *level_args,
+            *((f"-T{threads}",) if threads else ()),
+            *(("-D", zstd_dictionary) if zstd_dictionary else ()),
+        )
+    if compression == "xz":
+        return ("xz", "-c", *level_args, *((f"-T{threads}",) if threads else ()))
+    if compression == "lz4":
+        return ("lz4", "-cq", *level_args)
+    if compression == "lzo":
+        return ("lzop", "-c", *level_args)
+    if compression == "bzip2":
+        return ("bzip2", "-c", *level_args)
+    if compression == "bzip3":
+        return ("bzip3", "-ec")
+    if compression == "none":
+        return ("cat",)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+@dataclass(frozen=True)
+class Segment:
+    """One independently compressed tar stream of the payload."""
+
+    size: int
+    crc: str = NO_CRC
+    md5: str = NO_MD5
+    sha256: str = NO_SHA
+    usize_kb: int = 0
+
+
+def _quote(value: str) -> str:
+    """Quote `value` for use inside a double quoted shell string."""
+    for char in ("\\", '"', "$", "`"):
+        value = value.replace(char, f"\\{char}")
+    return f'"{value}"'
+
+
+def replace_variables(header: bytes, **values: str) -> bytes:
+    """Replace the first assignment of each of `values` in a rendered header.
+
+    Works on headers written by `makeself.sh` too, which assign the same variables one per line.
+    The number of lines is unchanged, so the `skip` of the header still holds.
+    """
+    lines = header.splitlines(keepends=True)
+    for name, value in values.items():
+        prefix = f"{name}=".encode()
+        for index, line in enumerate(lines):
+            if line.startswith(prefix):
+                lines[index] = f"{name}={_quote(value)}\n".encode()
+                break
+        else:
+            raise ValueError(f"The header doesn't assign `{name}`.")
+    return b"".join(lines)
+
+
+_PREAMBLE = """\
+#!/bin/sh
+# This script was generated by pants-backend-makeself and is compatible with Makeself 2.5.0
+# The license covering this archive and its contents, if any, is wholly independent of the
+# Makeself license (GPL)
+
+ORIG_UMASK=`umask`
+umask 077
+
+"""
+
+_BODY = r"""
+MS_Printf()
+{
+    test x"$quiet" = xy || printf "$@"
+}
+
+MS_Help()
+{
+    cat << EOH >&2
+Makeself version 2.5.0 compatible archive
+ 1) Getting help or info about $0 :
+  $0 --help   Print this message
+  $0 --info   Print embedded info : title, default target directory, embedded script ...
+  $0 --list   Print the list of files in the archive
+  $0 --check  Checks integrity of the archive
+  $0 --dumpconf  Print the archive configuration
+
+ 2) Running $0 :
+  $0 [options] [--] [additional arguments to embedded script]
+  with following options (in that order)
+  --confirm             Ask before running embedded script
+  --quiet               Do not print anything except error messages
+  --accept              Accept the license
+  --noexec              Do not run embedded script
+  --noexec-cleanup      Do not run embedded cleanup script, these archives have none
+  --keep                Do not erase target directory after running the embedded script
+  --keep-umask          Run the embedded script with the umask of the shell rather than 077
+  --nocheck             Do not verify the archive integrity, like \$SETUP_NOCHECK=1
+  --noprogress          Do not show the progress during the decompression
+  --nox11               Do not spawn an xterm
+  --nochown             Do not give the target folder to the current user
+  --chown               Give the target folder to the current user recursively
+  --nodiskspace         Do not check for available disk space
+  --threads n           Decompress with up to n threads if the archive was built for it,
+                        defaults to \$SETUP_THREADS or the number of processors
+  The zstd dictionary of the archive, if any, is looked up in the directories of
+  \$SETUP_ZSTD_DICTIONARY_PATH, then next to $0
+  --target dir          Extract directly to a target directory (absolute or relative)
+  --tar arg1 [arg2 ...] Access the contents of the archive through the tar command
+  --cleanup-args args   Arguments to the cleanup script, ignored as there is none
+  --                    Following arguments will be passed to the embedded script
+EOH
+}
+
+MS_Offset()
+{
+    head -n "$skip" "$1" | wc -c | tr -d " "
+}
+
+MS_Payload()
+{
+    tail -c +`expr "$2" + 1` "$1" | head -c "$3"
+}
+
+MS_Dictionary()
+{
+    dirs="$SETUP_ZSTD_DICTIONARY_PATH:$ARCHIVE_DIR"
+    save_ifs="$IFS"
+    IFS=:
+    for dir in $dirs; do
+        if test x"$dir" != x && test -f "$dir/$zdict"; then
+            IFS="$save_ifs"
+            zdictfile="$dir/$zdict"
+            return 0
+        fi
+    done
+    IFS="$save_ifs"
+    echo "Cannot find the zstd dictionary $zdict in \$SETUP_ZSTD_DICTIONARY_PATH or next to $0" >&2
+    return 1
+}
+
+MS_Decompress()
+{
+    if test x"$zdict" != x; then
+        MS_Dictionary || return 1
+        eval "$decompress -D \"\$zdictfile\""
+        return
+    fi
+    if test x"$pdecompress" != x; then
+        test x"$threads" = x && threads=`getconf _NPROCESSORS_ONLN 2>/dev/null`
+        pbinary=`echo $pdecompress | cut -d" " -f1`
+        if test "${threads:-1}" -gt 1 2>/dev/null && command -v $pbinary >/dev/null 2>&1; then
+            eval "$pdecompress"
+            return
+        fi
+    fi
+    eval "$decompress"
+}
+
+MS_Check()
+{
+    offset=`MS_Offset "$1"`
+    verb=$2
+    i=1
+    for s in $filesizes
+    do
+        sha=`echo $SHA | cut -d" " -f$i`
+        if test x"$sha" != x"$nosha"; then
+            if command -v sha256sum >/dev/null 2>&1; then
+                shasum=`MS_Payload "$1" $offset $s | sha256sum | cut -b-64`
+            elif command -v shasum >/dev/null 2>&1; then
+                shasum=`MS_Payload "$1" $offset $s | shasum -a 256 | cut -b-64`
+            else
+                shasum="$sha"
+                test x"$verb" = xy && echo " No sha256sum or shasum found, SHA256 skipped." >&2
+            fi
+            if test x"$shasum" != x"$sha"; then
+                echo "Error in SHA256 checksums: $shasum is different from $sha" >&2
+                exit 2
+            fi
+        fi
+        md5=`echo $MD5 | cut -d" " -f$i`
+        if test x"$md5" != x"$nomd5"; then
+            if command -v md5sum >/dev/null 2>&1; then
+                md5sum=`MS_Payload "$1" $offset $s | md5sum | cut -b-32`
+            else
+                md5sum="$md5"
+                test x"$verb" = xy && echo " No md5sum found, MD5 skipped." >&2
+            fi
+            if test x"$md5sum" != x"$md5"; then
+                echo "Error in MD5 checksums: $md5sum is different from $md5" >&2
+                exit 2
+            fi
+        fi
+        crc=`echo $CRCsum | cut -d" " -f$i`
+        if test x"$crc" != x"$nocrc"; then
+            sum1=`MS_Payload "$1" $offset $s | CMD_ENV=xpg4 cksum | cut -d" " -f1`
+            if test x"$sum1" != x"$crc"; then
+                echo "Error in checksums: $sum1 is different from $crc" >&2
+                exit 2
+            fi
+        fi
+        i=`expr $i + 1`
+        offset=`expr $offset + $s`
+    done
+    test x"$verb" = xy && echo " All good." >&2
+    return 0
+}
+
+MS_Link()
+{
+    mkdir -p "`dirname "$2"`" && { ln -f "$1" "$2" 2>/dev/null || cp -p "$1" "$2"; }
+}
+
+MS_Untar()
+{
+    offset=`MS_Offset "$0"`
+    for s in $filesizes
+    do
+        if MS_Payload "$0" $offset $s | MS_Decompress |
+            ( cd "$1" && umask $ORIG_UMASK && tar -xpf - ) 1>/dev/null; then
+            :
+        else
+            echo "Unable to decompress $0" >&2
+            return 1
+        fi
+        offset=`expr $offset + $s`
+    done
+    if ( cd "$1" && MS_Links ); then
+        :
+    else
+        echo "Unable to link the duplicate files of $0" >&2
+        return 1
+    fi
+}
+
+nosha=0000000000000000000000000000000000000000000000000000000000000000
+nomd5=00000000000000000000000000000000
+nocrc=0000000000
+noexec=n
+nocheck="$SETUP_NOCHECK"
+threads="$SETUP_THREADS"
+ownership=n
+confirm=n
+while true
+do
+    case "$1" in
+    -h | --help)
+        MS_Help
+        exit 0
+        ;;
+    -q | --quiet)
+        quiet=y
+        shift
+        ;;
+    --accept | --noprogress | --nox11 | --nochown)
+        shift
+        ;;
+    --chown)
+        ownership=y
+        shift
+        ;;
+    --confirm)
+        confirm=y
+        shift
+        ;;
+    --info)
+        echo Identification: "$label"
+        echo Target directory: "$targetdir"
+        echo Uncompressed size: $usize KB
+        echo Compression: $compression
+        echo Date of packaging: $packagingdate
+        test x"$installdir" != x && echo Installed once into: "$installdir/$installkey"
+        test x"$zdict" != x && echo zstd dictionary: "$zdict"
+        echo Built with pants-backend-makeself
+        echo Script run after extraction:
+        echo "    " $script $scriptargs
+        test x"$keep" = xy && echo "directory $targetdir is permanent" ||
+            echo "$targetdir will be removed after extraction"
+        exit 0
+        ;;
+    --dumpconf)
+        echo LABEL=\"$label\"
+        echo SCRIPT=\"$script\"
+        echo SCRIPTARGS=\"$scriptargs\"
+        echo archdirname=\"$targetdir\"
+        echo KEEP=$keep
+        echo COMPRESS=$compression
+        echo filesizes=\"$filesizes\"
+        echo totalsize=\"$totalsize\"
+        echo CRCsum=\"$CRCsum\"
+        echo MD5sum=\"$MD5\"
+        echo SHAsum=\"$SHA\"
+        echo SKIP=\"$skip\"
+        exit 0
+        ;;
+    --lsm)
+        echo "No LSM."
+        exit 0
+        ;;
+    --list)
+        echo Target directory: $targetdir
+        offset=`MS_Offset "$0"`
+        for s in $filesizes
+        do
+            MS_Payload "$0" $offset $s | MS_Decompress | tar -tvf - 2>/dev/null
+            offset=`expr $offset + $s`
+        done
+        exit 0
+        ;;
+    --tar)
+        arg1="$2"
+        shift 2 || { MS_Help; exit 1; }
+        offset=`MS_Offset "$0"`
+        for s in $filesizes
+        do
+            MS_Payload "$0" $offset $s | MS_Decompress | tar "$arg1" - "$@"
+            offset=`expr $offset + $s`
+        done
+        exit 0
+        ;;
+    --check)
+        MS_Check "$0" y
+        exit $?
+        ;;
+    --noexec)
+        noexec=y
+        shift
+        ;;
+    --noexec-cleanup)
+        shift
+        ;;
+    --cleanup-args)
+        shift 2 || { MS_Help; exit 1; }
+        ;;
+    --keep)
+        keep=y
+        shift
+        ;;
+    --keep-umask)
+        umask $ORIG_UMASK
+        shift
+        ;;
+    --nocheck)
+        nocheck=1
+        shift
+        ;;
+    --target)
+        keep=y
+        targetdir="${2:?ERROR: --target requires an argument}"
+        shift 2
+        ;;
+    --nodiskspace)
+        nodiskspace=y
+        shift
+        ;;
+    --threads)
+        threads="${2:?ERROR: --threads requires an argument}"
+        shift 2
+        ;;
+    --)
+        shift
+        break
+        ;;
+    -*)
+        echo Unrecognized flag : "$1" >&2
+        MS_Help
+        exit 1
+        ;;
+    *)
+        break
+        ;;
+    esac
+done
+
+# Archives with an install directory extract once into a directory keyed by their payload, which
+# only appears, by renaming a stamped staging directory, once complete: later runs start straight
+# from there. A directory without a stamp wasn't created that way and is left alone.
+extract=y
+installed=
+if test x"$installdir" != x && test x"$keep" = xn; then
+    eval "installbase=\"$installdir\""
+    installed="$installbase/$installkey"
+    for stale in "$installbase/.staging.$installkey".*; do
+        test -d "$stale" && ! kill -0 "${stale##*.}" 2>/dev/null && rm -rf "$stale"
+    done
+    if test -d "$installed" && test ! -f "$installed/$installstamp"; then
+        echo "Ignoring incomplete install directory $installed, remove it to install again" >&2
+        installed=
+    elif test -f "$installed/$installstamp"; then
+        extract=n
+    else
+        if ! mkdir -p "$installbase"; then
+            echo "Cannot create install directory $installbase" >&2
+            exit 1
+        fi
+        keep=y
+        targetdir="$installbase/.staging.$installkey.$$"
+    fi
+fi
+
+if test x"$extract" = xy; then
+    if test x"$nocheck" != x1; then
+        MS_Printf "Verifying archive integrity..."
+        MS_Check "$0"
+        MS_Printf " All good.\n"
+    fi
+
+    if test x"$keep" = xy; then
+        tmpdir="$targetdir"
+        mkdir -p "$tmpdir" || { echo "Cannot create target directory $tmpdir" >&2; exit 1; }
+    else
+        tmpdir="$TMPROOT/selfgz$$"
+        mkdir "$tmpdir" || { echo "Cannot create temporary directory $tmpdir" >&2; exit 1; }
+    fi
+
+    if test x"$nodiskspace" = xn && command -v df >/dev/null 2>&1; then
+        leftspace=`df -kP "$tmpdir" 2>/dev/null | tail -n 1 | tr -s " " | cut -d" " -f4`
+        if test -n "$leftspace" && test "$leftspace" -lt $usize; then
+            echo "Not enough space left in "`dirname $tmpdir`" ($leftspace KB)" \
+                "to decompress $0 ($usize KB)" >&2
+            echo "Use --nodiskspace option to skip this check and proceed anyway" >&2
+            test x"$keep" = xn && rm -rf "$tmpdir"
+            exit 1
+        fi
+    fi
+
+    MS_Printf "Uncompressing %s\n" "$label"
+    if MS_Untar "$tmpdir"; then
+        :
+    else
+        test x"$keep" = xn && rm -rf "$tmpdir"
+        exit 1
+    fi
+
+    if test x"$ownership" = xy; then
+        (cd "$tmpdir"; chown -R `id -u` .; chgrp -R `id -g` .)
+    fi
+fi
+
+if test x"$installed" != x; then
+    if test x"$extract" = xy; then
+        : > "$tmpdir/$installstamp"
+        if test -d "$installed"; then
+            # Another first run finished in the meantime.
+            rm -rf "$tmpdir"
+        else
+            mv "$tmpdir" "$installed"
+            # Another first run may have finished just now, and got the staging directory.
+            rm -rf "$installed/`basename "$tmpdir"`"
+        fi
+    fi
+    tmpdir="$installed"
+    keep=y
+fi
+
+res=0
+cd "$tmpdir"
+if test x"$script" != x && test x"$noexec" != xy; then
+    if test x"$confirm" = xy; then
+        printf "OK to execute: $script $scriptargs $* ? [Y/n] "
+        read yn
+        test x"$yn" = xn -o x"$yn" = xN && noexec=y
+    fi
+    if test x"$noexec" != xy; then
+        eval "\"$script\" $scriptargs \"\$@\""; res=$?
+        if test "$res" -ne 0; then
+            test x"$quiet" = xy || echo "The program '$script' returned an error code ($res)" >&2
+        fi
+    fi
+fi
+if test x"$keep" = xn; then
+    cd "$TMPROOT"
+    rm -rf "$tmpdir"
+fi
+exit $res
+"""
+
+
+def render_header(
+    *,
+    label: str,
+    script: str,
+    segments: Iterable[Segment],
+    compression: str,
+    scriptargs: str = "",
+    targetdir: str = "makeself",
+    keep: bool = False,
+    packaging_date: str = "",
+    parallel_decompression: bool = False,
+    install_dir: str = "",
+    install_key: str = "",
+    links: Iterable[Tuple[str, str]] = (),
+    zstd_dictionary: str = "",
+) -> bytes:
+    """Render the header to prepend to the concatenated `segments`.
+
+    With `parallel_decompression`, the archive decompresses with the codec's multithreaded
+    binary when the machine running it has one, see `PARALLEL_DECOMPRESS_COMMANDS`.
+
+    With `install_dir`, the archive extracts once into `install_dir/install_key` and later runs
+    start from there. Environment variables in `install_dir` are expanded when the archive runs.
+
+    `links` are `(original, duplicate)` paths of files left out of the payload because they have
+    the same content as another, which the archive hardlinks, or copies, once extracted.
+
+    `zstd_dictionary` is the file name of the dictionary a `zstd` payload was compressed with.
+    It isn't embedded: the archive looks it up in `SETUP_ZSTD_DICTIONARY_PATH`, then next to
+    itself, and always decompresses on a single thread with it.
+    """
+    if install_dir and not install_key:
+        raise ValueError("An install directory needs a key identifying the payload.")
+    if zstd_dictionary and compression != "zstd":
+        raise ValueError(f"Only zstd decompresses with a dictionary, not {compression}.")
+    segments = tuple(segments)
+    variables = (
+        ("CRCsum", " ".join(segment.crc for segment in segments)),
+        ("MD5", " ".join(segment.md5 for segment in segments)),
+        ("SHA", " ".join(segment.sha256 for segment in segments)),
+        ("label", label),
+        ("script", script),
+        ("scriptargs", scriptargs),
+        ("targetdir", targetdir),
+        ("filesizes", " ".join(str(segment.size) for segment in segments)),
+        ("totalsize", str(sum(segment.size for segment in segments))),
+        ("usize", str(sum(segment.usize_kb for segment in segments))),
+        ("keep", "y" if keep else "n"),
+        ("quiet", "n"),
+        ("nodiskspace", "n"),
+        ("compression", compression),
+        ("decompress", DECOMPRESS_COMMANDS[compression]),
+        (
+            "pdecompress",
+            PARALLEL_DECOMPRESS_COMMANDS.get(compression, "") if parallel_decompression else "",
+        ),
+        ("zdict", zstd_dictionary),
+        ("installdir", install_dir),
+        ("installkey", install_key),
+        ("installstamp", INSTALL_STAMP),
+        ("packagingdate", packaging_date),
+    )
+    environment = (
+        "TMPROOT=${TMPDIR:=/tmp}\n"
+        'USER_PWD="$PWD"\n'
+        "export USER_PWD\n"
+        'ARCHIVE_DIR=`dirname "$0"`\n'
+        "export ARCHIVE_DIR\n\n"
+    )
+    assignments = "".join(f"{name}={_quote(value)}\n" for name, value in variables)
+    link_commands = "".join(
+        f"    MS_Link {shlex.quote(original)} {shlex.quote(duplicate)} || return 1\n"
+        for original, duplicate in links
+    )
+    functions = f"\nMS_Links()\n{{\n{link_commands}    :\n}}\n"
+
+    def render(skip: int) -> str:
+        return f'{_PREAMBLE}{environment}{assignments}skip="{skip}"\n{functions}{_BODY}'
+
+    # The number of lines doesn't depend on the value of `skip`.
+    return render(render(0).count("\n")).encode()
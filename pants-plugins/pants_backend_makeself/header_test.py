@@ -0,0 +1,275 @@
+import hashlib
+import io
+import os
+import subprocess
+import tarfile
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+from pants_backend_makeself.header import (
+    INSTALL_STAMP,
+    Segment,
+    compress_command,
+    render_header,
+    replace_variables,
+)
+from pants_backend_makeself.variants import write_variant
+
+
+def _segment(files: Dict[str, str], compression: str) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mode = 0o755
+            tar.addfile(info, io.BytesIO(content.encode()))
+    return subprocess.run(
+        compress_command(compression), input=buffer.getvalue(), stdout=subprocess.PIPE, check=True
+    ).stdout
+
+
+def _write_archive(path: Path, compression: str, *payloads: bytes, **options: Any) -> None:
+    segments = []
+    for payload in payloads:
+        cksum = subprocess.run(["cksum"], input=payload, stdout=subprocess.PIPE, check=True)
+        segments.append(
+            Segment(
+                size=len(payload),
+                crc=cksum.stdout.split()[0].decode(),
+                md5=hashlib.md5(payload).hexdigest(),
+                sha256=hashlib.sha256(payload).hexdigest(),
+            )
+        )
+    header = render_header(
+        label="test archive",
+        script="./run.sh",
+        scriptargs="first",
+        segments=segments,
+        compression=compression,
+        **options,
+    )
+    path.write_bytes(header + b"".join(payloads))
+    path.chmod(0o755)
+
+
+def _run(path: Path, *args: str, **env: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [str(path), *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=path.parent,
+        env={**os.environ, "TMPDIR": str(path.parent), **env},
+        check=False,
+    )
+
+
+@pytest.mark.parametrize("compression", ["gzip", "bzip2", "none"])
+def test_segments_are_extracted_in_order(tmp_path: Path, compression: str) -> None:
+    archive = tmp_path / "test.run"
+    _write_archive(
+        archive,
+        compression,
+        _segment({"run.sh": '#!/bin/sh\necho "$@"\ncat data/a data/b\n'}, compression),
+        _segment({"data/a": "a\n"}, compression),
+        _segment({"data/b": "b\n"}, compression),
+    )
+
+    result = _run(archive, "--quiet", "--nox11", "--accept", "--", "second")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == b"first second\na\nb\n"
+    assert not list(tmp_path.glob("selfgz*"))
+
+
+def test_keep_target_noexec(tmp_path: Path) -> None:
+    archive = tmp_path / "test.run"
+    _write_archive(archive, "gzip", _segment({"run.sh": "#!/bin/sh\nexit 1\n"}, "gzip"))
+
+    result = _run(archive, "--quiet", "--noexec", "--keep", "--target", "out")
+    assert result.returncode == 0, result.stderr
+    assert (tmp_path / "out" / "run.sh").is_file()
+
+
+def test_corrupted_payload_fails_integrity_check(tmp_path: Path) -> None:
+    archive = tmp_path / "test.run"
+    _write_archive(archive, "gzip", _segment({"run.sh": "#!/bin/sh\necho ok\n"}, "gzip"))
+    data = bytearray(archive.read_bytes())
+    data[-12] ^= 0xFF
+    archive.write_bytes(bytes(data))
+
+    result = _run(archive, "--quiet")
+    assert result.returncode == 2
+    assert b"Error in SHA256 checksums" in result.stderr
+
+
+def test_makeself_flags(tmp_path: Path) -> None:
+    archive = tmp_path / "test.run"
+    _write_archive(archive, "gzip", _segment({"run.sh": "#!/bin/sh\numask\n"}, "gzip"))
+    archive.write_bytes(replace_variables(archive.read_bytes(), SHA="1" * 64))
+
+    assert _run(archive, "--quiet").returncode == 2
+    result = _run(archive, "--quiet", "--nocheck", "--noexec-cleanup", "--cleanup-args", "a b")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == b"0077\n"
+
+    umask = os.umask(0o027)
+    try:
+        result = _run(archive, "--quiet", "--nocheck", "--keep-umask")
+    finally:
+        os.umask(umask)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == b"0027\n"
+
+
+def test_variant_runs_its_own_command(tmp_path: Path) -> None:
+    archive = tmp_path / "test.run"
+    _write_archive(
+        archive,
+        "gzip",
+        _segment({"run.sh": "#!/bin/sh\necho run\n", "other.sh": '#!/bin/sh\necho "$@"\n'}, "gzip"),
+    )
+    variant = tmp_path / "test-other.run"
+    write_variant(str(archive), str(variant), "./other.sh 'a \"b\"' '$HOME'")
+
+    result = _run(variant, "--quiet", "--nox11", "--accept", "--", "c")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == b'a "b" $HOME c\n'
+    assert _run(variant, "--check").returncode == 0
+    assert _run(archive, "--quiet", "--nox11", "--accept").stdout == b"run\n"
+
+
+def test_replace_variables_requires_assignment() -> None:
+    with pytest.raises(ValueError):
+        replace_variables(b'#!/bin/sh\nlabel="x"\n', script="./run.sh")
+
+
+@pytest.mark.parametrize("threads", ["1", "4"])
+def test_parallel_decompression(tmp_path: Path, threads: str) -> None:
+    archive = tmp_path / "test.run"
+    payload = _segment({"run.sh": "#!/bin/sh\necho ok\n"}, "gzip")
+    cksum = subprocess.run(["cksum"], input=payload, stdout=subprocess.PIPE, check=True)
+    header = render_header(
+        label="test archive",
+        script="./run.sh",
+        segments=[Segment(size=len(payload), crc=cksum.stdout.split()[0].decode())],
+        compression="gzip",
+        parallel_decompression=True,
+    )
+    archive.write_bytes(header + payload)
+    archive.chmod(0o755)
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    pigz = bin_dir / "pigz"
+    pigz.write_text(f'#!/bin/sh\necho "$@" > {tmp_path}/pigz.args\nexec gzip -cd\n')
+    pigz.chmod(0o755)
+
+    result = _run(archive, "--quiet", PATH=f"{bin_dir}:{os.environ['PATH']}", SETUP_THREADS=threads)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == b"ok\n"
+    used = tmp_path / "pigz.args"
+    if threads == "1":
+        assert not used.exists()
+    else:
+        assert used.read_text().split() == ["-cd", "-p", threads]
+
+    result = _run(archive, "--quiet", "--threads", "2", SETUP_THREADS="1")
+    assert result.returncode == 0, result.stderr
+
+
+def test_help_names_environment_variables(tmp_path: Path) -> None:
+    archive = tmp_path / "test.run"
+    _write_archive(archive, "gzip", _segment({"run.sh": "#!/bin/sh\necho ok\n"}, "gzip"))
+
+    result = _run(archive, "--help", SETUP_THREADS="7", SETUP_ZSTD_DICTIONARY_PATH="/dicts")
+    assert b"defaults to $SETUP_THREADS or" in result.stderr
+    assert b"$SETUP_ZSTD_DICTIONARY_PATH, then" in result.stderr
+
+
+def _write_installing_archive(path: Path, install_dir: str) -> None:
+    payload = _segment({"run.sh": "#!/bin/sh\ncat data\n", "data": "extracted\n"}, "gzip")
+    header = render_header(
+        label="test archive",
+        script="./run.sh",
+        segments=[Segment(size=len(payload))],
+        compression="gzip",
+        install_dir=install_dir,
+        install_key="0123abcd",
+    )
+    path.write_bytes(header + payload)
+    path.chmod(0o755)
+
+
+def test_install_dir_extracts_once(tmp_path: Path) -> None:
+    archive = tmp_path / "test.run"
+    _write_installing_archive(archive, "$INSTALL_ROOT/app")
+    installed = tmp_path / "root" / "app" / "0123abcd"
+    stale = tmp_path / "root" / "app" / ".staging.0123abcd.999999999"
+    stale.mkdir(parents=True)
+
+    result = _run(archive, "--quiet", INSTALL_ROOT=str(tmp_path / "root"))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == b"extracted\n"
+    assert (installed / INSTALL_STAMP).is_file()
+    assert sorted(path.name for path in installed.parent.iterdir()) == ["0123abcd"]
+
+    # Later runs don't extract, so they see changes to the installed tree.
+    (installed / "data").write_text("installed\n")
+    result = _run(archive, "--quiet", INSTALL_ROOT=str(tmp_path / "root"))
+    assert result.stdout == b"installed\n"
+
+    # Unless asked to extract somewhere else.
+    result = _run(archive, "--quiet", "--target", "out", INSTALL_ROOT=str(tmp_path / "root"))
+    assert result.stdout == b"extracted\n"
+
+
+def test_install_dir_concurrent_first_runs(tmp_path: Path) -> None:
+    archive = tmp_path / "test.run"
+    _write_installing_archive(archive, str(tmp_path / "app"))
+
+    processes = [
+        subprocess.Popen(
+            [str(archive), "--quiet"],
+            stdout=subprocess.PIPE,
+            cwd=tmp_path,
+            env={**os.environ, "TMPDIR": str(tmp_path)},
+        )
+        for _ in range(8)
+    ]
+    assert [process.communicate()[0] for process in processes] == [b"extracted\n"] * 8
+    assert [process.returncode for process in processes] == [0] * 8
+    installed = tmp_path / "app" / "0123abcd"
+    assert sorted(path.name for path in installed.iterdir()) == [INSTALL_STAMP, "data", "run.sh"]
+
+    _run(archive, "--quiet")
+    assert sorted(path.name for path in installed.parent.iterdir()) == ["0123abcd"]
+
+
+def test_install_dir_without_stamp_is_ignored(tmp_path: Path) -> None:
+    archive = tmp_path / "test.run"
+    _write_installing_archive(archive, str(tmp_path / "app"))
+    installed = tmp_path / "app" / "0123abcd"
+    installed.mkdir(parents=True)
+
+    result = _run(archive, "--quiet")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == b"extracted\n"
+    assert b"incomplete install directory" in result.stderr
+    assert list(installed.iterdir()) == []
+
+
+def test_duplicates_are_linked(tmp_path: Path) -> None:
+    archive = tmp_path / "test.run"
+    _write_archive(
+        archive,
+        "gzip",
+        _segment({"run.sh": "#!/bin/sh\ncat 'lib/a b' copy/lib/c\n", "lib/a b": "a\n"}, "gzip"),
+        links=[("lib/a b", "copy/lib/c")],
+    )
+
+    result = _run(archive, "--quiet", "--noexec", "--keep", "--target", "out")
+    assert result.returncode == 0, result.stderr
+    original, duplicate = tmp_path / "out" / "lib" / "a b", tmp_path / "out" / "copy" / "lib" / "c"
+    assert duplicate.read_text() == "a\n"
+    assert duplicate.stat().st_ino == original.stat().st_ino
+    assert _run(archive, "--quiet", "--nox11", "--accept").stdout == b"a\na\n"
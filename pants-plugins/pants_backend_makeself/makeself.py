@@ -1,8 +1,13 @@
 import dataclasses
+import hashlib
+import io
 import logging
 import os
+import pkgutil
+import tarfile
+import time
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 from pants.core.util_rules import external_tool
 from pants.core.util_rules.external_tool import (
@@ -10,51 +15,41 @@ from pants.core.util_rules.external_tool import (
     ExternalToolRequest,
     TemplatedExternalTool,
 )
-from pants.core.util_rules.system_binaries import (
-    BashBinary,
-    BinaryShims,
-    BinaryShimsRequest,
-    CatBinary,
-    ChmodBinary,
-    MkdirBinary,
-    TarBinary,
+from pants.core.util_rules.system_binaries import BinaryPath, BinaryShims, BinaryShimsRequest
+from pants.engine.engine_aware import EngineAwareReturnType
+from pants.engine.fs import (
+    AddPrefix,
+    CreateDigest,
+    Digest,
+    DigestContents,
+    DigestEntries,
+    Directory,
+    FileContent,
+    FileEntry,
+    RemovePrefix,
 )
-from pants.engine.fs import Digest, RemovePrefix
 from pants.engine.platform import Platform
 from pants.engine.process import Process, ProcessCacheScope, ProcessResult
-from pants.engine.rules import Get, collect_rules, rule
+from pants.engine.rules import Get, MultiGet, collect_rules, rule, rule_helper
+from pants.option.option_types import BoolOption, EnumOption, IntOption, MemorySizeOption
+from pants.util.frozendict import FrozenDict
 from pants.util.logging import LogLevel
-from pants_backend_makeself.system_binaries import (
-    AwkBinary,
-    Base64Binary,
-    BasenameBinary,
-    Bzip2Binary,
-    CksumBinary,
-    CutBinary,
-    DateBinary,
-    DdBinary,
-    DfBinary,
-    DirnameBinary,
-    DuBinary,
-    ExprBinary,
-    FindBinary,
-    GpgBinary,
-    GzipBinary,
-    HeadBinary,
-    IdBinary,
-    Md5sumBinary,
-    PwdBinary,
-    RmBinary,
-    SedBinary,
-    ShBinary,
-    SortBinary,
-    TailBinary,
-    TestBinary,
-    TrBinary,
-    WcBinary,
-    XargsBinary,
-    XzBinary,
-    ZstdBinary,
+from pants.util.strutil import softwrap
+from pants_backend_makeself.header import (
+    INTEGRITY_CHECKSUMS,
+    NO_CRC,
+    NO_MD5,
+    NO_SHA,
+    Segment,
+    compress_command,
+    render_header,
+)
+from pants_backend_makeself.reader import extract_members
+from pants_backend_makeself.system_binaries import MakeselfBinaries
+from pants_backend_makeself.target_types import (
+    MakeselfCompression,
+    MakeselfEngine,
+    MakeselfIntegrity,
 )
 
 logger = logging.getLogger(__name__)
@@ -74,6 +69,281 @@ class MakeselfSubsystem(TemplatedExternalTool):
 
     default_url_template = "https://github.com/megastep/makeself/releases/download/release-{version}/makeself-{version}.run"
 
+    compression = EnumOption(
+        "--compression",
+        default=MakeselfCompression.GZIP,
+        help=softwrap(
+            """
+            Default compression for `makeself_archive` targets which don't set the
+            `compression` field.
+            """
+        ),
+    )
+    auto_compression_transfer_rate = MemorySizeOption(
+        "--auto-compression-transfer-rate",
+        default=10 * 1024 * 1024,
+        help=softwrap(
+            """
+            Bytes per second at which archives are shipped to where they run, weighing the
+            size of the archive against the time spent decompressing it for the `auto`
+            compression. The default is about a 100 Mbit/s link: with it, `xz` is picked over
+            `gzip` when it compresses the sample to at least 0.16 less of its size.
+            """
+        ),
+    )
+    auto_compression_runs_per_build = IntOption(
+        "--auto-compression-runs-per-build",
+        default=100,
+        help=softwrap(
+            """
+            How many times an archive is shipped and extracted for every time it is built,
+            weighing the startup time against the build time for the `auto` compression.
+            """
+        ),
+    )
+    compression_level = IntOption(
+        "--compression-level",
+        default=None,
+        help=softwrap(
+            """
+            Default compression level for `makeself_archive` targets which don't set the
+            `compression_level` field. If unset, makeself picks the codec's default.
+            """
+        ),
+    )
+    compression_threads = IntOption(
+        "--compression-threads",
+        default=0,
+        help=softwrap(
+            """
+            Maximum number of threads used to compress a single archive with a codec that
+            supports it (`pigz`, `zstd` and `xz`). `0` uses as many cores as Pants allots to the
+            process, `1` disables parallel compression.
+
+            Use `compression="pigz"` to get parallel gzip-compatible archives.
+            """
+        ),
+    )
+    bytes_per_compression_thread = MemorySizeOption(
+        "--bytes-per-compression-thread",
+        default=64 * 1024 * 1024,
+        help=softwrap(
+            """
+            Payload size that justifies one more compression thread. Archives smaller than this
+            are compressed on a single thread, so that several of them can be built at once.
+            """
+        ),
+    )
+    decompression_threads = IntOption(
+        "--decompression-threads",
+        default=0,
+        help=softwrap(
+            """
+            Maximum number of threads used to extract an archive built with
+            `parallel_decompression`, when Pants runs it itself. `0` sizes it with
+            `[makeself].bytes_per_compression_thread`, `1` disables parallel decompression.
+            """
+        ),
+    )
+    integrity = EnumOption(
+        "--integrity",
+        default=MakeselfIntegrity.MD5_CRC,
+        help=softwrap(
+            """
+            Default integrity checks for `makeself_archive` targets which don't set the
+            `integrity` field.
+            """
+        ),
+    )
+    deterministic = BoolOption(
+        "--deterministic",
+        default=False,
+        help=softwrap(
+            """
+            Build byte-identical archives from identical inputs, so that they can be shared
+            through the remote cache and deduplicated downstream.
+
+            The packaging date and the modification time of every archive member are set to
+            `SOURCE_DATE_EPOCH` (or the Unix epoch if unset), members are sorted by name and
+            ownership and permissions are normalized. With the `makeself` engine this relies
+            on GNU tar.
+
+            Both engines record the uncompressed size of the payload, used to check the free
+            disk space before extracting it, as the total size of its files rounded down to
+            KiB. It doesn't count the blocks they take on the filesystem.
+            """
+        ),
+    )
+    engine = EnumOption(
+        "--engine",
+        default=MakeselfEngine.MAKESELF,
+        help=softwrap(
+            """
+            Default engine for `makeself_archive` targets which don't set the `engine` field.
+            """
+        ),
+    )
+    link_packages = BoolOption(
+        "--link-packages",
+        default=True,
+        help=softwrap(
+            """
+            Symlink the files of `packages` into the packaging sandbox instead of copying them
+            there, and have the archive writer follow the links.
+
+            Large packages, like PEX files, are then read straight from the Pants store rather
+            than being written out again for every archive that includes them.
+            """
+        ),
+    )
+    run_cache = BoolOption(
+        "--run-cache",
+        default=True,
+        help=softwrap(
+            """
+            Extract archives run with `pants run` into a named cache keyed by the archive
+            digest, and start them straight from there while the archive doesn't change.
+
+            The startup script then runs in a directory shared between runs, so any files it
+            writes next to itself persist until the entry is evicted.
+
+            Needs `flock` to tell the entries in use from the ones which can be evicted,
+            archives are run without the cache where it isn't installed.
+            """
+        ),
+    )
+    run_cache_max_entries = IntOption(
+        "--run-cache-max-entries",
+        default=3,
+        help=softwrap(
+            """
+            How many extracted archives to keep in the `pants run` cache. The least recently
+            used ones are removed first.
+            """
+        ),
+    )
+
+
+COMPRESSION_FLAGS = FrozenDict(
+    {
+        MakeselfCompression.GZIP: "--gzip",
+        MakeselfCompression.PIGZ: "--pigz",
+        MakeselfCompression.ZSTD: "--zstd",
+        MakeselfCompression.XZ: "--xz",
+        MakeselfCompression.LZ4: "--lz4",
+        MakeselfCompression.LZO: "--lzo",
+        MakeselfCompression.BZIP2: "--bzip2",
+        MakeselfCompression.BZIP3: "--bzip3",
+        MakeselfCompression.NONE: "--nocomp",
+    }
+)
+
+PARALLEL_COMPRESSIONS = frozenset(
+    (MakeselfCompression.PIGZ, MakeselfCompression.ZSTD, MakeselfCompression.XZ)
+)
+
+PARALLEL_DECOMPRESSION_BINARIES = FrozenDict(
+    {
+        MakeselfCompression.GZIP: "pigz",
+        MakeselfCompression.PIGZ: "pigz",
+        MakeselfCompression.ZSTD: "pzstd",
+        MakeselfCompression.XZ: "xz",
+        MakeselfCompression.BZIP2: "lbzip2",
+    }
+)
+
+COMPRESSION_BINARIES = FrozenDict(
+    {
+        MakeselfCompression.GZIP: "gzip",
+        MakeselfCompression.PIGZ: "pigz",
+        MakeselfCompression.ZSTD: "zstd",
+        MakeselfCompression.XZ: "xz",
+        MakeselfCompression.LZ4: "lz4",
+        MakeselfCompression.LZO: "lzop",
+        MakeselfCompression.BZIP2: "bzip2",
+        MakeselfCompression.BZIP3: "bzip3",
+    }
+)
+
+
+DECOMPRESSION_BINARIES = FrozenDict(
+    {
+        MakeselfCompression.GZIP: "gzip",
+        MakeselfCompression.PIGZ: "gzip",
+        MakeselfCompression.ZSTD: "zstd",
+        MakeselfCompression.XZ: "xz",
+        MakeselfCompression.LZ4: "lz4",
+        MakeselfCompression.LZO: "lzop",
+        MakeselfCompression.BZIP2: "bzip2",
+        MakeselfCompression.BZIP3: "bzip3",
+    }
+)
+
+INTEGRITY_FLAGS = FrozenDict(
+    {
+        MakeselfIntegrity.MD5_CRC: (),
+        MakeselfIntegrity.SHA256: ("--sha256", "--nomd5", "--nocrc"),
+        MakeselfIntegrity.MD5: ("--nocrc",),
+        MakeselfIntegrity.CRC: ("--nomd5",),
+        MakeselfIntegrity.NONE: ("--nomd5", "--nocrc"),
+    }
+)
+
+# Interchangeable binaries computing each checksum, in order of preference.
+CHECKSUM_BINARIES = FrozenDict(
+    {
+        "crc": ("cksum",),
+        "md5": ("md5sum",),
+        "sha256": ("sha256sum", "shasum"),
+    }
+)
+
+RUN_MAKESELF_ARCHIVE_BINARIES = (
+    "awk",
+    "basename",
+    "bash",
+    "cat",
+    "cut",
+    "dd",
+    "df",
+    "dirname",
+    "expr",
+    "find",
+    "head",
+    "id",
+    "ln",
+    "mkdir",
+    "mv",
+    "pwd",
+    "rm",
+    "sed",
+    "tail",
+    "tar",
+    "test",
+    "tr",
+    "wc",
+)
+
+CREATE_MAKESELF_ARCHIVE_BINARIES = (
+    "awk",
+    "basename",
+    "cat",
+    "chmod",
+    "cut",
+    "date",
+    "dirname",
+    "expr",
+    "find",
+    "rm",
+    "sed",
+    "sh",
+    "sort",
+    "tar",
+    "tr",
+    "wc",
+    "xargs",
+)
+
 
 @dataclass(frozen=True)
 class RunMakeselfArchive:
@@ -82,75 +352,70 @@ class RunMakeselfArchive:
     description: str
     level: LogLevel = LogLevel.INFO
     output_directory: Optional[str] = None
+    # The compression the archive was built with, if known. Otherwise every decompressor
+    # installed on the machine is made available.
+    compression: Optional[MakeselfCompression] = None
+    # The checksums the archive was built with, if known. Otherwise makeself's default is assumed.
+    integrity: Optional[MakeselfIntegrity] = None
+    # Skip the integrity checks, for archives which come from a trusted source.
+    verify: bool = True
+    # The archive is split into volumes, see `max_volume_size`.
+    volumes: bool = False
+    # Maximum number of threads to decompress archives built with `parallel_decompression`
+    # with, handed over as `SETUP_THREADS`. `0` sizes it with the archive, `1` disables it.
+    decompression_threads: int = 1
+
+
+def _checksum_binaries(
+    binaries: MakeselfBinaries, integrity: MakeselfIntegrity, rationale: str
+) -> Tuple[BinaryPath, ...]:
+    return tuple(
+        binaries.require_any(*CHECKSUM_BINARIES[checksum], rationale=rationale)
+        for checksum in INTEGRITY_CHECKSUMS[integrity.value]
+    )
 
 
 @rule(desc="Run makeself archive", level=LogLevel.DEBUG)
 async def run_makeself_archive(
     request: RunMakeselfArchive,
-    awk: AwkBinary,
-    base64: Base64Binary,
-    basename: BasenameBinary,
-    bash: BashBinary,
-    bzip2: Bzip2Binary,
-    cat: CatBinary,
-    cut: CutBinary,
-    dd: DdBinary,
-    df: DfBinary,
-    dirname: DirnameBinary,
-    expr: ExprBinary,
-    find: FindBinary,
-    gpg: GpgBinary,
-    gzip: GzipBinary,
-    head: HeadBinary,
-    id: IdBinary,
-    md5sum: Md5sumBinary,
-    mkdir: MkdirBinary,
-    pwd: PwdBinary,
-    rm: RmBinary,
-    sed: SedBinary,
-    shasum: DateBinary,
-    tail: TailBinary,
-    tar: TarBinary,
-    test: TestBinary,
-    wc: WcBinary,
-    xz: XzBinary,
-    zstd: ZstdBinary,
+    binaries: MakeselfBinaries,
+    makeself: MakeselfSubsystem,
 ) -> Process:
+    rationale = "run makeself archive"
+    paths = binaries.require(*RUN_MAKESELF_ARCHIVE_BINARIES, rationale=rationale)
+    if request.compression is None:
+        decompressors = sorted(set(DECOMPRESSION_BINARIES.values()))
+        paths += tuple(filter(None, map(binaries.find, decompressors)))
+    elif decompressor := DECOMPRESSION_BINARIES.get(request.compression):
+        paths += binaries.require(decompressor, rationale=rationale)
+    concurrency = 1
+    parallel_decompressor = PARALLEL_DECOMPRESSION_BINARIES.get(request.compression)
+    if request.decompression_threads != 1 and (
+        request.compression is None or parallel_decompressor
+    ):
+        entries = await Get(DigestEntries, Digest, request.input_digest)
+        concurrency = _concurrency(
+            entries_size(entries)[0],
+            request.decompression_threads,
+            makeself.bytes_per_compression_thread,
+        )
+    if concurrency > 1:
+        parallel_decompressors = (
+            [parallel_decompressor]
+            if parallel_decompressor
+            else sorted(set(PARALLEL_DECOMPRESSION_BINARIES.values()))
+        )
+        paths += tuple(filter(None, map(binaries.find, parallel_decompressors)))
+    if request.verify:
+        paths += _checksum_binaries(
+            binaries, request.integrity or MakeselfIntegrity.MD5_CRC, rationale
+        )
+        if request.volumes:
+            paths += binaries.require("cksum", rationale=rationale)
+
     shims = await Get(
         BinaryShims,
-        BinaryShimsRequest(
-            paths=(
-                awk,
-                base64,
-                basename,
-                bash,
-                bzip2,
-                cat,
-                cut,
-                dd,
-                df,
-                dirname,
-                expr,
-                find,
-                gpg,
-                gzip,
-                head,
-                id,
-                md5sum,
-                mkdir,
-                pwd,
-                rm,
-                sed,
-                shasum,
-                tail,
-                tar,
-                test,
-                wc,
-                xz,
-                zstd,
-            ),
-            rationale="run makeself archive",
-        ),
+        BinaryShimsRequest(paths=tuple(dict.fromkeys(paths)), rationale=rationale),
     )
     output_directories = []
     argv = [
@@ -166,6 +431,18 @@ async def run_makeself_archive(
     if output_directory := request.output_directory:
         output_directories = [output_directory]
         argv.extend(["--keep", "--target", request.output_directory])
+    if concurrency > 1:
+        # Pants only substitutes `{pants_concurrency}` in the argv.
+        (bash,) = binaries.require("bash", rationale=rationale)
+        argv = [
+            bash.path,
+            "-c",
+            'SETUP_THREADS="$1"; export SETUP_THREADS; shift; exec "$@"',
+            "extract",
+            "{pants_concurrency}",
+            os.path.join(os.curdir, request.exe),
+            *argv[1:],
+        ]
 
     return Process(
         argv=argv,
@@ -174,7 +451,11 @@ async def run_makeself_archive(
         output_directories=output_directories,
         description=request.description,
         level=request.level,
-        env={"PATH": shims.path_component},
+        env={
+            "PATH": shims.path_component,
+            **({} if request.verify else {"SETUP_NOCHECK": "1"}),
+        },
+        concurrency_available=concurrency if concurrency > 1 else 0,
     )
 
 
@@ -203,10 +484,50 @@ class MakeselfTool(DownloadedExternalTool):
     """The Makeself tool."""
 
 
+def _unpack_makeself_archive(
+    content: bytes,
+) -> Optional[Tuple[Union[FileContent, Directory], ...]]:
+    """Unpack a makeself archive in process, without running it.
+
+    Returns `None` when the archive has anything `extract_members` can't handle, or which doesn't
+    map to a digest entry, e.g. links.
+    """
+    entries: List[Union[FileContent, Directory]] = []
+    try:
+        for member, data in extract_members(io.BytesIO(content)):
+            path = os.path.normpath(member.name)
+            if path == os.curdir:
+                continue
+            if os.path.isabs(path) or path.split(os.sep, 1)[0] == os.pardir:
+                return None
+            if member.isdir():
+                entries.append(Directory(path))
+            elif data is not None:
+                entries.append(FileContent(path, data, is_executable=bool(member.mode & 0o111)))
+            else:
+                return None
+    except (ValueError, OSError, EOFError, tarfile.TarError) as e:
+        logger.debug("Cannot unpack makeself archive in process: %s", e)
+        return None
+    return tuple(entries)
+
+
 @rule(desc="Extract makeself distribution", level=LogLevel.DEBUG)
 async def extract_makeself_distribution(
     dist: MakeselfDistribution,
+    makeself: MakeselfSubsystem,
 ) -> MakeselfTool:
+    # The distribution is a small gzip compressed archive, so unpacking it here saves finding all
+    # the binaries its header runs with, and a process, on a cold cache.
+    contents = await Get(DigestContents, Digest, dist.digest)
+    entries = next(
+        (_unpack_makeself_archive(file.content) for file in contents if file.path == dist.exe),
+        None,
+    )
+    if entries is not None:
+        digest = await Get(Digest, CreateDigest(entries))
+        return MakeselfTool(digest=digest, exe="makeself.sh")
+
     out = "__makeself"
     result = await Get(
         ProcessResult,
@@ -214,6 +535,10 @@ async def extract_makeself_distribution(
             exe=dist.exe,
             input_digest=dist.digest,
             output_directory=out,
+            compression=MakeselfCompression.GZIP,
+            # The download is already verified against the known versions' SHA256.
+            verify=False,
+            decompression_threads=makeself.decompression_threads,
             description=f"Extracting Makeself archive: {out}",
             level=LogLevel.DEBUG,
         ),
@@ -222,6 +547,28 @@ async def extract_makeself_distribution(
     return MakeselfTool(digest=digest, exe="makeself.sh")
 
 
+@dataclass(frozen=True)
+class MakeselfZstdDictionary:
+    """A dictionary trained with `zstd --train`, stored as `filename` in `digest`."""
+
+    digest: Digest
+    filename: str
+
+
+# The dictionary IDs zstd leaves to users, the others are reserved.
+_ZSTD_DICTIONARY_IDS = range(32768, 2**31)
+
+
+def zstd_dictionary_id(digests: Tuple[Digest, ...]) -> int:
+    """A dictionary ID derived from the samples a dictionary is trained on.
+
+    zstd records the ID in every frame compressed with the dictionary and refuses to decompress
+    them with another one, so retraining on other samples gives a new version of the dictionary.
+    """
+    fingerprint = hashlib.sha256("\n".join(digest.fingerprint for digest in digests).encode())
+    return _ZSTD_DICTIONARY_IDS[int(fingerprint.hexdigest(), 16) % len(_ZSTD_DICTIONARY_IDS)]
+
+
 @dataclass(frozen=True)
 class CreateMakeselfArchive:
     archive_dir: str
@@ -234,87 +581,1015 @@ class CreateMakeselfArchive:
     level: LogLevel = LogLevel.INFO
     cache_scope: Optional[ProcessCacheScope] = None
     timeout_seconds: Optional[int] = None
+    compression: MakeselfCompression = MakeselfCompression.GZIP
+    compression_level: Optional[int] = None
+    compression_threads: int = 1
+    bytes_per_compression_thread: int = 64 * 1024 * 1024
+    integrity: MakeselfIntegrity = MakeselfIntegrity.MD5_CRC
+    engine: MakeselfEngine = MakeselfEngine.MAKESELF
+    # Digests whose files are symlinked into `archive_dir` instead of being materialized in the
+    # sandbox. The archive writers follow the links, so the payload is the same either way.
+    linked_digests: Tuple[Digest, ...] = ()
+    # Set to build a deterministic archive dated, along with all its members, at this timestamp.
+    source_date_epoch: Optional[int] = None
+    # Only honoured by the python engine, see `MakeselfArchiveParallelDecompressionField`.
+    parallel_decompression: bool = False
+    # Only honoured by the python engine, see `MakeselfArchiveInstallDirField`. The key names
+    # the payload's subdirectory.
+    install_dir: Optional[str] = None
+    install_key: str = ""
+    # Only honoured by the python engine, which stores duplicate files as hardlinks.
+    deduplicate: bool = False
+    # Only honoured by the python engine, for the `zstd` compression.
+    zstd_dictionary: Optional[MakeselfZstdDictionary] = None
+
+
+@dataclass(frozen=True)
+class _CreateMakeselfShArchive:
+    request: CreateMakeselfArchive
+
+
+@dataclass(frozen=True)
+class _CreatePythonMakeselfArchive:
+    request: CreateMakeselfArchive
+
+
+# Codecs the writer compresses with the standard library when a single thread is used.
+WRITER_STDLIB_COMPRESSIONS = frozenset(
+    (MakeselfCompression.GZIP, MakeselfCompression.BZIP2, MakeselfCompression.XZ)
+)
+
+
+@dataclass(frozen=True)
+class MakeselfPythonModules:
+    """The standard library only modules of this backend, importable with `PYTHONPATH=path`."""
+
+    digest: Digest
+    path: str
+
+
+_PYTHON_MODULES_DIR = "__makeself_python"
+_PYTHON_MODULES = (
+    "__init__.py",
+    "delta.py",
+    "header.py",
+    "pexes.py",
+    "reader.py",
+    "sample.py",
+    "variants.py",
+    "volumes.py",
+    "writer.py",
+)
+
+
+@rule
+async def makeself_python_modules() -> MakeselfPythonModules:
+    digest = await Get(
+        Digest,
+        CreateDigest(
+            FileContent(
+                os.path.join(_PYTHON_MODULES_DIR, __package__, module),
+                pkgutil.get_data(__package__, module) or b"",
+            )
+            for module in _PYTHON_MODULES
+        ),
+    )
+    return MakeselfPythonModules(digest=digest, path=_PYTHON_MODULES_DIR)
+
+
+def packaging_date(source_date_epoch: int) -> str:
+    return time.strftime("%a %b %d %H:%M:%S UTC %Y", time.gmtime(source_date_epoch))
+
+
+def deterministic_tar_args(source_date_epoch: int) -> Tuple[str, ...]:
+    """GNU tar arguments normalizing member order and metadata."""
+    return (
+        "--sort=name",
+        f"--mtime=@{source_date_epoch}",
+        "--owner=0",
+        "--group=0",
+        "--numeric-owner",
+        "--mode=u+rwX,go=rX",
+    )
+
+
+def _immutable_inputs(root: str, digests: Sequence[Digest]) -> Dict[str, Digest]:
+    """Mount each of `digests` under its own directory of `root`, keyed by that directory.
+
+    Processes only read these inputs, so they are passed as immutable input digests, which are
+    linked into the sandbox rather than materialized in it.
+    """
+    return {os.path.join(root, str(index)): digest for index, digest in enumerate(digests)}
+
+
+_LINKED_DIR = "__linked"
+LINK_INPUTS_BINARIES = ("find", "ln", "mkdir")
+
+# Symlinks every file of the linked input roots into the archive directory, then execs the
+# command following `--`. Conflicting paths fail `ln`, as they would fail merging the digests.
+_LINK_INPUTS_SCRIPT = """\
+set -euo pipefail
+archive_dir="$1"
+shift
+while [[ "$1" != "--" ]]; do
+  root="${PWD}/$1"
+  shift
+  (cd "${root}" && find . ! -type d) | while IFS= read -r file; do
+    file="${file#./}"
+    [[ "${file}" != */* ]] || mkdir -p "${archive_dir}/${file%/*}"
+    ln -s "${root}/${file}" "${archive_dir}/${file}"
+  done
+done
+shift
+exec "$@"
+"""
+
+
+# makeself.sh records the uncompressed size of the payload from `du -ks` of the archive directory,
+# which depends on the filesystem and doesn't follow the links to `linked_digests`. This `du` comes
+# first on the `PATH` and prints the total size of the files instead, like the python engine.
+_DU_DIR = "__makeself_du"
+_DU_SCRIPT = "#!/bin/sh\necho {usize_kb}\n"
+
+
+def _link_inputs(
+    request: CreateMakeselfArchive, argv: Sequence[str], bash: Optional[BinaryPath]
+) -> Tuple[Tuple[str, ...], Dict[str, Digest]]:
+    """Wrap `argv` to symlink `request.linked_digests` into the archive directory first."""
+    if not request.linked_digests:
+        return tuple(argv), {}
+    assert bash is not None
+    roots = [os.path.join(_LINKED_DIR, str(index)) for index in range(len(request.linked_digests))]
+    return (
+        (bash.path, "-c", _LINK_INPUTS_SCRIPT, "link", request.archive_dir, *roots, "--", *argv),
+        dict(zip(roots, request.linked_digests)),
+    )
+
+
+@dataclass(frozen=True)
+class PackagingStats:
+    """Sizes and timing of one packaging stage, attached to its workunit as metadata.
+
+    Only stages running a process have a timing, the one recorded in its execution metadata.
+    """
+
+    input_bytes: int
+    input_files: int
+    elapsed_ms: Optional[int] = None
+    output_bytes: Optional[int] = None
+    # The size of the files only stored once, see `find_duplicates`.
+    deduplicated_bytes: Optional[int] = None
+
+    @property
+    def compression_ratio(self) -> Optional[float]:
+        if self.output_bytes is None or not self.input_bytes:
+            return None
+        return self.output_bytes / self.input_bytes
+
+    @property
+    def throughput_mb_per_s(self) -> Optional[float]:
+        if not self.elapsed_ms:
+            return None
+        return self.input_bytes / 1000 / self.elapsed_ms
+
+    def metadata(self, prefix: str = "") -> Dict[str, Any]:
+        metadata = {
+            "input_bytes": self.input_bytes,
+            "input_files": self.input_files,
+            "elapsed_ms": self.elapsed_ms,
+            "output_bytes": self.output_bytes,
+            "compression_ratio": self.compression_ratio,
+            "throughput_mb_per_s": self.throughput_mb_per_s,
+            "deduplicated_bytes": self.deduplicated_bytes,
+        }
+        return {f"{prefix}{key}": value for key, value in metadata.items() if value is not None}
+
+    def summary(self) -> str:
+        summary = f"{self.input_files} files, {self.input_bytes / 2**20:.1f} MiB"
+        if self.output_bytes is not None:
+            summary += f" -> {self.output_bytes / 2**20:.1f} MiB"
+        if self.compression_ratio is not None:
+            summary += f" (ratio {self.compression_ratio:.2f})"
+        if self.deduplicated_bytes:
+            summary += f", {self.deduplicated_bytes / 2**20:.1f} MiB deduplicated"
+        if self.elapsed_ms is not None:
+            summary += f" in {self.elapsed_ms / 1000:.2f}s"
+        if self.throughput_mb_per_s is not None:
+            summary += f" ({self.throughput_mb_per_s:.1f} MB/s)"
+        return summary
+
+
+def entries_size(*entries_per_digest: DigestEntries) -> Tuple[int, int]:
+    """The total size and number of files of the digests with `entries_per_digest`."""
+    files = [
+        entry for entries in entries_per_digest for entry in entries if isinstance(entry, FileEntry)
+    ]
+    return sum(entry.file_digest.serialized_bytes_length for entry in files), len(files)
+
+
+def find_duplicates(
+    *entries_per_digest: DigestEntries,
+) -> Tuple[Tuple[FileEntry, FileEntry], ...]:
+    """`(original, duplicate)` pairs of the files with the same content and mode as an earlier one.
+
+    Empty files aren't worth linking, and a path repeated across digests is left to overwrite
+    itself.
+    """
+    originals: Dict[Tuple[str, int, bool], FileEntry] = {}
+    duplicates = []
+    for entries in entries_per_digest:
+        for entry in entries:
+            if not isinstance(entry, FileEntry) or not entry.file_digest.serialized_bytes_length:
+                continue
+            key = (
+                entry.file_digest.fingerprint,
+                entry.file_digest.serialized_bytes_length,
+                entry.is_executable,
+            )
+            original = originals.setdefault(key, entry)
+            if original.path != entry.path:
+                duplicates.append((original, entry))
+    return tuple(duplicates)
+
+
+@rule_helper
+async def _digest_size(digests: Tuple[Digest, ...]) -> Tuple[int, int]:
+    entries_per_digest = await MultiGet(Get(DigestEntries, Digest, digest) for digest in digests)
+    return entries_size(*entries_per_digest)
+
+
+def _elapsed_ms(result: ProcessResult) -> int:
+    return result.metadata.total_elapsed_ms or 0
+
+
+def _concurrency(size: int, threads: int, bytes_per_thread: int) -> int:
+    """One thread per `bytes_per_thread` of `size`, capped at `threads` unless it's `0`."""
+    concurrency = max(1, size // max(1, bytes_per_thread))
+    if threads > 0:
+        concurrency = min(concurrency, threads)
+    return concurrency
+
+
+@rule_helper
+async def _compression_concurrency(
+    digests: Tuple[Digest, ...],
+    compression: MakeselfCompression,
+    compression_threads: int,
+    bytes_per_compression_thread: int,
+) -> int:
+    if compression not in PARALLEL_COMPRESSIONS or compression_threads == 1:
+        return 1
+    input_size, _ = await _digest_size(digests)
+    return _concurrency(input_size, compression_threads, bytes_per_compression_thread)
+
+
+@rule
+async def create_makeself_archive(request: CreateMakeselfArchive) -> Process:
+    if request.engine == MakeselfEngine.PYTHON:
+        return await Get(Process, _CreatePythonMakeselfArchive(request))
+    return await Get(Process, _CreateMakeselfShArchive(request))
 
 
 @rule
-async def create_makeself_archive(
-    request: CreateMakeselfArchive,
+async def create_makeself_sh_archive(
+    wrapped: _CreateMakeselfShArchive,
     makeself: MakeselfTool,
-    awk: AwkBinary,
-    basename: BasenameBinary,
-    cat: CatBinary,
-    date: DateBinary,
-    dirname: DirnameBinary,
-    du: DuBinary,
-    expr: ExprBinary,
-    find: FindBinary,
-    gzip: GzipBinary,
-    rm: RmBinary,
-    sed: SedBinary,
-    sh: ShBinary,
-    sort: SortBinary,
-    tar: TarBinary,
-    wc: WcBinary,
-    xargs: XargsBinary,
-    tr: TrBinary,
-    cksum: CksumBinary,
-    cut: CutBinary,
-    chmod: ChmodBinary,
+    binaries: MakeselfBinaries,
 ) -> Process:
+    request = wrapped.request
+    compressor = COMPRESSION_BINARIES.get(request.compression)
+    rationale = "create makeself archive"
+    bash = binaries.require("bash", rationale=rationale)[0] if request.linked_digests else None
     shims = await Get(
         BinaryShims,
         BinaryShimsRequest(
-            paths=(
-                awk,
-                basename,
-                cat,
-                date,
-                dirname,
-                du,
-                expr,
-                find,
-                gzip,
-                rm,
-                sed,
-                sh,
-                sort,
-                tar,
-                wc,
-                tr,
-                cksum,
-                cut,
-                chmod,
-                xargs,
-            ),
-            rationale="create makeself archive",
+            paths=binaries.require(
+                *CREATE_MAKESELF_ARCHIVE_BINARIES,
+                *((compressor,) if compressor else ()),
+                *(LINK_INPUTS_BINARIES if request.linked_digests else ()),
+                rationale=rationale,
+            )
+            + _checksum_binaries(binaries, request.integrity, rationale),
+            rationale=rationale,
         ),
     )
     tooldir = "__makeself"
-    argv = (
+    argv = [
         os.path.join(tooldir, makeself.exe),
-        request.archive_dir,
-        request.file_name,
-        request.label,
-        os.path.join(os.curdir, request.startup_script),
+        COMPRESSION_FLAGS[request.compression],
+        *INTEGRITY_FLAGS[request.integrity],
+    ]
+    tar_extra = []
+    if request.linked_digests:
+        tar_extra.append("-h")
+    if request.source_date_epoch is not None:
+        tar_extra.extend(deterministic_tar_args(request.source_date_epoch))
+        argv.extend(["--packaging-date", packaging_date(request.source_date_epoch)])
+    if tar_extra:
+        argv.extend(["--tar-extra", " ".join(tar_extra)])
+    if request.compression_level is not None:
+        argv.extend(["--complevel", str(request.compression_level)])
+    concurrency = await _compression_concurrency(
+        (request.input_digest, *request.linked_digests),
+        request.compression,
+        request.compression_threads,
+        request.bytes_per_compression_thread,
     )
+    if concurrency > 1:
+        argv.extend(["--threads", "{pants_concurrency}"])
+    usize, _ = await _digest_size((request.input_digest, *request.linked_digests))
+    du = await Get(
+        Digest,
+        CreateDigest(
+            [
+                FileContent(
+                    os.path.join(_DU_DIR, "du"),
+                    _DU_SCRIPT.format(usize_kb=usize // 1024).encode(),
+                    is_executable=True,
+                )
+            ]
+        ),
+    )
+    argv.extend(
+        [
+            request.archive_dir,
+            request.file_name,
+            request.label,
+            os.path.join(os.curdir, request.startup_script),
+        ]
+    )
+    process_argv, linked_digests = _link_inputs(request, argv, bash)
     process = Process(
-        argv,
+        process_argv,
         input_digest=request.input_digest,
         immutable_input_digests={
             tooldir: makeself.digest,
+            _DU_DIR: du,
+            **linked_digests,
             **shims.immutable_input_digests,
         },
-        env={"PATH": shims.path_component},
+        # GNU gzip doesn't store a timestamp when compressing stdin, pigz needs to be told.
+        env={
+            "PATH": os.pathsep.join((os.path.join("{chroot}", _DU_DIR), shims.path_component)),
+            **({} if request.source_date_epoch is None else {"PIGZ": "-n"}),
+        },
         description=request.description,
         level=request.level,
         append_only_caches={},
         output_files=(request.output_filename,),
         cache_scope=request.cache_scope or ProcessCacheScope.SUCCESSFUL,
         timeout_seconds=request.timeout_seconds,
+        concurrency_available=concurrency if concurrency > 1 else 0,
     )
     return process
 
 
+_ZSTD_DICTIONARY_DIR = "__zstd_dictionary"
+
+
+@rule
+async def create_python_makeself_archive(
+    wrapped: _CreatePythonMakeselfArchive,
+    binaries: MakeselfBinaries,
+    modules: MakeselfPythonModules,
+) -> Process:
+    request = wrapped.request
+    concurrency = await _compression_concurrency(
+        (request.input_digest, *request.linked_digests),
+        request.compression,
+        request.compression_threads,
+        request.bytes_per_compression_thread,
+    )
+    compressor = COMPRESSION_BINARIES.get(request.compression)
+    if concurrency == 1 and request.compression in WRITER_STDLIB_COMPRESSIONS:
+        compressor = None
+    rationale = "create makeself archive"
+    python, *paths = binaries.require(
+        "python3",
+        *((compressor,) if compressor else ()),
+        *(LINK_INPUTS_BINARIES if request.linked_digests else ()),
+        rationale=rationale,
+    )
+    bash = binaries.require("bash", rationale=rationale)[0] if request.linked_digests else None
+    shims = await Get(BinaryShims, BinaryShimsRequest(paths=tuple(paths), rationale=rationale))
+
+    argv = [
+        python.path,
+        "-m",
+        f"{__package__}.writer",
+        "--output",
+        request.output_filename,
+        "--label",
+        request.label,
+        "--script",
+        os.path.join(os.curdir, request.startup_script),
+        "--targetdir",
+        os.path.basename(request.archive_dir),
+        "--compression",
+        request.compression.value,
+        "--integrity",
+        request.integrity.value,
+    ]
+    if request.compression_level is not None:
+        argv.extend(["--level", str(request.compression_level)])
+    if concurrency > 1:
+        argv.extend(["--threads", "{pants_concurrency}"])
+    if request.source_date_epoch is not None:
+        argv.extend(
+            [
+                "--mtime",
+                str(request.source_date_epoch),
+                "--packaging-date",
+                packaging_date(request.source_date_epoch),
+            ]
+        )
+    if request.parallel_decompression:
+        argv.append("--parallel-decompression")
+    if request.install_dir:
+        argv.extend(["--install-dir", request.install_dir, "--install-key", request.install_key])
+    if request.deduplicate:
+        argv.append("--deduplicate")
+    dictionary_digests = {}
+    if request.zstd_dictionary:
+        dictionary_digests[_ZSTD_DICTIONARY_DIR] = request.zstd_dictionary.digest
+        argv.extend(
+            [
+                "--zstd-dictionary",
+                os.path.join(_ZSTD_DICTIONARY_DIR, request.zstd_dictionary.filename),
+            ]
+        )
+    argv.append(request.archive_dir)
+    process_argv, linked_digests = _link_inputs(request, argv, bash)
+
+    return Process(
+        process_argv,
+        input_digest=request.input_digest,
+        immutable_input_digests={
+            modules.path: modules.digest,
+            **linked_digests,
+            **dictionary_digests,
+            **shims.immutable_input_digests,
+        },
+        env={"PATH": shims.path_component, "PYTHONPATH": modules.path},
+        description=request.description,
+        level=request.level,
+        output_files=(request.output_filename,),
+        cache_scope=request.cache_scope or ProcessCacheScope.SUCCESSFUL,
+        timeout_seconds=request.timeout_seconds,
+        concurrency_available=concurrency if concurrency > 1 else 0,
+    )
+
+
+@dataclass(frozen=True)
+class MakeselfArchive(EngineAwareReturnType):
+    """A written makeself archive, stored as its output filename in `digest`."""
+
+    digest: Digest
+    stats: PackagingStats
+
+    def metadata(self) -> Dict[str, Any]:
+        return self.stats.metadata()
+
+
+@rule(desc="Write makeself archive", level=LogLevel.DEBUG)
+async def write_makeself_archive(request: CreateMakeselfArchive) -> MakeselfArchive:
+    process = await Get(Process, CreateMakeselfArchive, request)
+    result = await Get(ProcessResult, Process, process)
+    input_bytes, input_files = await _digest_size((request.input_digest, *request.linked_digests))
+    output_bytes, _ = await _digest_size((result.output_digest,))
+    return MakeselfArchive(
+        digest=result.output_digest,
+        stats=PackagingStats(
+            input_bytes=input_bytes,
+            input_files=input_files,
+            elapsed_ms=_elapsed_ms(result),
+            output_bytes=output_bytes,
+        ),
+    )
+
+
+@dataclass(frozen=True)
+class CompressMakeselfSegment:
+    """Compress a digest into one tar segment of a layered makeself archive."""
+
+    digest: Digest
+    description: str = dataclasses.field(compare=False)
+    compression: MakeselfCompression = MakeselfCompression.GZIP
+    compression_level: Optional[int] = None
+    compression_threads: int = 1
+    bytes_per_compression_thread: int = 64 * 1024 * 1024
+    integrity: MakeselfIntegrity = MakeselfIntegrity.MD5_CRC
+    source_date_epoch: Optional[int] = None
+    level: LogLevel = LogLevel.DEBUG
+    # Only used by the `zstd` compression.
+    zstd_dictionary: Optional[MakeselfZstdDictionary] = None
+
+
+@dataclass(frozen=True)
+class MakeselfSegment(EngineAwareReturnType):
+    """A compressed tar segment, stored as `SEGMENT_FILE` in `digest`."""
+
+    digest: Digest
+    segment: Segment
+    stats: PackagingStats
+
+    def metadata(self) -> Dict[str, Any]:
+        return self.stats.metadata()
+
+
+SEGMENT_FILE = "segment"
+
+# Prints `size crc md5 sha256` of the segment. A checksum is only computed when the
+# command for it is set, otherwise its placeholder is printed.
+_COMPRESS_SEGMENT_SCRIPT = f"""\
+set -euo pipefail
+tar ${{TAR_EXTRA:-}} -C __segment -cf - . | "$@" > segment
+checksum() {{
+  if [[ -n "$1" ]]; then
+    sum="$($1 < segment)"
+    echo "${{sum%% *}}"
+  else
+    echo "$2"
+  fi
+}}
+size="$(wc -c < segment)"
+crc="$(checksum "${{CRC_COMMAND:-}}" {NO_CRC})"
+md5="$(checksum "${{MD5_COMMAND:-}}" {NO_MD5})"
+sha="$(checksum "${{SHA256_COMMAND:-}}" {NO_SHA})"
+echo ${{size}} ${{crc}} ${{md5}} ${{sha}}
+"""
+
+
+def _checksum_command(path: BinaryPath) -> str:
+    name = os.path.basename(path.path)
+    return "shasum -a 256" if name == "shasum" else name
+
+
+@rule
+async def compress_makeself_segment(
+    request: CompressMakeselfSegment,
+    binaries: MakeselfBinaries,
+) -> MakeselfSegment:
+    compressor = COMPRESSION_BINARIES.get(request.compression)
+    rationale = "compress makeself archive segment"
+    bash, *paths = binaries.require(
+        "bash",
+        "tar",
+        "wc",
+        *((compressor,) if compressor else ("cat",)),
+        rationale=rationale,
+    )
+    checksum_paths = _checksum_binaries(binaries, request.integrity, rationale)
+    paths.extend(checksum_paths)
+    checksum_env = {
+        f"{checksum.upper()}_COMMAND": _checksum_command(path)
+        for checksum, path in zip(INTEGRITY_CHECKSUMS[request.integrity.value], checksum_paths)
+    }
+    shims, input_digest, entries = await MultiGet(
+        Get(BinaryShims, BinaryShimsRequest(paths=tuple(paths), rationale=rationale)),
+        Get(Digest, AddPrefix(request.digest, "__segment")),
+        Get(DigestEntries, Digest, request.digest),
+    )
+    concurrency = await _compression_concurrency(
+        (request.digest,),
+        request.compression,
+        request.compression_threads,
+        request.bytes_per_compression_thread,
+    )
+    result = await Get(
+        ProcessResult,
+        Process(
+            argv=(
+                bash.path,
+                "-c",
+                _COMPRESS_SEGMENT_SCRIPT,
+                "compress",
+                *compress_command(
+                    request.compression.value,
+                    request.compression_level,
+                    "{pants_concurrency}" if concurrency > 1 else None,
+                    (
+                        os.path.join(_ZSTD_DICTIONARY_DIR, request.zstd_dictionary.filename)
+                        if request.zstd_dictionary
+                        else None
+                    ),
+                ),
+            ),
+            input_digest=input_digest,
+            immutable_input_digests={
+                **(
+                    {_ZSTD_DICTIONARY_DIR: request.zstd_dictionary.digest}
+                    if request.zstd_dictionary
+                    else {}
+                ),
+                **shims.immutable_input_digests,
+            },
+            env={
+                "PATH": shims.path_component,
+                **checksum_env,
+                **(
+                    {}
+                    if request.source_date_epoch is None
+                    else {"TAR_EXTRA": " ".join(deterministic_tar_args(request.source_date_epoch))}
+                ),
+            },
+            output_files=(SEGMENT_FILE,),
+            description=request.description,
+            level=request.level,
+            concurrency_available=concurrency if concurrency > 1 else 0,
+        ),
+    )
+    size, crc, md5, sha256 = result.stdout.decode().split()
+    usize, files = entries_size(entries)
+    return MakeselfSegment(
+        digest=result.output_digest,
+        segment=Segment(size=int(size), crc=crc, md5=md5, sha256=sha256, usize_kb=usize // 1024),
+        stats=PackagingStats(
+            input_bytes=usize,
+            input_files=files,
+            elapsed_ms=_elapsed_ms(result),
+            output_bytes=int(size),
+        ),
+    )
+
+
+@dataclass(frozen=True)
+class CreateLayeredMakeselfArchive:
+    """Concatenate a header and previously compressed segments into a makeself archive."""
+
+    segments: Tuple[MakeselfSegment, ...]
+    label: str
+    startup_script: str
+    output_filename: str
+    compression: MakeselfCompression
+    description: str = dataclasses.field(compare=False)
+    level: LogLevel = LogLevel.INFO
+    source_date_epoch: Optional[int] = None
+    parallel_decompression: bool = False
+    install_dir: Optional[str] = None
+    install_key: str = ""
+    # `(original, duplicate)` paths of the files left out of the segments, which the header
+    # links once extracted.
+    links: Tuple[Tuple[str, str], ...] = ()
+    # The file name of the dictionary the segments were compressed with, if any.
+    zstd_dictionary: str = ""
+
+
+@rule
+async def create_layered_makeself_archive(
+    request: CreateLayeredMakeselfArchive,
+    binaries: MakeselfBinaries,
+) -> Process:
+    rationale = "assemble makeself archive"
+    bash, *paths = binaries.require("bash", "cat", "chmod", rationale=rationale)
+    header = render_header(
+        label=request.label,
+        script=os.path.join(os.curdir, request.startup_script),
+        segments=(segment.segment for segment in request.segments),
+        compression=request.compression.value,
+        targetdir="__archive",
+        packaging_date=(
+            "" if request.source_date_epoch is None else packaging_date(request.source_date_epoch)
+        ),
+        parallel_decompression=request.parallel_decompression,
+        install_dir=request.install_dir or "",
+        install_key=request.install_key,
+        links=request.links,
+        zstd_dictionary=request.zstd_dictionary,
+    )
+    shims, header_digest = await MultiGet(
+        Get(BinaryShims, BinaryShimsRequest(paths=tuple(paths), rationale=rationale)),
+        Get(Digest, CreateDigest([FileContent("__header", header)])),
+    )
+    segment_dirs = [f"__segments/{index}" for index in range(len(request.segments))]
+    return Process(
+        argv=(
+            bash.path,
+            "-c",
+            'out="$1"; shift; cat "$@" > "${out}"; chmod 755 "${out}"',
+            "assemble",
+            request.output_filename,
+            "__header",
+            *(os.path.join(segment_dir, SEGMENT_FILE) for segment_dir in segment_dirs),
+        ),
+        input_digest=header_digest,
+        immutable_input_digests={
+            **{
+                segment_dir: segment.digest
+                for segment_dir, segment in zip(segment_dirs, request.segments)
+            },
+            **shims.immutable_input_digests,
+        },
+        env={"PATH": shims.path_component},
+        output_files=(request.output_filename,),
+        description=request.description,
+        level=request.level,
+    )
+
+
+@rule(desc="Write layered makeself archive", level=LogLevel.DEBUG)
+async def write_layered_makeself_archive(request: CreateLayeredMakeselfArchive) -> MakeselfArchive:
+    process = await Get(Process, CreateLayeredMakeselfArchive, request)
+    result = await Get(ProcessResult, Process, process)
+    output_bytes, _ = await _digest_size((result.output_digest,))
+    return MakeselfArchive(
+        digest=result.output_digest,
+        stats=PackagingStats(
+            input_bytes=sum(segment.stats.input_bytes for segment in request.segments),
+            input_files=sum(segment.stats.input_files for segment in request.segments),
+            elapsed_ms=_elapsed_ms(result)
+            + sum(segment.stats.elapsed_ms or 0 for segment in request.segments),
+            output_bytes=output_bytes,
+        ),
+    )
+
+
+@dataclass(frozen=True)
+class CreateMakeselfArchiveVariants:
+    """Copies of a written archive which only differ in the startup command of their header."""
+
+    archive: str
+    input_digest: Digest
+    # The output filename of every variant, mapped to the command it runs after extraction.
+    variants: FrozenDict[str, str]
+    description: str
+    level: LogLevel = LogLevel.INFO
+
+
+@rule
+async def create_makeself_archive_variants(
+    request: CreateMakeselfArchiveVariants,
+    binaries: MakeselfBinaries,
+    modules: MakeselfPythonModules,
+) -> Process:
+    (python,) = binaries.require("python3", rationale="write makeself archive variants")
+    return Process(
+        (
+            python.path,
+            "-m",
+            f"{__package__}.variants",
+            *(f"--variant={output}={command}" for output, command in request.variants.items()),
+            request.archive,
+        ),
+        input_digest=request.input_digest,
+        immutable_input_digests={modules.path: modules.digest},
+        env={"PYTHONPATH": modules.path},
+        description=request.description,
+        level=request.level,
+        output_files=tuple(request.variants),
+    )
+
+
+@dataclass(frozen=True)
+class SplitMakeselfArchives:
+    """Archives split into volumes, written to `output_dir` next to the scripts joining them."""
+
+    archives: Tuple[str, ...]
+    input_digest: Digest
+    max_volume_size: int
+    output_dir: str
+    description: str
+    level: LogLevel = LogLevel.INFO
+
+
+@rule
+async def split_makeself_archives(
+    request: SplitMakeselfArchives,
+    binaries: MakeselfBinaries,
+    modules: MakeselfPythonModules,
+) -> Process:
+    (python,) = binaries.require("python3", rationale="split makeself archives into volumes")
+    return Process(
+        (
+            python.path,
+            "-m",
+            f"{__package__}.volumes",
+            "--max-size",
+            str(request.max_volume_size),
+            "--output-dir",
+            request.output_dir,
+            *request.archives,
+        ),
+        input_digest=request.input_digest,
+        immutable_input_digests={modules.path: modules.digest},
+        env={"PYTHONPATH": modules.path},
+        description=request.description,
+        level=request.level,
+        output_directories=(request.output_dir,),
+    )
+
+
+@dataclass(frozen=True)
+class SampleMakeselfPayload:
+    """Measure how well the files of `digests` compress with the codecs of `sample.py`."""
+
+    digests: Tuple[Digest, ...]
+    description: str
+    level: LogLevel = LogLevel.INFO
+
+
+@rule
+async def sample_makeself_payload(
+    request: SampleMakeselfPayload,
+    binaries: MakeselfBinaries,
+    modules: MakeselfPythonModules,
+) -> Process:
+    (python,) = binaries.require("python3", rationale="sample makeself archive payload")
+    inputs = _immutable_inputs("__sample", request.digests)
+    return Process(
+        (python.path, "-m", f"{__package__}.sample", *inputs),
+        immutable_input_digests={modules.path: modules.digest, **inputs},
+        env={"PYTHONPATH": modules.path},
+        description=request.description,
+        level=request.level,
+    )
+
+
+@dataclass(frozen=True)
+class AutoCompression:
+    """The codec picked by the `auto` compression, and the sample it was picked from."""
+
+    compression: MakeselfCompression
+    # The compressed size of the sample relative to its size, for each sampled codec.
+    ratios: FrozenDict[str, float]
+
+    def summary(self) -> str:
+        ratios = ", ".join(f"{codec} {ratio:.2f}" for codec, ratio in self.ratios.items())
+        return f"auto compression: {self.compression.value} (sampled ratios: {ratios})"
+
+
+# Reference compression and decompression throughputs, in bytes per second on one core, of the
+# codecs sampled for the `auto` compression at their sampled levels. They are fixed rather than
+# measured so that the same payload always gets the same codec, whichever machine builds it.
+AUTO_COMPRESSION_THROUGHPUTS = FrozenDict(
+    {
+        MakeselfCompression.GZIP: (10 * 1024 * 1024, 200 * 1024 * 1024),
+        MakeselfCompression.XZ: (2 * 1024 * 1024, 60 * 1024 * 1024),
+    }
+)
+
+
+def choose_compression(
+    sample: Dict[str, Any], payload_bytes: int, transfer_rate: int, runs_per_build: int
+) -> AutoCompression:
+    """Pick the codec of `sample` with the lowest estimated cost, or no compression.
+
+    The cost of a codec is the time to compress the payload once, plus `runs_per_build` times
+    the time to ship the compressed payload at `transfer_rate` and decompress it, with the
+    ratio measured on the sample and the throughputs of `AUTO_COMPRESSION_THROUGHPUTS`.
+    """
+    costs = {MakeselfCompression.NONE: runs_per_build * payload_bytes / transfer_rate}
+    for codec, measures in sample["codecs"].items():
+        compression = MakeselfCompression(codec)
+        compress_rate, decompress_rate = AUTO_COMPRESSION_THROUGHPUTS[compression]
+        startup_s = (
+            payload_bytes * measures["ratio"] / transfer_rate + payload_bytes / decompress_rate
+        )
+        costs[compression] = payload_bytes / compress_rate + runs_per_build * startup_s
+    return AutoCompression(
+        compression=min(costs, key=lambda compression: costs[compression]),
+        ratios=FrozenDict(
+            {codec: measures["ratio"] for codec, measures in sample["codecs"].items()}
+        ),
+    )
+
+
+@dataclass(frozen=True)
+class UnpackPexes:
+    """Zipapp PEXes unpacked into loose PEXes started through a launcher, see `pexes.py`.
+
+    `input_digest` holds `pexes` under `output_dir`, which is captured once they are unpacked.
+    Anything else than a zipapp PEX is left as is.
+    """
+
+    pexes: Tuple[str, ...]
+    input_digest: Digest
+    output_dir: str
+    description: str
+    level: LogLevel = LogLevel.INFO
+
+
+@rule
+async def unpack_pexes(
+    request: UnpackPexes,
+    binaries: MakeselfBinaries,
+    modules: MakeselfPythonModules,
+) -> Process:
+    (python,) = binaries.require("python3", rationale="unpack PEXes")
+    return Process(
+        (
+            python.path,
+            "-m",
+            f"{__package__}.pexes",
+            *(os.path.join(request.output_dir, pex) for pex in request.pexes),
+        ),
+        input_digest=request.input_digest,
+        immutable_input_digests={modules.path: modules.digest},
+        env={"PYTHONPATH": modules.path},
+        description=request.description,
+        level=request.level,
+        output_directories=(request.output_dir,),
+    )
+
+
+@dataclass(frozen=True)
+class TrainZstdDictionary:
+    """Train a zstd dictionary of at most `max_size` bytes on the files of `digests`."""
+
+    digests: Tuple[Digest, ...]
+    output_filename: str
+    dictionary_id: int
+    max_size: int
+    description: str
+    level: LogLevel = LogLevel.INFO
+
+
+@rule
+async def train_zstd_dictionary(
+    request: TrainZstdDictionary,
+    binaries: MakeselfBinaries,
+) -> Process:
+    (zstd,) = binaries.require("zstd", rationale="train zstd dictionary")
+    samples = _immutable_inputs("__samples", request.digests)
+    return Process(
+        (
+            zstd.path,
+            "--train",
+            "-q",
+            "-r",
+            # zstd skips symlinks given as arguments, unless they end with a `/`.
+            *(f"{root}/" for root in samples),
+            "-o",
+            request.output_filename,
+            f"--maxdict={request.max_size}",
+            f"--dictID={request.dictionary_id}",
+        ),
+        immutable_input_digests=samples,
+        description=request.description,
+        level=request.level,
+        output_files=(request.output_filename,),
+    )
+
+
+@dataclass(frozen=True)
+class CreateMakeselfDelta:
+    """A delta rebuilding `archive` from its previous version `base`, see `delta.py`.
+
+    `input_digest` holds `archive`, `base_digest` holds `base`. The delta is written to
+    `output_dir` and the process prints the JSON report of `delta.py`.
+    """
+
+    archive: str
+    input_digest: Digest
+    base: str
+    base_digest: Digest
+    output_dir: str
+    description: str
+    compression_level: Optional[int] = None
+    level: LogLevel = LogLevel.INFO
+
+
+_DELTA_BASE_DIR = "__delta_base"
+
+
+@rule
+async def create_makeself_delta(
+    request: CreateMakeselfDelta,
+    binaries: MakeselfBinaries,
+    modules: MakeselfPythonModules,
+) -> Process:
+    rationale = "create makeself archive delta"
+    python, zstd = binaries.require("python3", "zstd", rationale=rationale)
+    shims = await Get(BinaryShims, BinaryShimsRequest(paths=(zstd,), rationale=rationale))
+    base = _immutable_inputs(_DELTA_BASE_DIR, (request.base_digest,))
+    (base_dir,) = base
+    argv = [
+        python.path,
+        "-m",
+        f"{__package__}.delta",
+        "--base",
+        os.path.join(base_dir, request.base),
+        "--output-dir",
+        request.output_dir,
+    ]
+    if request.compression_level is not None:
+        argv.extend(["--level", str(request.compression_level)])
+    argv.append(request.archive)
+    return Process(
+        tuple(argv),
+        input_digest=request.input_digest,
+        immutable_input_digests={
+            modules.path: modules.digest,
+            **base,
+            **shims.immutable_input_digests,
+        },
+        env={"PATH": shims.path_component, "PYTHONPATH": modules.path},
+        description=request.description,
+        level=request.level,
+        output_directories=(request.output_dir,),
+    )
+
+
 def rules():
     return [
         *collect_rules(),
@@ -0,0 +1,39 @@
+import os
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+from pants_backend_makeself.makeself import choose_compression
+from pants_backend_makeself.sample import sample_payload
+from pants_backend_makeself.target_types import MakeselfCompression
+
+# The defaults of `[makeself].auto_compression_transfer_rate` and `auto_compression_runs_per_build`.
+TRANSFER_RATE = 10 * 1024 * 1024
+RUNS_PER_BUILD = 100
+
+
+def _sample(gzip: float, xz: float) -> Dict[str, Any]:
+    return {"sampled_bytes": 1024, "codecs": {"gzip": {"ratio": gzip}, "xz": {"ratio": xz}}}
+
+
+@pytest.mark.parametrize(
+    "gzip, xz, compression",
+    [
+        (0.3, 0.25, MakeselfCompression.GZIP),
+        (0.5, 0.2, MakeselfCompression.XZ),
+        (0.99, 0.98, MakeselfCompression.NONE),
+    ],
+)
+def test_choose_compression(gzip: float, xz: float, compression: MakeselfCompression) -> None:
+    auto = choose_compression(_sample(gzip, xz), 100 * 1024 * 1024, TRANSFER_RATE, RUNS_PER_BUILD)
+    assert auto.compression == compression
+    assert dict(auto.ratios) == {"gzip": gzip, "xz": xz}
+
+
+def test_choose_compression_picks_xz_for_distant_repeats(tmp_path: Path) -> None:
+    # Repeats further apart than the 32 KiB window of gzip, only xz finds them.
+    (tmp_path / "a.bin").write_bytes(os.urandom(64 * 1024) * 16)
+
+    sample = sample_payload([str(tmp_path)], 1024 * 1024, 1024 * 1024)
+    auto = choose_compression(sample, 1024 * 1024, TRANSFER_RATE, RUNS_PER_BUILD)
+    assert auto.compression == MakeselfCompression.XZ
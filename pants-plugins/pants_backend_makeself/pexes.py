@@ -0,0 +1,77 @@
+"""Unpacks zipapp PEXes into loose PEX directories run through a launcher.
+
+A zipapp PEX extracts its code and dependencies into `PEX_ROOT` the first time it runs. Once
+unzipped, the PEX runs in place instead, so an archive shipping it loose saves that second
+extraction. The `.pex` file is replaced by a launcher running the directory next to it with the
+interpreter of the PEX shebang, so it is still started the same way. Run as
+`python -m pants_backend_makeself.pexes`, it only depends on the standard library.
+"""
+import argparse
+import os
+import shlex
+import stat
+import sys
+import zipfile
+from typing import List, Optional
+
+LOOSE_SUFFIX = ".loose"
+
+_LAUNCHER = """\
+#!/bin/sh
+# This script was generated by pants-backend-makeself. It runs the PEX unpacked next to it.
+exec {interpreter} "`dirname "$0"`"/{directory} "$@"
+"""
+
+
+def _is_pex(path: str) -> bool:
+    if not os.path.isfile(path) or not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as pex:
+        names = set(pex.namelist())
+    return {"PEX-INFO", "__main__.py"} <= names
+
+
+def _shebang(path: str) -> List[str]:
+    with open(path, "rb") as fp:
+        line = fp.readline()
+    if not line.startswith(b"#!"):
+        return ["python3"]
+    return line[2:].decode().split()
+
+
+def unpack_pex(path: str) -> bool:
+    """Unpack the zipapp PEX at `path` into `path + LOOSE_SUFFIX`, leaving a launcher at `path`.
+
+    Returns whether `path` was a zipapp PEX, anything else is left as is.
+    """
+    if not _is_pex(path):
+        return False
+    directory = path + LOOSE_SUFFIX
+    with zipfile.ZipFile(path) as pex:
+        for info in pex.infolist():
+            extracted = pex.extract(info, directory)
+            mode = info.external_attr >> 16
+            if not info.is_dir() and mode & stat.S_IXUSR:
+                os.chmod(extracted, 0o755)
+    interpreter = " ".join(shlex.quote(word) for word in _shebang(path))
+    with open(path, "w") as fp:
+        fp.write(
+            _LAUNCHER.format(
+                interpreter=interpreter, directory=shlex.quote(os.path.basename(directory))
+            )
+        )
+    os.chmod(path, 0o755)
+    return True
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("pexes", nargs="+")
+    options = parser.parse_args(argv)
+
+    for path in options.pexes:
+        unpack_pex(path)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,37 @@
+import subprocess
+import sys
+import zipfile
+from pathlib import Path
+
+from pants_backend_makeself.pexes import LOOSE_SUFFIX, main
+
+
+def _write_pex(path: Path) -> None:
+    with path.open("wb") as fp:
+        fp.write(f"#!{sys.executable}\n".encode())
+        with zipfile.ZipFile(fp, "w") as pex:
+            pex.writestr("PEX-INFO", "{}")
+            pex.writestr("__main__.py", "import sys\nimport app\napp.main(sys.argv[1:])\n")
+            pex.writestr("app.py", "def main(args):\n    print('hello', *args)\n")
+            script = zipfile.ZipInfo(".deps/bin/tool")
+            script.external_attr = 0o755 << 16
+            pex.writestr(script, "#!/bin/sh\n")
+    path.chmod(0o755)
+
+
+def test_pexes_are_unpacked(tmp_path: Path) -> None:
+    pex = tmp_path / "dir with spaces" / "app.pex"
+    pex.parent.mkdir()
+    _write_pex(pex)
+    other = tmp_path / "other.pex"
+    other.write_text("not a pex\n")
+
+    main([str(pex), str(other)])
+
+    assert other.read_text() == "not a pex\n"
+    loose = pex.parent / f"app.pex{LOOSE_SUFFIX}"
+    assert (loose / "PEX-INFO").is_file()
+    assert (loose / ".deps" / "bin" / "tool").stat().st_mode & 0o111
+    assert not (loose / "app.py").stat().st_mode & 0o111
+    result = subprocess.run([str(pex), "a b"], stdout=subprocess.PIPE, check=True)
+    assert result.stdout == b"hello a b\n"
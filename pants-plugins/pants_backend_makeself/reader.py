@@ -0,0 +1,332 @@
+"""Reads a makeself archive without extracting it.
+
+The header is parsed for the payload layout, and every payload segment is streamed through its
+decompressor and `tarfile` to account for the size of each member. Run as
+`python -m pants_backend_makeself.reader`, it prints a JSON report and only depends on the
+standard library and the decompressor binaries for codecs the standard library doesn't provide.
+"""
+import argparse
+import bz2
+import gzip
+import heapq
+import json
+import lzma
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import IO, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from pants_backend_makeself.header import DECOMPRESS_COMMANDS
+
+_CHUNK_SIZE = 16 * 1024
+_ASSIGNMENT = re.compile(rb'^([A-Za-z_][A-Za-z0-9_]*)="(.*)"$')
+_ESCAPED = re.compile(r'\\([\\"$`])')
+
+# Magic bytes at the start of a compressed stream, checked in order.
+_MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"BZ3v1", "bzip3"),
+    (b"BZh", "bzip2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+    (b"\x04\x22\x4d\x18", "lz4"),
+    (b"\x89LZO", "lzo"),
+)
+# Codecs decompressed by the standard library, without any binary.
+_STDLIB_COMPRESSIONS = ("gzip", "bzip2", "xz", "none")
+
+
+@dataclass(frozen=True)
+class ArchiveLayout:
+    """Where the payload segments of an archive are."""
+
+    offset: int
+    filesizes: Tuple[int, ...]
+    variables: Dict[str, str]
+
+    def segments(self) -> Iterator[Tuple[int, int]]:
+        """Yield `(offset, size)` of every payload segment."""
+        offset = self.offset
+        for size in self.filesizes:
+            yield offset, size
+            offset += size
+
+
+def parse_header(fp: BinaryIO) -> ArchiveLayout:
+    """Parse the header of a makeself archive written by `makeself.sh` or by this plugin.
+
+    Both store the number of header lines in `skip` and the segment sizes in `filesizes`.
+    """
+    variables: Dict[str, str] = {}
+    offset = lines = 0
+    skip: Optional[int] = None
+    while skip is None or lines < skip:
+        line = fp.readline()
+        if not line:
+            raise ValueError("Not a makeself archive: the header ends before its payload.")
+        offset += len(line)
+        lines += 1
+        match = _ASSIGNMENT.match(line.rstrip(b"\n"))
+        if match and skip is None:
+            name, value = match.group(1).decode(), match.group(2).decode(errors="replace")
+            variables.setdefault(name, _ESCAPED.sub(r"\1", value))
+            if name == "skip":
+                skip = int(variables["skip"])
+    if "filesizes" not in variables:
+        raise ValueError("Not a makeself archive: `filesizes` is missing from the header.")
+    return ArchiveLayout(
+        offset=offset,
+        filesizes=tuple(int(size) for size in variables["filesizes"].split()),
+        variables=variables,
+    )
+
+
+def detect_compression(data: bytes) -> str:
+    """The codec of a compressed stream starting with `data`."""
+    for magic, compression in _MAGIC:
+        if data.startswith(magic):
+            return compression
+    return "none"
+
+
+class SegmentReader:
+    """Reads one segment out of the archive, counting the bytes consumed."""
+
+    def __init__(self, fp: BinaryIO, offset: int, size: int) -> None:
+        self._fp = fp
+        self._fp.seek(offset)
+        self._remaining = size
+        self.consumed = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._fp.read(size)
+        self._remaining -= len(data)
+        self.consumed += len(data)
+        return data
+
+    def peek(self, size: int) -> bytes:
+        position = self._fp.tell()
+        data = self._fp.read(min(size, self._remaining))
+        self._fp.seek(position)
+        return data
+
+
+class _DecompressorProcess:
+    """A decompressor binary fed from a thread, its stdout read as the decompressed stream."""
+
+    def __init__(self, argv: List[str], source: SegmentReader) -> None:
+        self._process = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        assert self._process.stdin is not None and self._process.stdout is not None
+        self._stdout = self._process.stdout
+        stdin = self._process.stdin
+        self._feeder = threading.Thread(target=lambda: _feed(source, stdin), daemon=True)
+        self._feeder.start()
+
+    def read(self, size: int = -1) -> bytes:
+        return self._stdout.read(size)
+
+    def close(self) -> None:
+        self._stdout.read()
+        self._feeder.join()
+        if self._process.wait() != 0:
+            raise subprocess.CalledProcessError(self._process.returncode, self._process.args)
+
+
+def _feed(source: SegmentReader, sink: IO[bytes]) -> None:
+    try:
+        for chunk in iter(lambda: source.read(_CHUNK_SIZE), b""):
+            sink.write(chunk)
+    except BrokenPipeError:
+        pass
+    finally:
+        sink.close()
+
+
+def open_decompressor(
+    compression: str, source: SegmentReader, zstd_dictionary: Optional[str] = None
+) -> IO[bytes]:
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=source)  # type: ignore[call-overload]
+    if compression == "bzip2":
+        return bz2.BZ2File(source)  # type: ignore[call-overload]
+    if compression == "xz":
+        return lzma.LZMAFile(source)  # type: ignore[arg-type]
+    if compression == "none":
+        return source  # type: ignore[return-value]
+    argv = shlex.split(DECOMPRESS_COMMANDS[compression])
+    if zstd_dictionary and compression == "zstd":
+        argv.extend(["-D", zstd_dictionary])
+    return _DecompressorProcess(argv, source)  # type: ignore[return-value]
+
+
+@dataclass
+class Entry:
+    """The accumulated size of a group of archive members."""
+
+    name: str
+    files: int = 0
+    uncompressed_bytes: int = 0
+    compressed_bytes: int = 0
+
+
+@dataclass
+class Report:
+    compression: str = "none"
+    compressed_bytes: int = 0
+    uncompressed_bytes: int = 0
+    files: int = 0
+    entries: Dict[str, Entry] = field(default_factory=dict)
+    largest_files: List[Tuple[int, str]] = field(default_factory=list)
+
+    def to_json(self) -> dict:
+        return {
+            "compression": self.compression,
+            "compressed_bytes": self.compressed_bytes,
+            "uncompressed_bytes": self.uncompressed_bytes,
+            "files": self.files,
+            "entries": [
+                entry.__dict__
+                for entry in sorted(
+                    self.entries.values(), key=lambda entry: (-entry.compressed_bytes, entry.name)
+                )
+            ],
+            "largest_files": [
+                {"path": path, "bytes": size}
+                for size, path in sorted(self.largest_files, reverse=True)
+            ],
+        }
+
+
+def _group(path: str, groups: Dict[str, str]) -> str:
+    for prefix, name in groups.items():
+        if path == prefix or path.startswith(f"{prefix}/"):
+            return name
+    return path.split("/", 1)[0]
+
+
+def inspect_archive(
+    fp: BinaryIO, groups: Dict[str, str], largest: int, archive_dir: str = os.curdir
+) -> Report:
+    """Account for every member of the archive.
+
+    Members are grouped by the first of `groups` (path -> name) containing them, otherwise by
+    their top-level entry. The compressed size of a member is estimated from how far the
+    decompressor had read when `tarfile` reached the next member, so it lags behind by what the
+    decompressor buffers: a block for the binary decompressors, e.g. up to 4 MiB for lz4.
+
+    The zstd dictionary of the archive, if it was compressed with one, is read from
+    `archive_dir`.
+    """
+    layout = parse_header(fp)
+    zstd_dictionary = layout.variables.get("zdict")
+    report = Report()
+    for offset, size in layout.segments():
+        source = SegmentReader(fp, offset, size)
+        report.compression = detect_compression(source.peek(8))
+        report.compressed_bytes += size
+        decompressed = open_decompressor(
+            report.compression,
+            source,
+            os.path.join(archive_dir, zstd_dictionary) if zstd_dictionary else None,
+        )
+        previous: Optional[Entry] = None
+        attributed = 0
+        with tarfile.open(fileobj=decompressed, mode="r|") as tar:
+            for member in tar:
+                if previous is not None:
+                    previous.compressed_bytes += source.consumed - attributed
+                    attributed = source.consumed
+                    previous = None
+                path = member.name[2:] if member.name.startswith("./") else member.name
+                if not member.isfile() or not path:
+                    continue
+                name = _group(path, groups)
+                entry = report.entries.setdefault(name, Entry(name))
+                entry.files += 1
+                entry.uncompressed_bytes += member.size
+                report.files += 1
+                report.uncompressed_bytes += member.size
+                if largest:
+                    heapq.heappush(report.largest_files, (member.size, path))
+                    if len(report.largest_files) > largest:
+                        heapq.heappop(report.largest_files)
+                previous = entry
+        if decompressed is not source:
+            decompressed.close()
+        if previous is not None:
+            # The end of the tar stream, padding included, goes with the last member.
+            previous.compressed_bytes += size - attributed
+    return report
+
+
+def extract_members(fp: BinaryIO) -> Iterator[Tuple[tarfile.TarInfo, Optional[bytes]]]:
+    """Yield every member of the archive along with the content of the regular files.
+
+    Unlike `inspect_archive`, this never runs a decompressor binary: payloads compressed with a
+    codec the standard library doesn't provide raise `ValueError`.
+    """
+    layout = parse_header(fp)
+    for offset, size in layout.segments():
+        source = SegmentReader(fp, offset, size)
+        compression = detect_compression(source.peek(8))
+        if compression not in _STDLIB_COMPRESSIONS:
+            raise ValueError(f"Cannot extract a {compression} payload with the standard library.")
+        decompressed = open_decompressor(compression, source)
+        with tarfile.open(fileobj=decompressed, mode="r|") as tar:
+            for member in tar:
+                content = tar.extractfile(member) if member.isfile() else None
+                yield member, content.read() if content else None
+        if decompressed is not source:
+            decompressed.close()
+
+
+@contextmanager
+def _open_archive(paths: List[str]) -> Iterator[BinaryIO]:
+    """Open the archive, joining it into a temporary file first if it is split in volumes."""
+    if len(paths) == 1:
+        with open(paths[0], "rb") as fp:
+            yield fp
+        return
+    with tempfile.TemporaryFile() as joined:
+        for path in paths:
+            with open(path, "rb") as volume:
+                shutil.copyfileobj(volume, joined, _CHUNK_SIZE)
+        joined.seek(0)
+        yield joined
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--group",
+        action="append",
+        default=[],
+        metavar="NAME=PATH",
+        help="Account for the members under PATH as NAME instead of their top-level entry.",
+    )
+    parser.add_argument("--largest", type=int, default=10)
+    parser.add_argument(
+        "archive", nargs="+", help="The archive, or every volume of an archive split in volumes."
+    )
+    options = parser.parse_args(argv)
+
+    groups = {path: name for name, path in (group.split("=", 1) for group in options.group)}
+    with _open_archive(options.archive) as fp:
+        report = inspect_archive(
+            fp, groups, options.largest, os.path.dirname(options.archive[0]) or os.curdir
+        )
+    json.dump(report.to_json(), sys.stdout)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,124 @@
+import io
+import json
+import os
+from pathlib import Path
+
+import pytest
+from pants_backend_makeself import writer
+from pants_backend_makeself.reader import (
+    detect_compression,
+    extract_members,
+    inspect_archive,
+    main,
+    parse_header,
+)
+from pants_backend_makeself.volumes import split_archive
+
+
+def _write(tmp_path: Path, compression: str, *options: str) -> Path:
+    root = tmp_path / "__archive"
+    (root / "src.python").mkdir(parents=True)
+    (root / "src.python" / "app.pex").write_bytes(os.urandom(256 * 1024))
+    (root / "data").mkdir()
+    (root / "data" / "a.txt").write_text("a\n" * 1024)
+    (root / "data" / "b.txt").write_text("b\n")
+    (root / "run.sh").write_text("#!/bin/sh\n")
+    archive = tmp_path / "test.run"
+    writer.main(
+        [
+            "--output",
+            str(archive),
+            "--label",
+            "test archive",
+            "--script",
+            "./run.sh",
+            "--compression",
+            compression,
+            *options,
+            str(root),
+        ]
+    )
+    return archive
+
+
+@pytest.mark.parametrize("compression", ["gzip", "bzip2", "xz", "zstd", "none"])
+def test_inspect_archive(tmp_path: Path, compression: str) -> None:
+    archive = _write(tmp_path, compression)
+    with archive.open("rb") as fp:
+        report = inspect_archive(fp, {"src.python/app.pex": "//src/python:app"}, largest=2)
+
+    assert report.compression == compression
+    assert report.files == 4
+    assert report.uncompressed_bytes == 256 * 1024 + 2048 + 2 + 10
+    entries = {entry.name: entry for entry in report.entries.values()}
+    assert set(entries) == {"//src/python:app", "data", "run.sh"}
+    assert entries["//src/python:app"].uncompressed_bytes == 256 * 1024
+    assert (entries["data"].files, entries["data"].uncompressed_bytes) == (2, 2050)
+    assert sum(entry.compressed_bytes for entry in entries.values()) == report.compressed_bytes
+    assert [path for _, path in sorted(report.largest_files, reverse=True)] == [
+        "src.python/app.pex",
+        "data/a.txt",
+    ]
+
+
+def test_parse_header(tmp_path: Path) -> None:
+    archive = _write(tmp_path, "gzip")
+    data = archive.read_bytes()
+    layout = parse_header(io.BytesIO(data))
+
+    assert layout.variables["label"] == "test archive"
+    assert layout.offset + sum(layout.filesizes) == len(data)
+    assert detect_compression(data[layout.offset :]) == "gzip"
+
+
+def test_parse_header_rejects_other_files() -> None:
+    with pytest.raises(ValueError):
+        parse_header(io.BytesIO(b"#!/bin/sh\necho hello\n"))
+
+
+def test_main_joins_volumes(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    archive = _write(tmp_path, "gzip")
+    output_dir = tmp_path / "dist"
+    output_dir.mkdir()
+    volumes = split_archive(str(archive), str(output_dir), 64 * 1024)
+
+    main([str(output_dir / volume) for volume in volumes])
+    report = json.loads(capsys.readouterr().out)
+    assert report["files"] == 4
+    with archive.open("rb") as fp:
+        assert report["compressed_bytes"] == sum(parse_header(fp).filesizes)
+
+
+def test_main_reads_zstd_dictionary_next_to_archive(
+    tmp_path: Path, capsys: pytest.CaptureFixture
+) -> None:
+    # zstd uses any file which isn't a trained dictionary as raw content.
+    dictionary = tmp_path / "test.zdict"
+    dictionary.write_bytes(b"a\n" * 1024)
+    archive = _write(tmp_path, "zstd", "--zstd-dictionary", str(dictionary))
+    output_dir = tmp_path / "dist"
+    output_dir.mkdir()
+    (output_dir / archive.name).write_bytes(archive.read_bytes())
+    (output_dir / dictionary.name).write_bytes(dictionary.read_bytes())
+
+    main([str(output_dir / archive.name)])
+    report = json.loads(capsys.readouterr().out)
+    assert report["compression"] == "zstd"
+    assert report["files"] == 4
+
+
+def test_extract_members(tmp_path: Path) -> None:
+    archive = _write(tmp_path, "xz")
+    with archive.open("rb") as fp:
+        members = {member.name: (member, content) for member, content in extract_members(fp)}
+
+    member, content = members["./data/a.txt"]
+    assert member.isfile() and content == b"a\n" * 1024
+    member, content = members["./data"]
+    assert member.isdir() and content is None
+
+
+def test_extract_members_needs_stdlib_codec(tmp_path: Path) -> None:
+    archive = _write(tmp_path, "zstd")
+    with archive.open("rb") as fp, pytest.raises(ValueError, match="zstd"):
+        list(extract_members(fp))
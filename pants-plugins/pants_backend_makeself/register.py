@@ -1,15 +1,16 @@
 from . import makeself, system_binaries
-from .goals import package, run
-from .target_types import MakeselfArchiveTarget
+from .goals import makeself_inspect, package, run
+from .target_types import MakeselfArchiveTarget, MakeselfZstdDictionaryTarget
 
 
 def target_types():
-    return [MakeselfArchiveTarget]
+    return [MakeselfArchiveTarget, MakeselfZstdDictionaryTarget]
 
 
 def rules():
     return [
         *makeself.rules(),
+        *makeself_inspect.rules(),
         *package.rules(),
         *run.rules(),
         *system_binaries.rules(),
@@ -0,0 +1,82 @@
+"""Estimates how well a payload compresses from chunks sampled across it.
+
+Chunks are spread evenly over the files below the given roots, taken in path order, and each is
+compressed on its own with the standard library codecs to measure their ratio. Only sizes are
+measured, never time, so the same payload gets the same report on any machine. Run as
+`python -m pants_backend_makeself.sample`, it prints a JSON report and only depends on the
+standard library.
+"""
+import argparse
+import gzip
+import json
+import lzma
+import os
+import sys
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# The fast and the strong codec considered by `auto` compression, at the levels archives are
+# written with when `compression_level` is unset: `gzip -9` and `xz -6`. The gzip header embeds
+# the time, which doesn't change its size.
+CODECS: Dict[str, Callable[[bytes], bytes]] = {
+    "gzip": lambda data: gzip.compress(data, compresslevel=9),
+    "xz": lambda data: lzma.compress(data, preset=6),
+}
+
+
+def _files(roots: List[str]) -> Iterator[Tuple[str, int]]:
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+            dirnames.sort()
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                yield path, os.path.getsize(path)
+
+
+def sample_chunks(roots: List[str], sample_size: int, chunk_size: int) -> Iterator[bytes]:
+    """Yield up to `sample_size` bytes, in chunks spread evenly over the files of `roots`."""
+    files = list(_files(roots))
+    total = sum(size for _, size in files)
+    count = max(1, min(sample_size, total) // chunk_size)
+    stride = max(chunk_size, total // count)
+    # Offsets are taken in the concatenation of all the files, the chunks stop at file ends.
+    offset = next_offset = 0
+    for path, size in files:
+        with open(path, "rb") as fp:
+            while next_offset < offset + size:
+                fp.seek(next_offset - offset)
+                chunk = fp.read(chunk_size)
+                if chunk:
+                    yield chunk
+                next_offset += stride
+        offset += size
+
+
+def sample_payload(roots: List[str], sample_size: int, chunk_size: int) -> Dict:
+    """The compression ratio of every codec of `CODECS` on a sample of `roots`."""
+    compressed = dict.fromkeys(CODECS, 0)
+    sampled = 0
+    for chunk in sample_chunks(roots, sample_size, chunk_size):
+        sampled += len(chunk)
+        for codec, compress in CODECS.items():
+            compressed[codec] += len(compress(chunk))
+    return {
+        "sampled_bytes": sampled,
+        "codecs": {
+            codec: {"ratio": size / sampled if sampled else 1.0}
+            for codec, size in compressed.items()
+        },
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sample-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--chunk-size", type=int, default=128 * 1024)
+    parser.add_argument("roots", nargs="+")
+    options = parser.parse_args(argv)
+
+    json.dump(sample_payload(options.roots, options.sample_size, options.chunk_size), sys.stdout)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
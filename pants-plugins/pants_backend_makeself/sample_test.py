@@ -0,0 +1,27 @@
+import os
+from pathlib import Path
+
+from pants_backend_makeself.sample import sample_chunks, sample_payload
+
+
+def test_sample_chunks_spread_over_files(tmp_path: Path) -> None:
+    for name in ("a", "b", "c", "d"):
+        (tmp_path / name).write_bytes(name.encode() * 1024)
+
+    chunks = list(sample_chunks([str(tmp_path)], 1024, 256))
+    assert chunks == [b"a" * 256, b"b" * 256, b"c" * 256, b"d" * 256]
+
+
+def test_sample_payload_tells_compressed_data_apart(tmp_path: Path) -> None:
+    (tmp_path / "text").mkdir()
+    (tmp_path / "text" / "a.txt").write_bytes(b"hello world\n" * 100_000)
+    (tmp_path / "random").mkdir()
+    (tmp_path / "random" / "a.bin").write_bytes(os.urandom(1024 * 1024))
+
+    text = sample_payload([str(tmp_path / "text")], 512 * 1024, 64 * 1024)
+    random = sample_payload([str(tmp_path / "random")], 512 * 1024, 64 * 1024)
+    assert text["sampled_bytes"] == random["sampled_bytes"] == 512 * 1024
+    assert text["codecs"]["gzip"]["ratio"] < 0.05
+    assert random["codecs"]["gzip"]["ratio"] > 0.99
+    assert random["codecs"]["xz"]["ratio"] > 0.99
+    assert sample_payload([str(tmp_path / "text")], 512 * 1024, 64 * 1024) == text
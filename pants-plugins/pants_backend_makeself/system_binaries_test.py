@@ -0,0 +1,47 @@
+import pytest
+from pants.core.util_rules.system_binaries import BinaryNotFoundError, BinaryPath
+from pants.testutil.rule_runner import QueryRule, RuleRunner
+from pants.util.frozendict import FrozenDict
+from pants_backend_makeself import system_binaries
+from pants_backend_makeself.system_binaries import MakeselfBinaries
+
+
+def _binaries(*names: str) -> MakeselfBinaries:
+    return MakeselfBinaries(
+        search_path=("/usr/bin", "/bin"),
+        paths=FrozenDict({name: BinaryPath(f"/usr/bin/{name}") for name in names}),
+    )
+
+
+def test_require_missing_binary() -> None:
+    binaries = _binaries("gzip", "tar")
+
+    assert binaries.require("tar", "gzip", rationale="extract") == (
+        BinaryPath("/usr/bin/tar"),
+        BinaryPath("/usr/bin/gzip"),
+    )
+    assert binaries.find("zstd") is None
+    with pytest.raises(BinaryNotFoundError, match=r"`zstd`.*so that Pants can compress"):
+        binaries.require("tar", "zstd", rationale="compress")
+
+
+def test_require_any_falls_back() -> None:
+    binaries = _binaries("sha256sum", "shasum")
+
+    assert binaries.require_any("md5sum", "sha256sum", "shasum", rationale="hash") == BinaryPath(
+        "/usr/bin/sha256sum"
+    )
+    with pytest.raises(BinaryNotFoundError, match=r"any of `md5sum`, `cksum`"):
+        binaries.require_any("md5sum", "cksum", rationale="hash")
+
+
+def test_find_makeself_binaries() -> None:
+    rule_runner = RuleRunner(
+        rules=[*system_binaries.rules(), QueryRule(MakeselfBinaries, [])],
+    )
+
+    binaries = rule_runner.request(MakeselfBinaries, [])
+    (bash,) = binaries.require("bash", rationale="test")
+    assert bash.path.endswith("/bash")
+    assert bash.fingerprint
+    assert set(binaries.paths) <= set(system_binaries.MAKESELF_BINARIES)
@@ -1,15 +1,58 @@
+from enum import Enum
+from typing import Dict, Iterable, Optional, Tuple
+
 from pants.core.goals.package import OutputPathField
+from pants.engine.addresses import Address
 from pants.engine.target import (
     COMMON_TARGET_FIELDS,
+    BoolField,
+    DictStringToStringField,
+    IntField,
+    InvalidFieldException,
     SingleSourceField,
     SpecialCasedDependencies,
     StringField,
+    StringSequenceField,
     Target,
+    ValidNumbers,
 )
 from pants.util.docutil import bin_name
+from pants.util.frozendict import FrozenDict
 from pants.util.strutil import help_text
 
 
+class MakeselfCompression(Enum):
+    GZIP = "gzip"
+    PIGZ = "pigz"
+    ZSTD = "zstd"
+    XZ = "xz"
+    LZ4 = "lz4"
+    LZO = "lzo"
+    BZIP2 = "bzip2"
+    BZIP3 = "bzip3"
+    NONE = "none"
+    # Resolved to one of the others when packaging, see `MakeselfArchiveCompressionField`.
+    AUTO = "auto"
+
+
+class MakeselfIntegrity(Enum):
+    MD5_CRC = "md5_crc"
+    SHA256 = "sha256"
+    MD5 = "md5"
+    CRC = "crc"
+    NONE = "none"
+
+
+class MakeselfEngine(Enum):
+    MAKESELF = "makeself"
+    PYTHON = "python"
+
+
+class MakeselfPexLayout(Enum):
+    ZIPAPP = "zipapp"
+    LOOSE = "loose"
+
+
 class MakeselfArthiveLabel(StringField):
     alias = "label"
 
@@ -57,6 +100,293 @@ class MakeselfArchivePackagesField(SpecialCasedDependencies):
 
         You can include anything that can be built by `{bin_name()} package`,
         e.g. a `pex_binary`, `python_awslambda`, or even another `makeself_archive`.
+
+        Another `makeself_archive` isn't compressed twice: its payload is merged into the
+        `<name>` directory next to where `<name>.run` would be, and `<name>.run`, along with
+        its variants, is a script running its startup script from there.
+        """
+    )
+
+
+class _MakeselfArchiveGlobsField(StringSequenceField):
+    @classmethod
+    def compute_value(
+        cls, raw_value: Optional[Iterable[str]], address: Address
+    ) -> Optional[Tuple[str, ...]]:
+        value = super().compute_value(raw_value, address)
+        for glob in value or ():
+            if not glob or glob.startswith(("!", "/")):
+                raise InvalidFieldException(
+                    f"The {cls.alias!r} field in target {address} must only contain globs "
+                    f"relative to the archive root, without a `!` prefix, got {glob!r}."
+                )
+        return value
+
+
+class MakeselfArchiveIncludeField(_MakeselfArchiveGlobsField):
+    alias = "include"
+    help = help_text(
+        """
+        Only put the files of `packages` and `files` matching these globs into the archive,
+        e.g. `["src.python/*.pex", "config/**"]`.
+
+        Globs match paths relative to the archive root, as listed by `makeself-inspect`, so a
+        package only matches as a whole. The startup script is always included. How many files
+        and bytes are left out is reported when building the archive.
+        """
+    )
+
+
+class MakeselfArchiveExcludeField(_MakeselfArchiveGlobsField):
+    alias = "exclude"
+    help = help_text(
+        """
+        Leave the files of `packages` and `files` matching these globs out of the archive, e.g.
+        `["**/__pycache__", "**/tests", "**/*.pyi", "**/*.debug"]`.
+
+        A glob matching a directory excludes everything below it. Exclusions apply after
+        `include`, and never to the startup script.
+        """
+    )
+
+
+class MakeselfArchivePexLayoutField(StringField):
+    alias = "pex_layout"
+    valid_choices = MakeselfPexLayout
+    default = MakeselfPexLayout.ZIPAPP.value
+    help = help_text(
+        """
+        How the zipapp PEXes among `packages` are shipped.
+
+        A zipapp PEX extracts itself into `~/.pex` the first time it runs, on top of the archive
+        being extracted. With `loose`, each `<name>.pex` is unpacked into a `<name>.pex.loose`
+        directory when building the archive, and replaced by a launcher running it with the
+        interpreter of the PEX shebang. The PEX then runs in place, without writing to
+        `~/.pex`, and is still started as `./<name>.pex`.
+
+        PEXes built with `execution_mode="venv"` still create their venv on the first run.
+        """
+    )
+
+
+class MakeselfArchiveCompressionField(StringField):
+    alias = "compression"
+    valid_choices = MakeselfCompression
+    help = help_text(
+        """
+        Compression used for the archive payload.
+
+        Only the binary for the chosen codec is required on the machine building the archive,
+        and its decompressor on the machine extracting it.
+
+        With `auto`, chunks sampled across the payload are compressed with `gzip -9` and
+        `xz -6` to measure their ratio, and whichever of `none`, `gzip` and `xz` costs the
+        least is used. The cost weighs the build time against the time to ship and extract the
+        archive, from the sampled ratios and fixed reference speeds of each codec, see the
+        `[makeself].auto_compression_*` options. The same payload thus always gets the same
+        codec. Payloads made of already compressed data, like PEX files or images, then aren't
+        compressed again. These levels are used, whatever `compression_level` is.
+
+        If unset, falls back to `[makeself].compression`.
+        """
+    )
+
+
+class MakeselfArchiveCompressionLevelField(IntField):
+    alias = "compression_level"
+    help = help_text(
+        """
+        Compression level passed to the codec, e.g. `19` for `zstd` or `9` for `xz`.
+
+        If unset, falls back to `[makeself].compression_level`.
+        """
+    )
+
+
+class MakeselfArchiveLayeredField(BoolField):
+    alias = "layered"
+    default = False
+    help = help_text(
+        """
+        Compress the startup script, each of `packages` and each of `files` into its own
+        payload segment instead of compressing everything in one go.
+
+        Every segment is cached on its own, so changing one package only recompresses that
+        package and the final archive is the header followed by the cached segments. The
+        trade-off is a slightly worse compression ratio, as the codec can't share context
+        between segments.
+        """
+    )
+
+
+class MakeselfArchiveParallelDecompressionField(BoolField):
+    alias = "parallel_decompression"
+    default = False
+    help = help_text(
+        """
+        Make the archive decompress on several threads when it is extracted, if the machine
+        running it has a multithreaded decompressor for its codec: `pigz` for `gzip` and `pigz`,
+        `pzstd` for `zstd`, `xz` 5.4 or later for `xz` and `lbzip2` for `bzip2`. Otherwise the
+        archive falls back to the usual single threaded decompressor.
+
+        The number of threads is the number of processors, unless set with `--threads` or the
+        `SETUP_THREADS` environment variable. `zstd` archives only decompress in parallel when
+        they were compressed by `pzstd`, and `xz` archives when they were compressed on several
+        threads.
+
+        Only archives written by the `python` engine or `layered` support it.
+        """
+    )
+
+
+class MakeselfArchiveInstallDirField(StringField):
+    alias = "install_dir"
+    help = help_text(
+        """
+        Extract the archive only once, into a subdirectory of this directory named after a hash
+        of the payload, and start later runs straight from there.
+
+        Environment variables are expanded when the archive runs, e.g. `$HOME/.cache/app`. The
+        payload is extracted into a staging directory which is only renamed into place once
+        complete, so concurrent first runs are safe and interrupted ones are cleaned up by the
+        next run. `--target` and `--keep` still extract to the given directory instead.
+
+        Only archives written by the `python` engine or `layered` support it.
+        """
+    )
+
+
+class MakeselfArchiveDeduplicateField(BoolField):
+    alias = "deduplicate"
+    default = False
+    help = help_text(
+        """
+        Store files with the same content, e.g. the same wheel or shared library in several
+        packages, only once in the archive. The copies are extracted as hardlinks to the same
+        file, so writing to one of them at runtime changes all of them.
+
+        The `python` engine stores them as tar hardlinks, `layered` archives leave them out of
+        their segments and link them once extracted. The `makeself` engine doesn't support it.
+        """
+    )
+
+
+class MakeselfArchiveZstdDictionaryField(StringField):
+    alias = "zstd_dictionary"
+    help = help_text(
+        """
+        Address of a `makeself_zstd_dictionary` target to compress the payload with, e.g.
+        `"agents:dictionary"`. Only used with the `zstd` compression.
+
+        Small archives with similar contents compress much better with a dictionary trained on
+        them. The dictionary isn't embedded in the archive: it is packaged next to it, and the
+        archive looks it up in the `:` separated directories of `SETUP_ZSTD_DICTIONARY_PATH`,
+        then next to itself, when it is extracted. Ship it along with the archives, once per
+        machine. Archives always decompress on a single thread with a dictionary.
+
+        Only archives written by the `python` engine or `layered` support it.
+        """
+    )
+
+
+class MakeselfArchiveEngineField(StringField):
+    alias = "engine"
+    valid_choices = MakeselfEngine
+    help = help_text(
+        """
+        How the archive is written.
+
+        `makeself` runs the upstream `makeself.sh`, which copies the payload, tars it, compresses
+        it and checksums it in separate passes. `python` tars, compresses and checksums the
+        payload in a single streaming pass and prepends an equivalent header, so only `python3`
+        (and the codec binary, unless it's `gzip`, `bzip2` or `xz`) is needed on the machine
+        building the archive.
+
+        If unset, falls back to `[makeself].engine`.
+        """
+    )
+
+
+class MakeselfArchiveIntegrityField(StringField):
+    alias = "integrity"
+    valid_choices = MakeselfIntegrity
+    help = help_text(
+        """
+        Checksums stored in the archive and verified before it is extracted.
+
+        `md5_crc` is makeself's default. `sha256`, `md5` and `crc` store only that checksum, and
+        `none` skips the verification altogether. Every checksum is one more pass over the
+        payload, both when building the archive and every time it starts.
+
+        If unset, falls back to `[makeself].integrity`.
+        """
+    )
+
+
+class MakeselfArchiveVariantsField(DictStringToStringField):
+    alias = "variants"
+    help = help_text(
+        """
+        More archives to write with the same payload, as a mapping of a variant name to the
+        command run after extraction instead of `startup_script`, e.g.
+        `{"migrate": "./src/app/run.sh migrate", "shell": "bash"}`.
+
+        The payload is only compressed once: every variant is a copy of the archive with another
+        command in its header, written next to it as `<name>-<variant>.run`.
+        """
+    )
+
+    @classmethod
+    def compute_value(
+        cls, raw_value: Optional[Dict[str, str]], address: Address
+    ) -> Optional[FrozenDict[str, str]]:
+        value = super().compute_value(raw_value, address)
+        for name, command in (value or {}).items():
+            if not name or "/" in name or not command.strip():
+                raise InvalidFieldException(
+                    f"The {cls.alias!r} field in target {address} must map names without "
+                    f"`/` to non-empty commands, got {name!r}: {command!r}."
+                )
+        return value
+
+
+class MakeselfArchiveMaxVolumeSizeField(IntField):
+    alias = "max_volume_size"
+    valid_numbers = ValidNumbers.positive_only
+    help = help_text(
+        """
+        Split the archive into volumes of at most this many bytes, numbered
+        `<name>.run.001`, `<name>.run.002` and so on.
+
+        `<name>.run` is then a small script which verifies the checksum of every volume next to
+        it, joins them into a temporary file in `$TMPDIR` and runs that with the same arguments,
+        so extracting takes twice the archive size in temporary space. Every volume is a
+        separate artifact of the package.
+        """
+    )
+
+
+class MakeselfArchiveDeltaFromField(SpecialCasedDependencies):
+    alias = "delta_from"
+    help = help_text(
+        f"""
+        Addresses of previous versions of the archive to write deltas from, e.g.
+        `["releases:app-1.4"]`: `file` targets, e.g. downloaded with `http_source`, or targets
+        built with `{bin_name()} package` whose first artifact is the previous archive.
+
+        Every delta is written next to the archive as `<name>.run.from-<sha>.delta`, where
+        `<sha>` starts the SHA256 of the previous archive. Running
+        `sh <delta> PREVIOUS_ARCHIVE [OUTPUT]` on a host which has the previous archive verifies
+        it, rebuilds the new archive, by default next to the delta, and verifies it too. This
+        needs `zstd`, `sha256sum` or `shasum` on that host.
+
+        Parts of the archive, its header and payload segments, found unchanged in the previous
+        version are copied from it. Others are patched with `zstd --patch-from`, 256 MiB at a
+        time against the same region of the previous version, which takes about 2 GiB of memory.
+        Compressed `zstd` streams resynchronize soon after a change, while `gzip`, `bzip2` or `xz`
+        ones differ from there on, so use it with the `zstd` or `none` compression, and with
+        `layered` archives to copy the packages which didn't change as they are. Deltas are
+        computed before the archive is split into volumes, and rebuild the joined archive.
         """
     )
 
@@ -72,6 +402,21 @@ class MakeselfArchiveTarget(Target):
         MakeselfArchiveStartupScript,
         MakeselfArchiveFilesField,
         MakeselfArchivePackagesField,
+        MakeselfArchiveIncludeField,
+        MakeselfArchiveExcludeField,
+        MakeselfArchivePexLayoutField,
+        MakeselfArchiveCompressionField,
+        MakeselfArchiveCompressionLevelField,
+        MakeselfArchiveLayeredField,
+        MakeselfArchiveParallelDecompressionField,
+        MakeselfArchiveInstallDirField,
+        MakeselfArchiveDeduplicateField,
+        MakeselfArchiveZstdDictionaryField,
+        MakeselfArchiveEngineField,
+        MakeselfArchiveIntegrityField,
+        MakeselfArchiveVariantsField,
+        MakeselfArchiveMaxVolumeSizeField,
+        MakeselfArchiveDeltaFromField,
         MakeselfArchiveOutputPath,
         *COMMON_TARGET_FIELDS,
     )
@@ -81,3 +426,54 @@ class MakeselfArchiveTarget(Target):
         tool.
         """
     )
+
+
+class MakeselfZstdDictionaryArchivesField(SpecialCasedDependencies):
+    alias = "archives"
+    required = True
+    help = help_text(
+        """
+        Addresses of the `makeself_archive` targets to train the dictionary on, e.g.
+        `["agents/billing", "agents/search"]`.
+
+        The training samples are the files of their payloads, as they are put into the archives,
+        so the archives themselves aren't built. This will ignore any targets that are not
+        `makeself_archive` targets.
+        """
+    )
+
+
+class MakeselfZstdDictionaryMaxSizeField(IntField):
+    alias = "max_size"
+    default = 112640
+    valid_numbers = ValidNumbers.positive_only
+    help = help_text(
+        """
+        Maximum size of the dictionary in bytes. zstd recommends training on at least 10 times,
+        and preferably 100 times, as many bytes.
+        """
+    )
+
+
+class MakeselfZstdDictionaryOutputPath(OutputPathField):
+    pass
+
+
+class MakeselfZstdDictionaryTarget(Target):
+    alias = "makeself_zstd_dictionary"
+    core_fields = (
+        MakeselfZstdDictionaryArchivesField,
+        MakeselfZstdDictionaryMaxSizeField,
+        MakeselfZstdDictionaryOutputPath,
+        *COMMON_TARGET_FIELDS,
+    )
+    help = help_text(
+        """
+        A zstd dictionary trained on the payloads of `makeself_archive` targets, for the
+        `zstd_dictionary` field of small archives with similar contents.
+
+        The dictionary is versioned by an ID derived from its training samples, which is part of
+        its file name, e.g. `dictionary-1234567890.zdict`: archives compressed with a previous
+        version keep decompressing with it, as long as it is still shipped.
+        """
+    )
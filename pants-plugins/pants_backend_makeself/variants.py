@@ -0,0 +1,54 @@
+"""Writes variants of a makeself archive which only differ in their startup command.
+
+The payload of the archive is copied as is, so the variants share its compression and checksums.
+Run as `python -m pants_backend_makeself.variants`, it only depends on the standard library.
+"""
+import argparse
+import os
+import shlex
+import shutil
+import sys
+from typing import List, Optional
+
+from pants_backend_makeself.header import replace_variables
+from pants_backend_makeself.reader import parse_header
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def write_variant(archive: str, output: str, command: str) -> None:
+    """Copy `archive` to `output`, running `command` after extraction instead."""
+    script, *scriptargs = shlex.split(command)
+    with open(archive, "rb") as source:
+        layout = parse_header(source)
+        source.seek(0)
+        header = replace_variables(
+            source.read(layout.offset),
+            script=script,
+            scriptargs=" ".join(map(shlex.quote, scriptargs)),
+        )
+        with open(output, "wb") as sink:
+            sink.write(header)
+            shutil.copyfileobj(source, sink, _CHUNK_SIZE)
+    os.chmod(output, 0o755)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--variant",
+        action="append",
+        default=[],
+        metavar="OUTPUT=COMMAND",
+        help="Write a copy of the archive to OUTPUT which runs COMMAND after extraction.",
+    )
+    parser.add_argument("archive")
+    options = parser.parse_args(argv)
+
+    for variant in options.variant:
+        output, command = variant.split("=", 1)
+        write_variant(options.archive, output, command)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
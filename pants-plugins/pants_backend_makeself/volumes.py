@@ -0,0 +1,111 @@
+"""Splits makeself archives into volumes of a maximum size.
+
+Every archive is cut into numbered parts, `<archive>.001`, `<archive>.002` and so on, and
+replaced by a small script which verifies the POSIX `cksum` of each part, joins them into a
+temporary file and runs it with the same arguments. Run as
+`python -m pants_backend_makeself.volumes`, it only depends on the standard library.
+"""
+import argparse
+import os
+import shlex
+import sys
+from typing import List, Optional, Tuple
+
+from pants_backend_makeself.writer import Cksum
+
+_CHUNK_SIZE = 1024 * 1024
+
+_WRAPPER = """\
+#!/bin/sh
+# This script was generated by pants-backend-makeself. It joins the volumes listed below, which
+# must sit next to it, into a makeself archive and runs that with the same arguments.
+volumes={volumes}
+cksums={cksums}
+dir=`dirname "$0"`
+nocheck="$SETUP_NOCHECK"
+# `--nocheck` among the makeself options, before `--`, also skips the checksums of the volumes.
+for arg in "$@"; do
+    test x"$arg" = x-- && break
+    test x"$arg" = x--nocheck && nocheck=1
+done
+joined="${{TMPDIR:-/tmp}}/.makeself_volumes.$$"
+: > "$joined" || exit 1
+for volume in $volumes; do
+    sum="${{cksums%% *}}"
+    cksums="${{cksums#* }}"
+    if test x"$nocheck" != x1; then
+        actual=`cksum < "$dir/$volume" | cut -d" " -f1`
+        if test x"$actual" != x"$sum"; then
+            echo "Error in checksums of volume $volume: $actual is different from $sum" >&2
+            rm -f "$joined"
+            exit 2
+        fi
+    fi
+    if ! cat "$dir/$volume" >> "$joined"; then
+        rm -f "$joined"
+        exit 1
+    fi
+done
+# The joined archive looks for its zstd dictionary, if any, next to the volumes.
+SETUP_ZSTD_DICTIONARY_PATH="${{SETUP_ZSTD_DICTIONARY_PATH:+$SETUP_ZSTD_DICTIONARY_PATH:}}$dir"
+export SETUP_ZSTD_DICTIONARY_PATH
+/bin/sh "$joined" "$@"
+res=$?
+rm -f "$joined"
+exit $res
+"""
+
+
+def volume_names(archive: str, count: int) -> Tuple[str, ...]:
+    width = max(3, len(str(count)))
+    return tuple(f"{archive}.{index:0{width}d}" for index in range(1, count + 1))
+
+
+def split_archive(archive: str, output_dir: str, max_size: int) -> Tuple[str, ...]:
+    """Split `archive` into volumes in `output_dir`, next to its wrapper script.
+
+    Returns the names of the volumes.
+    """
+    size = os.path.getsize(archive)
+    names = volume_names(os.path.basename(archive), max(1, -(-size // max_size)))
+    cksums = []
+    with open(archive, "rb") as source:
+        for name in names:
+            cksum = Cksum()
+            remaining = max_size
+            with open(os.path.join(output_dir, name), "wb") as sink:
+                while remaining:
+                    chunk = source.read(min(remaining, _CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    cksum.update(chunk)
+                    sink.write(chunk)
+                    remaining -= len(chunk)
+            cksums.append(str(cksum.digest()))
+
+    wrapper = os.path.join(output_dir, os.path.basename(archive))
+    with open(wrapper, "w") as fp:
+        fp.write(
+            _WRAPPER.format(
+                volumes=shlex.quote(" ".join(names)), cksums=shlex.quote(" ".join(cksums))
+            )
+        )
+    os.chmod(wrapper, 0o755)
+    return names
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--max-size", type=int, required=True)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("archives", nargs="+")
+    options = parser.parse_args(argv)
+
+    for archive in options.archives:
+        output_dir = os.path.join(options.output_dir, os.path.dirname(archive))
+        os.makedirs(output_dir, exist_ok=True)
+        split_archive(archive, output_dir, options.max_size)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
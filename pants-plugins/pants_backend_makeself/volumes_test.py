@@ -0,0 +1,81 @@
+import os
+import re
+import subprocess
+from pathlib import Path
+
+from pants_backend_makeself import writer
+from pants_backend_makeself.volumes import split_archive
+
+
+def _split(tmp_path: Path, max_size: int) -> Path:
+    root = tmp_path / "__archive"
+    root.mkdir()
+    (root / "data.bin").write_bytes(os.urandom(64 * 1024))
+    (root / "run.sh").write_text('#!/bin/sh\necho "$@"\nwc -c < data.bin\n')
+    (root / "run.sh").chmod(0o755)
+    archive = tmp_path / "test.run"
+    writer.main(
+        [
+            "--output",
+            str(archive),
+            "--label",
+            "test archive",
+            "--script",
+            "./run.sh",
+            "--compression",
+            "gzip",
+            str(root),
+        ]
+    )
+    output_dir = tmp_path / "dist"
+    output_dir.mkdir()
+    names = split_archive(str(archive), str(output_dir), max_size)
+
+    assert len(names) == -(-archive.stat().st_size // max_size)
+    assert b"".join((output_dir / name).read_bytes() for name in names) == archive.read_bytes()
+    return output_dir / "test.run"
+
+
+def _run(wrapper: Path, *args: str, **env: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [str(wrapper), *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=wrapper.parent.parent,
+        env={**os.environ, "TMPDIR": str(wrapper.parent.parent), **env},
+        check=False,
+    )
+
+
+def test_volumes_are_joined(tmp_path: Path) -> None:
+    wrapper = _split(tmp_path, 16 * 1024)
+
+    result = _run(wrapper, "--quiet", "--nox11", "--accept", "--", "arg")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == [b"arg", b"65536"]
+    assert [path.name for path in tmp_path.iterdir() if path.name.startswith(".")] == []
+
+
+def test_corrupted_volume_fails_check(tmp_path: Path) -> None:
+    wrapper = _split(tmp_path, 16 * 1024)
+    volume = wrapper.parent / "test.run.002"
+    data = bytearray(volume.read_bytes())
+    data[0] ^= 0xFF
+    volume.write_bytes(bytes(data))
+
+    result = _run(wrapper, "--quiet", "--nox11", "--accept")
+    assert result.returncode == 2
+    assert b"test.run.002" in result.stderr
+
+
+def test_nocheck_skips_checksums(tmp_path: Path) -> None:
+    wrapper = _split(tmp_path, 16 * 1024)
+    script = wrapper.read_text()
+    wrapper.write_text(re.sub(r"^cksums=.*$", "cksums='1 2 3 4 5'", script, flags=re.M))
+
+    result = _run(wrapper, "--quiet", "--nox11", "--accept")
+    assert result.returncode == 2
+
+    result = _run(wrapper, "--nocheck", "--quiet", "--nox11", "--accept", "--", "--nocheck")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == [b"--nocheck", b"65536"]
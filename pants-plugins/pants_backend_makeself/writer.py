@@ -0,0 +1,282 @@
+"""Writes a makeself compatible archive in a single streaming pass.
+
+The payload directory is tarred, compressed and checksummed at once, then the header is prepended.
+Run as `python -m pants_backend_makeself.writer`, it only depends on the standard library and the
+compressor binaries for codecs the standard library doesn't provide.
+"""
+import argparse
+import binascii
+import bz2
+import gzip
+import hashlib
+import lzma
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+from typing import IO, BinaryIO, Dict, Iterator, List, Optional, Tuple, cast
+
+from pants_backend_makeself.header import (
+    INTEGRITY_CHECKSUMS,
+    NO_CRC,
+    NO_MD5,
+    NO_SHA,
+    Segment,
+    compress_command,
+    render_header,
+)
+
+_CHUNK_SIZE = 1024 * 1024
+_BIT_REVERSED = bytes(int(f"{byte:08b}"[::-1], 2) for byte in range(256))
+
+
+class Cksum:
+    """The POSIX `cksum` CRC.
+
+    `cksum` runs the CRC-32 polynomial MSB first, while `binascii.crc32` runs it LSB first. Feeding
+    `binascii.crc32` bit-reversed bytes and reversing its register back gives the same CRC at C
+    speed.
+    """
+
+    def __init__(self) -> None:
+        self._value = 0xFFFFFFFF
+        self._length = 0
+
+    def update(self, data: bytes) -> None:
+        self._value = binascii.crc32(data.translate(_BIT_REVERSED), self._value)
+        self._length += len(data)
+
+    def digest(self) -> int:
+        length = bytearray()
+        remaining = self._length
+        while remaining:
+            length.append(remaining & 0xFF)
+            remaining >>= 8
+        value = binascii.crc32(bytes(length).translate(_BIT_REVERSED), self._value)
+        register = int(f"{value ^ 0xFFFFFFFF:032b}"[::-1], 2)
+        return register ^ 0xFFFFFFFF
+
+
+class ChecksummingWriter:
+    """Writes to `sink` while computing the checksums the header verifies."""
+
+    def __init__(self, sink: BinaryIO, checksums: Tuple[str, ...] = ("md5", "crc")) -> None:
+        self._sink = sink
+        self.size = 0
+        self.cksum = Cksum() if "crc" in checksums else None
+        self.md5 = hashlib.md5() if "md5" in checksums else None
+        self.sha256 = hashlib.sha256() if "sha256" in checksums else None
+
+    def write(self, data: bytes) -> int:
+        self._sink.write(data)
+        self.size += len(data)
+        if self.cksum:
+            self.cksum.update(data)
+        if self.md5:
+            self.md5.update(data)
+        if self.sha256:
+            self.sha256.update(data)
+        return len(data)
+
+    def flush(self) -> None:
+        self._sink.flush()
+
+    def segment(self, usize_kb: int) -> Segment:
+        return Segment(
+            size=self.size,
+            crc=str(self.cksum.digest()) if self.cksum else NO_CRC,
+            md5=self.md5.hexdigest() if self.md5 else NO_MD5,
+            sha256=self.sha256.hexdigest() if self.sha256 else NO_SHA,
+            usize_kb=usize_kb,
+        )
+
+
+class _CompressorProcess:
+    """A compressor binary fed through stdin, its stdout copied to `sink` by a thread."""
+
+    def __init__(self, argv: Tuple[str, ...], sink: ChecksummingWriter) -> None:
+        self._process = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        assert self._process.stdin is not None and self._process.stdout is not None
+        self._stdin = self._process.stdin
+        stdout = self._process.stdout
+        self._copier = threading.Thread(target=lambda: _copy(stdout, sink), daemon=True)
+        self._copier.start()
+
+    def write(self, data: bytes) -> int:
+        return self._stdin.write(data)
+
+    def close(self) -> None:
+        self._stdin.close()
+        self._copier.join()
+        if self._process.wait() != 0:
+            raise subprocess.CalledProcessError(self._process.returncode, self._process.args)
+
+
+def _copy(source: IO[bytes], sink: ChecksummingWriter) -> None:
+    for chunk in iter(lambda: source.read(_CHUNK_SIZE), b""):
+        sink.write(chunk)
+
+
+def open_compressor(
+    compression: str,
+    level: Optional[int],
+    threads: int,
+    sink: ChecksummingWriter,
+    zstd_dictionary: Optional[str] = None,
+) -> IO[bytes]:
+    """A writable stream compressing into `sink`.
+
+    The standard library codecs are used where they exist and a single thread is enough,
+    everything else goes through the codec's binary.
+    """
+    if threads <= 1:
+        if compression == "gzip":
+            return gzip.GzipFile(  # type: ignore[return-value]
+                fileobj=sink, mode="wb", compresslevel=9 if level is None else level, mtime=0
+            )
+        if compression == "bzip2":
+            return bz2.BZ2File(  # type: ignore[return-value]
+                sink, mode="wb", compresslevel=9 if level is None else level
+            )
+        if compression == "xz":
+            return lzma.LZMAFile(  # type: ignore[return-value]
+                cast(IO[bytes], sink), mode="wb", preset=6 if level is None else level
+            )
+    if compression == "none":
+        return sink  # type: ignore[return-value]
+    return _CompressorProcess(  # type: ignore[return-value]
+        compress_command(
+            compression, level, str(threads) if threads > 1 else None, zstd_dictionary
+        ),
+        sink,
+    )
+
+
+def iter_payload(root: str) -> Iterator[Tuple[str, str]]:
+    """Yield `(path, arcname)` for `root` and everything below it, sorted by name."""
+    yield root, "./"
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        dirnames.sort()
+        relpath = os.path.relpath(dirpath, root)
+        for name in sorted(dirnames + filenames):
+            path = os.path.join(dirpath, name)
+            yield path, "./" + os.path.normpath(os.path.join(relpath, name))
+
+
+def normalize(info: tarfile.TarInfo, mtime: int) -> tarfile.TarInfo:
+    """Drop the metadata which differs between machines building the same archive."""
+    info.mtime = mtime
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    info.mode = 0o755 if info.isdir() or info.mode & 0o111 else 0o644
+    return info
+
+
+def _file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def write_payload(
+    root: str,
+    compression: str,
+    level: Optional[int],
+    threads: int,
+    sink: ChecksummingWriter,
+    mtime: Optional[int] = None,
+    deduplicate: bool = False,
+    zstd_dictionary: Optional[str] = None,
+) -> int:
+    """Tar, compress and checksum `root` into `sink`, returning the uncompressed size in KB.
+
+    If `mtime` is set, every member gets it along with normalized ownership and permissions.
+    With `deduplicate`, files with the same content and mode as an earlier one are stored as
+    hardlinks to it, so their content is only compressed once. `zstd_dictionary` is the path
+    of the dictionary a `zstd` payload is compressed with.
+    """
+    usize = 0
+    originals: Dict[Tuple[str, int], str] = {}
+    compressor = open_compressor(compression, level, threads, sink, zstd_dictionary)
+    with tarfile.open(fileobj=compressor, mode="w|", dereference=True) as tar:
+        for path, arcname in iter_payload(root):
+            info = tar.gettarinfo(path, arcname)
+            if mtime is not None:
+                info = normalize(info, mtime)
+            if deduplicate and info.isreg() and info.size:
+                original = originals.setdefault((_file_sha256(path), info.mode), arcname)
+                if original != arcname:
+                    info.type = tarfile.LNKTYPE
+                    info.linkname = original
+                    info.size = 0
+            if info.isreg():
+                usize += info.size
+                with open(path, "rb") as fp:
+                    tar.addfile(info, fp)
+            else:
+                tar.addfile(info)
+    if compressor is not sink:
+        compressor.close()
+    return usize // 1024
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--label", required=True)
+    parser.add_argument("--script", required=True)
+    parser.add_argument("--scriptargs", default="")
+    parser.add_argument("--targetdir", default="makeself")
+    parser.add_argument("--compression", default="gzip")
+    parser.add_argument("--level", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--integrity", choices=sorted(INTEGRITY_CHECKSUMS), default="md5_crc")
+    parser.add_argument("--mtime", type=int, default=None)
+    parser.add_argument("--packaging-date", default="")
+    parser.add_argument("--parallel-decompression", action="store_true")
+    parser.add_argument("--install-dir", default="")
+    parser.add_argument("--install-key", default="")
+    parser.add_argument("--deduplicate", action="store_true")
+    parser.add_argument("--zstd-dictionary", default=None)
+    parser.add_argument("root")
+    options = parser.parse_args(argv)
+
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(options.output))) as payload:
+        sink = ChecksummingWriter(payload, INTEGRITY_CHECKSUMS[options.integrity])
+        usize_kb = write_payload(
+            options.root,
+            options.compression,
+            options.level,
+            options.threads,
+            sink,
+            options.mtime,
+            options.deduplicate,
+            options.zstd_dictionary,
+        )
+        header = render_header(
+            label=options.label,
+            script=options.script,
+            scriptargs=options.scriptargs,
+            segments=[sink.segment(usize_kb)],
+            compression=options.compression,
+            targetdir=options.targetdir,
+            packaging_date=options.packaging_date,
+            parallel_decompression=options.parallel_decompression,
+            install_dir=options.install_dir,
+            install_key=options.install_key,
+            zstd_dictionary=os.path.basename(options.zstd_dictionary or ""),
+        )
+        payload.seek(0)
+        with open(options.output, "wb") as output:
+            output.write(header)
+            shutil.copyfileobj(payload, output, _CHUNK_SIZE)
+    os.chmod(options.output, 0o755)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
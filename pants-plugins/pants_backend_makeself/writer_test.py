@@ -0,0 +1,187 @@
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+from pants_backend_makeself.writer import Cksum, main
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"", b"a", b"hello world\n", bytes(range(256)) * 1000],
+    ids=["empty", "byte", "line", "large"],
+)
+def test_cksum_matches_posix_cksum(data: bytes) -> None:
+    cksum = Cksum()
+    for offset in range(0, len(data), 4096):
+        cksum.update(data[offset : offset + 4096])
+    expected = subprocess.run(["cksum"], input=data, stdout=subprocess.PIPE, check=True)
+    assert str(cksum.digest()) == expected.stdout.split()[0].decode()
+
+
+@pytest.mark.parametrize("compression", ["gzip", "bzip2", "xz", "zstd", "none"])
+def test_written_archive_runs(tmp_path: Path, compression: str) -> None:
+    root = tmp_path / "__archive"
+    (root / "data").mkdir(parents=True)
+    (root / "data" / "a.txt").write_text("a\n")
+    (root / "run.sh").write_text('#!/bin/sh\necho "$@"\ncat data/a.txt\n')
+    (root / "run.sh").chmod(0o755)
+    archive = tmp_path / "test.run"
+
+    main(
+        [
+            "--output",
+            str(archive),
+            "--label",
+            "test archive",
+            "--script",
+            "./run.sh",
+            "--scriptargs",
+            "first",
+            "--compression",
+            compression,
+            str(root),
+        ]
+    )
+
+    result = subprocess.run(
+        [str(archive), "--quiet", "--nox11", "--accept", "--", "second"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=tmp_path,
+        env={**os.environ, "TMPDIR": str(tmp_path)},
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == b"first second\na\n"
+
+    check = subprocess.run([str(archive), "--check"], stdout=subprocess.PIPE, check=False)
+    assert check.returncode == 0
+
+
+@pytest.mark.parametrize("integrity", ["md5_crc", "sha256", "md5", "crc", "none"])
+def test_integrity_checks(tmp_path: Path, integrity: str) -> None:
+    root = tmp_path / "__archive"
+    root.mkdir()
+    (root / "run.sh").write_text("#!/bin/sh\n")
+    archive = tmp_path / "test.run"
+    main(
+        [
+            "--output",
+            str(archive),
+            "--label",
+            "test archive",
+            "--script",
+            "./run.sh",
+            "--compression",
+            "none",
+            "--integrity",
+            integrity,
+            str(root),
+        ]
+    )
+    data = bytearray(archive.read_bytes())
+    data[-1] ^= 0xFF
+    archive.write_bytes(bytes(data))
+
+    check = subprocess.run([str(archive), "--check"], stdout=subprocess.PIPE, check=False)
+    assert check.returncode == (0 if integrity == "none" else 2)
+
+
+def test_deduplicated_files_are_hardlinked(tmp_path: Path) -> None:
+    root = tmp_path / "__archive"
+    for name in ("a", "b"):
+        (root / name).mkdir(parents=True)
+        (root / name / "lib.so").write_bytes(os.urandom(64 * 1024))
+    (root / "c").mkdir()
+    (root / "c" / "lib.so").write_bytes((root / "a" / "lib.so").read_bytes())
+    (root / "run.sh").write_text("#!/bin/sh\n")
+    archives = {}
+    for deduplicate in (False, True):
+        archives[deduplicate] = tmp_path / f"test-{deduplicate}.run"
+        main(
+            [
+                "--output",
+                str(archives[deduplicate]),
+                "--label",
+                "test archive",
+                "--script",
+                "./run.sh",
+                *(["--deduplicate"] if deduplicate else []),
+                str(root),
+            ]
+        )
+
+    sizes = {deduplicate: archive.stat().st_size for deduplicate, archive in archives.items()}
+    assert sizes[False] - sizes[True] > 60 * 1024
+    result = subprocess.run(
+        [str(archives[True]), "--quiet", "--noexec", "--keep", "--target", "out"],
+        stderr=subprocess.PIPE,
+        cwd=tmp_path,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+    out = tmp_path / "out"
+    assert (out / "c" / "lib.so").read_bytes() == (root / "a" / "lib.so").read_bytes()
+    assert (out / "c" / "lib.so").stat().st_ino == (out / "a" / "lib.so").stat().st_ino
+    assert (out / "b" / "lib.so").stat().st_ino != (out / "a" / "lib.so").stat().st_ino
+
+
+def test_zstd_dictionary(tmp_path: Path) -> None:
+    samples = tmp_path / "samples"
+    samples.mkdir()
+    for index in range(32):
+        (samples / f"agent-{index}.yaml").write_text(
+            f"service: agent-{index}\nport: {8000 + index}\nmetrics:\n  enabled: true\n"
+            f"  endpoint: https://metrics.example.com/api/v2/push/agent-{index}\n"
+        )
+    dictionaries = tmp_path / "dictionaries"
+    dictionaries.mkdir()
+    dictionary = dictionaries / "agents-40000.zdict"
+    subprocess.run(
+        ["zstd", "--train", "-q", "-r", str(samples), "-o", str(dictionary), "--dictID=40000"],
+        check=True,
+    )
+    root = tmp_path / "__archive"
+    root.mkdir()
+    (root / "agent.yaml").write_text((samples / "agent-0.yaml").read_text())
+    (root / "run.sh").write_text("#!/bin/sh\ncat agent.yaml\n")
+    (root / "run.sh").chmod(0o755)
+    archive = tmp_path / "out" / "test.run"
+    archive.parent.mkdir()
+    main(
+        [
+            "--output",
+            str(archive),
+            "--label",
+            "test archive",
+            "--script",
+            "./run.sh",
+            "--compression",
+            "zstd",
+            "--zstd-dictionary",
+            str(dictionary),
+            str(root),
+        ]
+    )
+
+    def run(**env: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [str(archive), "--quiet"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=tmp_path,
+            env={**os.environ, "TMPDIR": str(tmp_path), **env},
+            check=False,
+        )
+
+    result = run()
+    assert result.returncode != 0
+    assert b"Cannot find the zstd dictionary agents-40000.zdict" in result.stderr
+    result = run(SETUP_ZSTD_DICTIONARY_PATH=f"/nonexistent:{dictionaries}")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == (root / "agent.yaml").read_bytes()
+    (archive.parent / dictionary.name).write_bytes(dictionary.read_bytes())
+    result = run()
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == (root / "agent.yaml").read_bytes()